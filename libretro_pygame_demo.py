@@ -3,6 +3,7 @@ import sys, time
 import pygame
 
 from retro import core as C
+from snes import pacing
 from retro.video.pygame_output import set_video_refresh_cb
 from retro.audio.pygame_output import set_audio_sample_cb
 
@@ -36,8 +37,15 @@ def main():
 			start = now
 		framecount += 1
 
+	# The core reports its exact frame and sample rates.
+	frame_rate, sample_rate = pacing.core_timing(core)
+
 	set_video_refresh_cb(core, paint_frame)
-	set_audio_sample_cb(core)
+	audio = set_audio_sample_cb(core, frequency=int(round(sample_rate)))
+
+	# Run frames at that rate, in step with the sound card.
+	pacer = pacing.FramePacer(frame_rate)
+	pacer.sync_to_audio(audio)
 
 	pygame.init()
 
@@ -45,6 +53,7 @@ def main():
 	running = True
 	while running:
 		core.run()
+		pacer.wait()
 		for event in pygame.event.get():
 			if event.type == pygame.QUIT:
 				running = False
@@ -3,13 +3,20 @@ import sys, time
 import pygame
 
 from snes import core as C
+from snes import pacing
 from snes.video.pygame_output import set_video_refresh_cb
+from snes.video.presenter import ThreadedPresenter
 from snes.audio.pygame_output import set_audio_sample_cb
 
 framecount = 0.0
 start = time.clock()
 screen = None
 
+# The latest converted frame, handed from the presenter's thread to the main
+# thread, which does all the drawing: SDL expects the display to be used from
+# the thread that created it.
+latest = None
+
 def main():
 	core = C.EmulatedSNES('/usr/lib/libsnes/libsnes-snes9x.so')
 	game_path = sys.argv[1]
@@ -18,10 +25,22 @@ def main():
 		core.load_cartridge_normal(handle.read())
 
 
-	def paint_frame(surf):
-		global screen, framecount, start
+	def keep_frame(surf):
+		global latest
+
+		# The surface isn't touched again until the core's next frame, and
+		# the main thread waits for the presenter before drawing it, so it
+		# can be handed over without copying.
+		latest = surf
+
+	def paint_frame():
+		global screen, framecount, start, latest
 
-		if screen is None:
+		if latest is None:
+			return
+		surf, latest = latest, None
+
+		if screen is None or screen.get_size() != surf.get_size():
 			screen = pygame.display.set_mode(surf.get_size())
 
 		screen.blit(surf, (0,0))
@@ -35,17 +54,34 @@ def main():
 			start = now
 		framecount += 1
 
-	set_video_refresh_cb(core, paint_frame)
-	set_audio_sample_cb(core)
-
 	pygame.init()
 
+	# Frames are converted on a background thread, while the main thread
+	# waits for the next frame to be due.
+	presenter = ThreadedPresenter(core)
+	set_video_refresh_cb(presenter, keep_frame)
+	audio = set_audio_sample_cb(core)
+
+	# Run frames at the console's exact frame rate, in step with the sound
+	# card.
+	pacer = pacing.FramePacer(pacing.core_timing(core)[0])
+	pacer.sync_to_audio(audio)
+
 	# run each frame until closed.
 	running = True
-	while running:
-		core.run()
-		for event in pygame.event.get():
-			if event.type == pygame.QUIT:
-				running = False
+	try:
+		while running:
+			core.run()
+			pacer.wait()
+
+			# Draw the frame that was just run.
+			presenter.wait()
+			paint_frame()
+
+			for event in pygame.event.get():
+				if event.type == pygame.QUIT:
+					running = False
+	finally:
+		presenter.close()
 
 if __name__ == "__main__": main()
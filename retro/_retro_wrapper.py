@@ -7,6 +7,26 @@ import ctypes
 from retro import exceptions as EX
 from retro.globals import *
 
+
+def _environment(cmd, data):
+	"""
+	Answer a libretro core's questions about what the frontend supports.
+
+	Returns True if the command was understood.
+	"""
+	if cmd == ENVIRONMENT_GET_CAN_DUPE:
+		# Our video outputs all understand a NULL frame to mean "the same as
+		# the last one", so cores needn't hand us a copy of it.
+		ctypes.cast(data, ctypes.POINTER(ctypes.c_bool))[0] = True
+		return True
+
+	return False
+
+# This doesn't refer to any particular library, so one wrapper can be shared
+# between them all (and it must stay alive as long as any of them do).
+_environment_wrapper = retro_environment_t(_environment)
+
+
 class LowLevelWrapper(object):
 	_lib_active = False
 
@@ -99,6 +119,10 @@ class LowLevelWrapper(object):
 		self._lib.retro_get_memory_size.restype = ctypes.c_size_t
 		self._lib.retro_get_memory_size.argtypes = [ctypes.c_uint]
 
+		# Cores may ask about the environment as soon as they start, so it
+		# has to be set up before retro_init().
+		self._lib.retro_set_environment(_environment_wrapper)
+
 		# Now that we've configured our library, we can start it up.
 		self._lib.retro_init()
 
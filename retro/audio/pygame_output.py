@@ -1,58 +1,29 @@
 """
-Pygame output for SNES Audio.
+Pygame output for libretro audio.
 """
 
-import pygame, numpy, struct
+from snes.audio.pygame_output import PygameAudioOutput, \
+		SNES_OUTPUT_FREQUENCY, DEFAULT_LATENCY, DEFAULT_BUFFER_BLOCKS, \
+		DEFAULT_DEVICE_FREQUENCY
 
-SNES_OUTPUT_FREQUENCY = 32040 # Hz
-
-sndstruct = struct.Struct('<hh')
-sndlog = ''
-
-def set_audio_sample_cb(core, callback=pygame.mixer.Sound.play):
+def set_audio_sample_cb(core, latency=DEFAULT_LATENCY,
+		buffer_blocks=DEFAULT_BUFFER_BLOCKS, frequency=SNES_OUTPUT_FREQUENCY,
+		device_frequency=DEFAULT_DEVICE_FREQUENCY):
 	"""
-	Sets the callback that will handle updated audio samples.
+	Plays libretro audio through pygame.
 
-	Unlike core.EmulatedSNES.set_audio_sample_cb, the callback passed to this
-	function should accept only one parameter:
+	"frequency" is the sample rate of the core's audio. It defaults to the
+	SNES' rate, which is right for libretro SNES implementations.
 
-		"snd" is an instance of pygame.mixer.Sound containing the last 512
-		samples.
+	"latency", "buffer_blocks" and "device_frequency" are passed to
+	snes.audio.pygame_output.PygameAudioOutput.
 
-	If no callback function is provided, the default implementation of
-	snd.play() is used.
+	Returns the PygameAudioOutput instance used to play the audio.
 	"""
+	# Unlike libsnes, libretro hands us properly signed samples.
+	res = PygameAudioOutput(latency, buffer_blocks, typecode='h',
+			frequency=frequency, device_frequency=device_frequency)
 
-	# HACK: pygame 1.9.3 seems to have removed Sound.get_buffer()...
-	core.set_audio_sample_cb(lambda *args: None)
-	return
-
-	# init pygame sound.  snes freq is 32000, 16bit unsigned stereo.
-	pygame.mixer.init(
-		frequency=SNES_OUTPUT_FREQUENCY,
-		size=16, channels=2, buffer=512
-	)
-
-	snd = pygame.sndarray.make_sound(
-			numpy.zeros( (512, 2), dtype='int16', order='C' )
-		)
-	sndbuf = snd.get_buffer()
-
-	def wrapper(left, right):
-		global sndlog, sndstruct
-		sndlog += sndstruct.pack(left, right)
-
-		if len(sndlog) >= 512*2*2: # 512 stereo samples of 16-bits each
-			# this try-except block works around a bug in pygame 1.9.1 on 64-bit hosts.
-			# http://archives.seul.org/pygame/users/Apr-2011/msg00069.html
-			# https://bitbucket.org/pygame/pygame/issue/109/bufferproxy-indexerror-exception-thrown
-			try:
-				sndbuf.write(sndlog, 0)
-				callback(snd)
-			except IndexError:
-				pass
-
-			sndlog = ''
-
-	core.set_audio_sample_cb(wrapper)
+	core.set_audio_sample_cb(res.audio_sample)
 
+	return res
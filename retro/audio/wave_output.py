@@ -1,47 +1,24 @@
 """
-.wav output for SNES audio.
+.wav output for libretro audio.
 """
-import wave
-import struct
-from itertools import izip
-from tempfile import mkstemp
-import os
-import os.path
+from snes.audio.wave_output import AudioRecorder, WaveWriter, \
+		CompressedWriter, FORMAT_WAVE, FORMAT_COMPRESSED, \
+		SNES_OUTPUT_FREQUENCY
+from snes.audio import wave_output as _snes_wave_output
 
-SNES_OUTPUT_FREQUENCY = 32040 # Hz
 
-# libsnes generates signed 16-bit samples, but passes them to us marked as
-# int16 values so we need to pack them as int16 values to avoid any
-# signed/unsigned conversions.
-sndstruct = struct.Struct('<hh')
-
-
-def set_audio_sink(core, filenameOrHandle):
+def set_audio_sink(core, filenameOrHandle, format=None):
 	"""
-	Records SNES audio to the given .wav file.
+	Records libretro audio to the given file.
 
-	"core" should be an instance of snes.core.EmulatedSNES.
+	"core" should be an instance of retro.core.EmulatedSystem.
 
-	"filenameOrHandle" should be either a string representing the filename
-	where audio data should be written, or a file-handle opened in "wb" mode.
+	"filenameOrHandle" and "format" are as for
+	snes.audio.wave_output.set_audio_sink.
 
-	Audio data will be written to the given file as a 32040Hz 16-bit stereo
-	.wav file, using the 'wave' module from the Python standard library.
-
-	Returns the wave.Wave_write instance used to write the SNES audio.
+	Returns the AudioRecorder instance used to record the audio. Call its
+	close() method when you're done, to finish writing the file.
 	"""
-	res = wave.open(filenameOrHandle, "wb")
-	res.setnchannels(2)
-	res.setsampwidth(2)
-	res.setframerate(SNES_OUTPUT_FREQUENCY)
-	res.setcomptype('NONE', 'not compressed')
-
-	def audio_sample(left, right):
-		# We can safely use .writeframesraw() here because the header will be
-		# corrected once we call .close()
-		res.writeframesraw(sndstruct.pack(left, right))
-
-	core.set_audio_sample_cb(audio_sample)
-
-	return res
-
+	# Unlike libsnes, libretro hands us properly signed samples.
+	return _snes_wave_output.set_audio_sink(core, filenameOrHandle, format,
+			typecode='h')
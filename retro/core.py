@@ -74,12 +74,13 @@ class EmulatedSystem(W.LowLevelWrapper):
 		   a game image to run.
 		3. Call set_controller_port_device() to connect appropriate controllers
 		   to the emulated console.
-		4. Call get_refresh_rate() to determine the intended refresh rate of
-		   the loaded game.
+		4. Call get_system_av_info() to determine the exact frame rate and
+		   audio sample rate of the loaded game.
 		5. Call run() to cause emulation to occur. Process the output and
 		   supply input as the registered callbacks are called. For real-time
-		   playback, call run() at the refresh rate returned by
-		   get_refresh_rate().
+		   playback, call run() at the frame rate returned by
+		   get_system_av_info() (snes.pacing.FramePacer can do this for
+		   you).
 		6. Call unload() to free the resources associated with the loaded
 		   game, and return the contents of the game's non-volatile
 		   storage for use with the next session.
@@ -202,6 +203,9 @@ class EmulatedSystem(W.LowLevelWrapper):
 
 			"data" is a pointer to the top-left of a 512*480 array of pixels.
 			Each pixel is an unsigned, 16-bit integer in XBGR1555 format.
+			If the core is repeating the previous frame exactly, "data" is
+			None instead (see ENVIRONMENT_GET_CAN_DUPE), and the callback
+			should show the previous frame again.
 
 			"width" is the number of pixels in each row of the frame. It can be
 			either 256 (if the SNES is in "low-res" mode) or 512 (if the SNES
@@ -397,13 +401,13 @@ class EmulatedSystem(W.LowLevelWrapper):
 		return res
 
 	def get_refresh_rate(self):
-		# FIXME: this should now use libretro's system_av_info
 		"""
 		Return the intended refresh-rate of the loaded game.
 
 		Returns either the integer 50 or the integer 60, depending on whether
 		the loaded game was designed for a 50Hz region (PAL territories)
-		or a 60Hz region (NTSC territories, and Brazil's PAL60).
+		or a 60Hz region (NTSC territories, and Brazil's PAL60). For the
+		exact frame rate, use get_system_av_info().
 		"""
 		region = self._lib.retro_get_region()
 		if region == False:
@@ -413,6 +417,23 @@ class EmulatedSystem(W.LowLevelWrapper):
 			# PAL50
 			return 50
 
+	def get_system_av_info(self):
+		"""
+		Return the audio and video timing and geometry of the loaded game.
+
+		Returns a retro.globals.retro_system_av_info structure. In
+		particular, "timing.fps" is the exact frame rate (such as 60.0988
+		for an NTSC SNES) and "timing.sample_rate" the exact audio sample
+		rate, in Hz.
+
+		Requires that a game be loaded.
+		"""
+		self._require_game_loaded()
+
+		res = retro_system_av_info()
+		self._lib.retro_get_system_av_info(ctypes.byref(res))
+		return res
+
 	def serialize(self):
 		"""
 		Serializes the state of the emulated console to a string.
@@ -429,6 +450,38 @@ class EmulatedSystem(W.LowLevelWrapper):
 			raise EX.RetroException("problem in serialize")
 		return buf.raw
 
+	def serialize_size(self):
+		"""
+		Returns the size, in bytes, of the emulated console's serialized state.
+
+		Requires that a game be loaded.
+		"""
+		return self._lib.retro_serialize_size()
+
+	def serialize_into(self, buffer):
+		"""
+		Serializes the state of the emulated console into an existing buffer.
+
+		"buffer" should be a ctypes array at least serialize_size() bytes
+		long, such as one returned by ctypes.create_string_buffer(). Reusing
+		the same buffer avoids allocating and copying a new string every
+		time, which matters when saving state every frame.
+
+		The buffer can be handed to unserialize() later, just like the
+		string returned by serialize().
+
+		Requires that a game be loaded.
+		"""
+		size = self._lib.retro_serialize_size()
+		if ctypes.sizeof(buffer) < size:
+			raise ValueError("Buffer of %d bytes is too small for %d bytes "
+					"of state" % (ctypes.sizeof(buffer), size))
+
+		res = self._lib.retro_serialize(ctypes.cast(buffer, ctypes.c_void_p),
+				size)
+		if not res:
+			raise EX.RetroException("problem in serialize")
+
 	def unserialize(self, state):
 		"""
 		Restores the state of the emulated console from a string.
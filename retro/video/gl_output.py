@@ -4,12 +4,9 @@ PyOpenGL output for libretro video.
 from OpenGL.GL import *
 from OpenGL.raw.GL import glTexImage2D
 import ctypes
-from xml.etree import ElementTree as ET
-
-SHADER_TYPES = {
-		"vertex": OpenGL.GL.GL_VERTEX_SHADER,
-		"fragment": OpenGL.GL.GL_FRAGMENT_SHADER,
-	}
+# The XML shader format is the same as for libsnes.
+from snes.video.gl_output import SHADER_TYPES, ShaderManager, \
+		load_shader_elem, compile_shader_elem
 
 def set_video_refresh_cb(core, callback):
 	"""
@@ -30,12 +27,21 @@ def set_video_refresh_cb(core, callback):
 
 		"textureH" is an integer, the height of the allocated texture in
 		pixels.
+
+	If the core repeats the previous frame, the texture isn't uploaded again.
 	"""
 	# Allocate and configure our texture.
 	texture = glGenTextures(1)
 	glBindTexture(GL_TEXTURE_2D, texture)
 
+	previous = [None]
+
 	def wrapper(data, width, height, hires, interlace, overscan, pitch):
+		if data is None:
+			if previous[0] is not None:
+				callback(texture, *previous[0])
+			return
+
 		# Extract the pixel data we want into a framebuffer.
 		frame_buf = ctypes.create_string_buffer(width * height * 2)
 		for y in xrange(height):
@@ -51,32 +57,7 @@ def set_video_refresh_cb(core, callback):
 		glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_BGRA,
 				GL_UNSIGNED_SHORT_1_5_5_5_REV, frame_buf)
 
-		callback(texture, width, height, width, height)
+		previous[0] = (width, height, width, height)
+		callback(texture, *previous[0])
 
 	core.set_video_refresh_cb(wrapper)
-
-
-def load_shader_elem(filename):
-	"""
-	Build an ElementTree representing the given XML shader file.
-	"""
-	tree = ET.parse(filename)
-	root = tree.getroot()
-
-	assert root.tag == "shader"
-	assert root.attrib.get("language") == "GLSL"
-
-	return root
-
-
-def compile_shader_elem(elem):
-	"""
-	Compile the shaders in the given ElementTree element.
-	"""
-	shaderList = [
-			shaders.compileShader(child.text,
-				SHADER_TYPES[child.tag])
-			for child in elem
-		]
-
-	return shaders.compileProgram(*shaderList)
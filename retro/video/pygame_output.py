@@ -11,9 +11,18 @@ def set_video_refresh_cb(core, callback):
 	function should accept only one parameter:
 
 		"surf" is an instance of pygame.Surface containing the frame data.
+
+	If the core repeats the previous frame, the callback is given the previous
+	surface again.
 	"""
+	previous = [None]
 
 	def wrapper(data, width, height, hires, interlace, overscan, pitch):
+		if data is None:
+			if previous[0] is not None:
+				callback(previous[0])
+			return
+
 		#print data, width, height, hires, interlace, overscan, pitch
 		#from sys import exit
 		#exit()
@@ -48,6 +57,7 @@ def set_video_refresh_cb(core, callback):
 				surf = pygame.transform.scale(surf,
 						(width,height))
 
+		previous[0] = surf
 		callback(surf)
 
 	core.set_video_refresh_cb(wrapper)
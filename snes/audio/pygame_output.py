@@ -2,53 +2,232 @@
 Pygame output for SNES Audio.
 """
 
-import pygame, numpy, struct
+import warnings
+import pygame, numpy
+from snes.audio.ringbuffer import AudioRingBuffer
+from snes.audio.resampler import StreamingResampler
 
 SNES_OUTPUT_FREQUENCY = 32040 # Hz
 
-sndstruct = struct.Struct('<HH')
-sndlog = ''
+# The sample rate we ask pygame for. Almost every sound card supports this
+# directly; very few support SNES_OUTPUT_FREQUENCY.
+DEFAULT_DEVICE_FREQUENCY = 44100 # Hz
 
-def set_audio_sample_cb(core, callback=pygame.mixer.Sound.play):
+# The number of stereo samples in each block handed to pygame. Smaller blocks
+# mean lower latency, but a higher chance of running dry.
+DEFAULT_LATENCY = 512
+
+# The number of blocks the ring buffer can hold before it starts dropping
+# samples.
+DEFAULT_BUFFER_BLOCKS = 8
+
+
+class PygameAudioOutput(object):
 	"""
-	Sets the callback that will handle updated audio samples.
+	Plays audio samples through a pygame.mixer.Channel.
+
+	Samples are collected in an AudioRingBuffer, and handed to pygame in
+	blocks of "latency" stereo samples. Two Sound objects are used in turn:
+	while one is playing, the other is filled and queued up behind it.
+
+	If pygame's sample rate differs from the rate of the incoming samples,
+	they're converted with a StreamingResampler in blocks of "latency"
+	samples. The resampling ratio is adjusted to keep about two blocks
+	waiting to be played, so that small differences between the emulation
+	speed and the sound card's clock don't cause crackling or creeping
+	latency. (Unless "adjust_rate" is False: see below.)
 
-	Unlike core.EmulatedSNES.set_audio_sample_cb, the callback passed to this
-	function should accept only one parameter:
+	The following attributes are available:
 
-		"snd" is an instance of pygame.mixer.Sound containing the last 512
-		samples.
+		"underruns" is the number of times the channel finished playing
+		before the next block of samples was ready.
 
-	If no callback function is provided, the default implementation of
-	snd.play() is used.
+		"overruns" is the number of stereo samples dropped because pygame
+		wasn't playing them as fast as they arrived.
+
+		"adjust_rate" is True if the resampling ratio is adjusted to keep
+		the queue depth steady. snes.pacing.FramePacer.sync_to_audio() sets
+		it to False, since the pacer then keeps the queue steady by
+		adjusting the speed of emulation instead, and two controllers
+		steering the same queue would overshoot.
 	"""
 
-	# init pygame sound.  snes freq is 32000, 16bit unsigned stereo.
-	pygame.mixer.init(
-		frequency=SNES_OUTPUT_FREQUENCY,
-		size=16, channels=2, buffer=512
-	)
+	def __init__(self, latency=DEFAULT_LATENCY,
+			buffer_blocks=DEFAULT_BUFFER_BLOCKS, typecode='H',
+			frequency=SNES_OUTPUT_FREQUENCY,
+			device_frequency=DEFAULT_DEVICE_FREQUENCY, callback=None):
+		"""
+		Initialise pygame.mixer and prepare to play audio.
+
+		"latency" is the number of stereo samples in each block handed to
+		pygame.
+
+		"buffer_blocks" is the number of blocks that may be waiting to be
+		played before samples are dropped.
+
+		"typecode" describes the samples passed to audio_sample(); see
+		AudioRingBuffer.
+
+		"frequency" is the sample rate of the samples passed to
+		audio_sample().
 
-	snd = pygame.sndarray.make_sound(
-			numpy.zeros( (512, 2), dtype='uint16', order='C' )
+		"device_frequency" is the sample rate to ask pygame for. If pygame.mixer
+		has already been initialised, its existing rate is used instead.
+
+		If "callback" is given, it's called with each block of samples as a
+		pygame.mixer.Sound, instead of the block being played. Two Sounds are
+		used in turn, so the callback must play (or copy) each one before the
+		block after next arrives. Since we can't tell how much audio the
+		callback has queued up, the resampling ratio isn't adjusted.
+		"""
+		self.latency = latency
+		self.underruns = 0
+		self._callback = callback
+		self._adjust_rate = callback is None
+
+		pygame.mixer.init(
+			frequency=device_frequency,
+			size=-16, channels=2, buffer=latency
 		)
-	sndbuf = snd.get_buffer()
+		self.device_frequency = pygame.mixer.get_init()[0]
+
+		if self.device_frequency == frequency:
+			self.resampler = None
+		else:
+			self.resampler = StreamingResampler(frequency,
+					self.device_frequency)
+			self._input = AudioRingBuffer(latency, typecode)
+			self._input_block = numpy.zeros( (latency, 2), dtype=numpy.int16 )
+
+		# Keep a channel for ourselves, so pygame doesn't give it away to
+		# somebody else's Sound.play().
+		pygame.mixer.set_reserved(1)
+		self._channel = pygame.mixer.Channel(0)
+
+		self._ring = AudioRingBuffer(latency * buffer_blocks, typecode)
+
+		self._sounds = [
+				pygame.sndarray.make_sound(
+					numpy.zeros( (latency, 2), dtype=numpy.int16 ))
+				for _ in xrange(2)
+			]
+		self._sound_samples = [
+				pygame.sndarray.samples(snd) for snd in self._sounds
+			]
+		self._next_sound = 0
+		self._started = False
+
+	@property
+	def adjust_rate(self):
+		return self._adjust_rate
+
+	@adjust_rate.setter
+	def adjust_rate(self, value):
+		self._adjust_rate = bool(value)
+		if not value and self.resampler is not None:
+			# Go back to the nominal ratio.
+			self.resampler.adjustment = 0.0
+
+	@property
+	def overruns(self):
+		return self._ring.overruns
 
-	def wrapper(left, right):
-		global sndlog, sndstruct
-		sndlog += sndstruct.pack(left, right)
+	@property
+	def queue_depth(self):
+		"""
+		The number of stereo samples waiting to be played.
 
-		if len(sndlog) >= 512*2*2: # 512 stereo samples of 16-bits each
-			# this try-except block works around a bug in pygame 1.9.1 on 64-bit hosts.
-			# http://archives.seul.org/pygame/users/Apr-2011/msg00069.html
-			# https://bitbucket.org/pygame/pygame/issue/109/bufferproxy-indexerror-exception-thrown
-			try:
-				sndbuf.write(sndlog, 0)
-				callback(snd)
-			except IndexError:
-				pass
+		This includes samples in blocks already handed to pygame, so it's
+		a good estimate of the current output latency.
+		"""
+		depth = len(self._ring)
+
+		if self._channel.get_busy():
+			depth += self.latency
+		if self._channel.get_queue() is not None:
+			depth += self.latency
+
+		return depth
+
+	def audio_sample(self, left, right):
+		"""
+		Accept a single stereo sample from libsnes.
+
+		This is suitable for passing to core.EmulatedSNES.set_audio_sample_cb.
+		"""
+		if self.resampler is None:
+			self._ring.write_sample(left, right)
+
+		else:
+			self._input.write_sample(left, right)
+			if len(self._input) < self.latency:
+				return
+
+			self._input.read_into(self._input_block)
+			if self._adjust_rate:
+				self.resampler.update(self.queue_depth, 2 * self.latency)
+			self._ring.write(self.resampler.process(self._input_block))
+
+		if len(self._ring) >= self.latency:
+			self.pump()
+
+	def pump(self):
+		"""
+		Hand as many complete blocks to pygame as it will accept.
+		"""
+		while len(self._ring) >= self.latency:
+			if self._callback is not None:
+				index = self._next_sound
+				self._ring.read_into(self._sound_samples[index])
+				self._next_sound = 1 - index
+				self._callback(self._sounds[index])
+				continue
+
+			busy = self._channel.get_busy()
+
+			if busy and self._channel.get_queue() is not None:
+				# Both our Sounds are in use; the samples will have to wait in
+				# the ring buffer.
+				return
+
+			index = self._next_sound
+			self._ring.read_into(self._sound_samples[index])
+			self._next_sound = 1 - index
+
+			if busy:
+				self._channel.queue(self._sounds[index])
+			else:
+				if self._started:
+					self.underruns += 1
+				self._started = True
+				self._channel.play(self._sounds[index])
+
+
+def set_audio_sample_cb(core, callback=None, latency=DEFAULT_LATENCY,
+		buffer_blocks=DEFAULT_BUFFER_BLOCKS,
+		device_frequency=DEFAULT_DEVICE_FREQUENCY):
+	"""
+	Plays SNES audio through pygame.
+
+	"latency", "buffer_blocks" and "device_frequency" are passed to
+	PygameAudioOutput.
+
+	"callback" is deprecated. Earlier versions called it with a
+	pygame.mixer.Sound for every block of samples, and left it to play
+	them; it's still called that way if given (see PygameAudioOutput), but
+	it's better to leave it out and let PygameAudioOutput queue the Sounds
+	itself.
+
+	Returns the PygameAudioOutput instance used to play the SNES audio.
+	"""
+	if callback is not None:
+		warnings.warn("set_audio_sample_cb()'s callback parameter is "
+				"deprecated; PygameAudioOutput plays audio itself",
+				DeprecationWarning, stacklevel=2)
 
-			sndlog = ''
+	res = PygameAudioOutput(latency, buffer_blocks,
+			device_frequency=device_frequency, callback=callback)
 
-	core.set_audio_sample_cb(wrapper)
+	core.set_audio_sample_cb(res.audio_sample)
 
+	return res
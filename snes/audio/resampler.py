@@ -0,0 +1,124 @@
+"""
+Sample-rate conversion for SNES audio.
+
+The SNES produces audio at 32040Hz, which few sound cards support directly.
+StreamingResampler converts blocks of samples to another rate, carrying its
+state from one block to the next so there are no clicks at block boundaries.
+
+Emulation never runs at exactly the speed the sound card plays, so over time
+the output buffer either runs dry (crackling) or fills up (growing latency).
+To stop that, the resampler's ratio can be nudged slightly faster or slower
+depending on how full the output buffer is; see StreamingResampler.update().
+The adjustment is small enough that the change in pitch isn't audible.
+"""
+import numpy
+
+# The largest relative change in the resampling ratio that update() will
+# make. Half a percent is well below what most people can hear.
+DEFAULT_MAX_ADJUSTMENT = 0.005
+
+
+class StreamingResampler(object):
+	"""
+	Converts a stream of stereo samples from one sample rate to another.
+
+	Samples are linearly interpolated. Blocks of any size may be passed to
+	process(); the output is the same as if all the samples had been passed
+	in one block.
+	"""
+
+	def __init__(self, input_rate, output_rate,
+			max_adjustment=DEFAULT_MAX_ADJUSTMENT):
+		"""
+		Prepare to convert samples at "input_rate" Hz to "output_rate" Hz.
+
+		"max_adjustment" is the largest relative change to the ratio that
+		update() will make.
+		"""
+		self.input_rate = input_rate
+		self.output_rate = output_rate
+		self.max_adjustment = max_adjustment
+		self.adjustment = 0.0
+
+		# The last input sample from the previous block. The next output
+		# sample will be interpolated from here onwards.
+		self._last = numpy.zeros( (1, 2), dtype=numpy.float64 )
+
+		# The position of the next output sample, in input samples after
+		# self._last. The first output sample is the first input sample.
+		self._position = 1.0
+
+	@property
+	def step(self):
+		"""
+		The number of input samples consumed by each output sample.
+		"""
+		return (float(self.input_rate) / self.output_rate) \
+				* (1.0 + self.adjustment)
+
+	def update(self, fill, target):
+		"""
+		Adjust the ratio according to how full the output buffer is.
+
+		"fill" is the number of samples currently waiting in the output
+		buffer, and "target" the number that should ideally be waiting. If the
+		buffer is fuller than the target, slightly fewer samples are produced,
+		and vice-versa.
+		"""
+		error = float(fill - target) / max(target, 1)
+		error = max(-1.0, min(1.0, error))
+
+		self.adjustment = error * self.max_adjustment
+
+	def output_count(self, count):
+		"""
+		Return the number of samples process() will produce from "count" input
+		samples, at the current ratio.
+		"""
+		if count < self._position:
+			return 0
+
+		return int(numpy.floor((count - self._position) / self.step)) + 1
+
+	def process(self, samples):
+		"""
+		Resample a block of samples.
+
+		"samples" should be a numpy array of shape (n, 2).
+
+		Returns an int16 numpy array of shape (m, 2), where m is roughly
+		n * output_rate / input_rate.
+		"""
+		count = len(samples)
+		if count == 0:
+			return numpy.zeros( (0, 2), dtype=numpy.int16 )
+
+		step = self.step
+		out_count = self.output_count(count)
+
+		# Index 0 is the last sample of the previous block, so input sample i
+		# is at index i + 1.
+		source = numpy.concatenate([self._last, samples])
+
+		positions = self._position + numpy.arange(out_count) * step
+		indexes = positions.astype(numpy.intp)
+		fractions = (positions - indexes)[:, numpy.newaxis]
+
+		# The last output position may land exactly on the last input sample,
+		# in which case there's nothing after it to interpolate towards.
+		following = numpy.minimum(indexes + 1, count)
+
+		res = source[indexes] * (1.0 - fractions) \
+				+ source[following] * fractions
+
+		self._last = source[-1:].astype(numpy.float64)
+		self._position += out_count * step - count
+
+		return numpy.rint(res).astype(numpy.int16)
+
+	def reset(self):
+		"""
+		Forget any samples from previous blocks.
+		"""
+		self._last[:] = 0
+		self._position = 1.0
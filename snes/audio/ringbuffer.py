@@ -0,0 +1,120 @@
+"""
+A fixed-size FIFO of stereo audio samples.
+
+libsnes delivers audio one stereo sample at a time, while audio back-ends want
+large blocks of samples. AudioRingBuffer sits between the two: samples are
+written into preallocated storage as they arrive, and read back out in blocks
+as numpy arrays, without allocating anything per-sample or per-block.
+
+The buffer has no locks; it's meant to be written and read from a single
+thread (typically the one calling core.EmulatedSNES.run()).
+"""
+import array
+import numpy
+
+
+class AudioRingBuffer(object):
+	"""
+	Stores up to "capacity" stereo samples, first-in first-out.
+
+	The following attributes are available:
+
+		"overruns" is the number of stereo samples dropped because the buffer
+		was full when they were written.
+	"""
+
+	def __init__(self, capacity, typecode='h'):
+		"""
+		Create an empty buffer.
+
+		"capacity" is the number of stereo samples the buffer can hold.
+
+		"typecode" is the array module typecode of the samples that will be
+		written. libsnes passes signed samples marked as uint16 values, so use
+		'H' for snes.core and 'h' for retro.core. Either way, samples are read
+		back as int16.
+		"""
+		self.capacity = capacity
+		self.overruns = 0
+
+		self._storage = array.array(typecode, [0]) * (capacity * 2)
+		self._samples = numpy.frombuffer(self._storage,
+				dtype=numpy.int16).reshape(capacity, 2)
+
+		# Index of the next stereo sample to read.
+		self._read = 0
+		# Index into _storage of the next mono sample to write.
+		self._write = 0
+		self._count = 0
+
+	def __len__(self):
+		return self._count
+
+	def write_sample(self, left, right):
+		"""
+		Add a single stereo sample to the buffer.
+		"""
+		if self._count == self.capacity:
+			self.overruns += 1
+			return
+
+		storage = self._storage
+		write = self._write
+		storage[write] = left
+		storage[write + 1] = right
+
+		write += 2
+		if write == len(storage):
+			write = 0
+		self._write = write
+		self._count += 1
+
+	def write(self, samples):
+		"""
+		Add a block of stereo samples to the buffer.
+
+		"samples" should be an int16 numpy array of shape (n, 2).
+		"""
+		count = len(samples)
+		space = self.capacity - self._count
+		if count > space:
+			self.overruns += count - space
+			samples = samples[:space]
+			count = space
+
+		start = self._write // 2
+		first = min(count, self.capacity - start)
+		self._samples[start:start + first] = samples[:first]
+		self._samples[:count - first] = samples[first:]
+
+		self._write = ((start + count) % self.capacity) * 2
+		self._count += count
+
+	def read_into(self, out):
+		"""
+		Move samples from the buffer into the given array.
+
+		"out" should be an int16 numpy array of shape (n, 2). If fewer than
+		n stereo samples are available, nothing is read.
+
+		Returns the number of stereo samples read.
+		"""
+		count = len(out)
+		if count > self._count:
+			return 0
+
+		first = min(count, self.capacity - self._read)
+		out[:first] = self._samples[self._read:self._read + first]
+		out[first:] = self._samples[:count - first]
+
+		self._read = (self._read + count) % self.capacity
+		self._count -= count
+
+		return count
+
+	def clear(self):
+		"""
+		Discard all the samples in the buffer.
+		"""
+		self._read = self._write // 2
+		self._count = 0
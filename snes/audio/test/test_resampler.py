@@ -0,0 +1,88 @@
+#!/usr/bin/python
+import unittest
+import numpy
+from snes.audio.resampler import StreamingResampler
+
+
+def _ramp(count):
+	t = numpy.arange(count)
+	return numpy.array([t * 10, t * -10]).T.astype(numpy.int16)
+
+
+class TestStreamingResampler(unittest.TestCase):
+
+	def test_same_rate(self):
+		"""
+		Resampling to the same rate changes nothing.
+		"""
+		resampler = StreamingResampler(32040, 32040)
+		samples = _ramp(100)
+
+		self.assertEqual(resampler.process(samples[:30]).tolist(),
+				samples[:30].tolist())
+		self.assertEqual(resampler.process(samples[30:]).tolist(),
+				samples[30:].tolist())
+
+	def test_upsample(self):
+		"""
+		Doubling the rate interpolates between the input samples.
+		"""
+		resampler = StreamingResampler(100, 200)
+
+		res = resampler.process(_ramp(3))
+		self.assertEqual(res.tolist(),
+				[[0, 0], [5, -5], [10, -10], [15, -15], [20, -20]])
+
+		# The next block carries on from where the last one finished.
+		res = resampler.process(_ramp(5)[3:])
+		self.assertEqual(res.tolist(),
+				[[25, -25], [30, -30], [35, -35], [40, -40]])
+
+	def test_blocks(self):
+		"""
+		Splitting the input into blocks doesn't change the output.
+		"""
+		samples = (numpy.random.RandomState(1).rand(10000, 2) * 60000
+				- 30000).astype(numpy.int16)
+
+		whole = StreamingResampler(32040, 44100).process(samples)
+
+		resampler = StreamingResampler(32040, 44100)
+		pieces = numpy.concatenate([
+				resampler.process(samples[start:start + 517])
+				for start in xrange(0, len(samples), 517)
+			])
+
+		self.assertEqual(whole.shape, pieces.shape)
+		self.assertTrue(numpy.abs(whole.astype(int) - pieces).max() <= 1)
+
+		# And we get the right number of samples.
+		self.assertEqual(len(whole), 9999 * 44100 // 32040 + 1)
+
+	def test_update(self):
+		"""
+		A fuller output buffer means fewer output samples.
+		"""
+		samples = numpy.zeros( (32040, 2), dtype=numpy.int16 )
+
+		resampler = StreamingResampler(32040, 44100, max_adjustment=0.01)
+		resampler.update(100, 100)
+		self.assertEqual(resampler.adjustment, 0.0)
+		normal = len(resampler.process(samples))
+
+		resampler = StreamingResampler(32040, 44100, max_adjustment=0.01)
+		resampler.update(1000, 100)
+		self.assertEqual(resampler.adjustment, 0.01)
+		full = len(resampler.process(samples))
+
+		resampler = StreamingResampler(32040, 44100, max_adjustment=0.01)
+		resampler.update(0, 100)
+		self.assertEqual(resampler.adjustment, -0.01)
+		empty = len(resampler.process(samples))
+
+		self.assertTrue(full < normal < empty)
+		self.assertTrue(abs(full - normal) < 0.011 * normal)
+
+
+if __name__ == "__main__":
+	unittest.main()
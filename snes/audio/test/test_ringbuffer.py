@@ -0,0 +1,85 @@
+#!/usr/bin/python
+import unittest
+import numpy
+from snes.audio.ringbuffer import AudioRingBuffer
+
+class TestAudioRingBuffer(unittest.TestCase):
+
+	def _read(self, ring, count):
+		out = numpy.zeros( (count, 2), dtype=numpy.int16 )
+		self.assertEqual(ring.read_into(out), count)
+		return out.tolist()
+
+	def test_samples_in_order(self):
+		"""
+		Samples are read back in the order they were written.
+		"""
+		ring = AudioRingBuffer(4)
+
+		ring.write_sample(1, -1)
+		ring.write_sample(2, -2)
+		ring.write_sample(3, -3)
+		self.assertEqual(len(ring), 3)
+
+		self.assertEqual(self._read(ring, 2), [[1, -1], [2, -2]])
+		self.assertEqual(len(ring), 1)
+
+		# Writing more samples wraps around the end of the buffer.
+		ring.write_sample(4, -4)
+		ring.write_sample(5, -5)
+		ring.write_sample(6, -6)
+
+		self.assertEqual(self._read(ring, 4),
+				[[3, -3], [4, -4], [5, -5], [6, -6]])
+		self.assertEqual(len(ring), 0)
+
+	def test_block_writes(self):
+		"""
+		Blocks of samples can be written, wrapping around the buffer.
+		"""
+		ring = AudioRingBuffer(4)
+		ring.write_sample(1, -1)
+		self._read(ring, 1)
+
+		ring.write(numpy.array([[2, -2], [3, -3], [4, -4], [5, -5]],
+			dtype=numpy.int16))
+
+		self.assertEqual(self._read(ring, 4),
+				[[2, -2], [3, -3], [4, -4], [5, -5]])
+
+	def test_short_read(self):
+		"""
+		Nothing is read unless enough samples are available.
+		"""
+		ring = AudioRingBuffer(4)
+		ring.write_sample(1, -1)
+
+		out = numpy.zeros( (2, 2), dtype=numpy.int16 )
+		self.assertEqual(ring.read_into(out), 0)
+		self.assertEqual(len(ring), 1)
+
+	def test_overruns(self):
+		"""
+		Samples written to a full buffer are dropped and counted.
+		"""
+		ring = AudioRingBuffer(2)
+		ring.write_sample(1, -1)
+		ring.write_sample(2, -2)
+		ring.write_sample(3, -3)
+		ring.write(numpy.zeros( (2, 2), dtype=numpy.int16 ))
+
+		self.assertEqual(ring.overruns, 3)
+		self.assertEqual(self._read(ring, 2), [[1, -1], [2, -2]])
+
+	def test_unsigned_samples(self):
+		"""
+		Samples passed as uint16 values are read back as int16.
+		"""
+		ring = AudioRingBuffer(2, typecode='H')
+		ring.write_sample(0xFFFF, 0x8000)
+
+		self.assertEqual(self._read(ring, 1), [[-1, -32768]])
+
+
+if __name__ == "__main__":
+	unittest.main()
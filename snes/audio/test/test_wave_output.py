@@ -0,0 +1,225 @@
+#!/usr/bin/python
+import unittest
+import os
+import wave
+import numpy
+from StringIO import StringIO
+from tempfile import mkstemp
+from snes.audio import wave_output as W
+
+
+class FakeCore(object):
+
+	def set_audio_sample_cb(self, callback):
+		self.audio_sample = callback
+
+
+class RecordingWriter(object):
+
+	def __init__(self):
+		self.blocks = []
+		self.closed = False
+
+	def write(self, samples):
+		self.blocks.append(samples.tolist())
+
+	def close(self):
+		self.closed = True
+
+
+class BrokenWriter(RecordingWriter):
+
+	def write(self, samples):
+		raise IOError("disk full")
+
+
+def _samples(count):
+	"""
+	Some stereo samples that exercise the whole int16 range.
+	"""
+	t = numpy.arange(count)
+	left = 32767 * numpy.sin(t / 7.0)
+	right = numpy.where(t % 50 < 25, 32767, -32768)
+	return numpy.array([left, right]).T.astype(numpy.int16)
+
+
+class TestAudioRecorder(unittest.TestCase):
+
+	def test_blocks(self):
+		"""
+		Samples are handed to the writer in blocks, and the rest on close.
+		"""
+		writer = RecordingWriter()
+		recorder = W.AudioRecorder(writer, block_size=2, typecode='h')
+
+		for i in xrange(5):
+			recorder.audio_sample(i, -i)
+
+		recorder.close()
+
+		self.assertEqual(writer.blocks, [
+				[[0, 0], [1, -1]],
+				[[2, -2], [3, -3]],
+				[[4, -4]],
+			])
+		self.assertTrue(writer.closed)
+
+	def test_unsigned_samples(self):
+		"""
+		libsnes' unsigned samples are written as signed samples.
+		"""
+		writer = RecordingWriter()
+		recorder = W.AudioRecorder(writer, typecode='H')
+
+		recorder.audio_sample(0xFFFF, 0x8000)
+		recorder.close()
+
+		self.assertEqual(writer.blocks, [[[-1, -32768]]])
+
+	def test_writer_errors(self):
+		"""
+		Exceptions raised by the writer are raised again by close().
+		"""
+		recorder = W.AudioRecorder(BrokenWriter(), block_size=1)
+		recorder.audio_sample(0, 0)
+
+		self.assertRaises(IOError, recorder.close)
+
+
+class TestWaveOutput(unittest.TestCase):
+
+	def test_set_audio_sink(self):
+		"""
+		Samples from the core end up in a .wav file.
+		"""
+		core = FakeCore()
+		handle = StringIO()
+		recorder = W.set_audio_sink(core, handle)
+
+		for left, right in _samples(3000).astype(numpy.uint16).tolist():
+			core.audio_sample(left, right)
+
+		# wave.Wave_write closes file handles it's given, so keep the data.
+		handle.close = lambda: None
+		recorder.close()
+
+		handle.seek(0)
+		reader = wave.open(handle, "rb")
+		self.assertEqual(reader.getnchannels(), 2)
+		self.assertEqual(reader.getsampwidth(), 2)
+		self.assertEqual(reader.getframerate(), W.SNES_OUTPUT_FREQUENCY)
+		self.assertEqual(reader.getnframes(), 3000)
+
+		data = numpy.frombuffer(reader.readframes(3000),
+				dtype='<i2').reshape(-1, 2)
+		self.assertEqual(data.tolist(), _samples(3000).tolist())
+
+
+class TestCompressedOutput(unittest.TestCase):
+
+	def _write(self, blocks):
+		handle = StringIO()
+		writer = W.CompressedWriter(handle)
+		for block in blocks:
+			writer.write(block)
+		writer.close()
+
+		return handle.getvalue()
+
+	def test_round_trip(self):
+		"""
+		Compressed recordings are lossless, across chunk boundaries.
+		"""
+		samples = _samples(5000)
+		data = self._write([samples[:1234], samples[1234:]])
+
+		frequency, blocks = W.read_compressed(StringIO(data))
+		self.assertEqual(frequency, W.SNES_OUTPUT_FREQUENCY)
+		self.assertEqual(numpy.concatenate(list(blocks)).tolist(),
+				samples.tolist())
+
+		# And it's smaller than the raw samples would be.
+		self.assertTrue(len(data) < samples.nbytes)
+
+	def test_truncated(self):
+		"""
+		An incomplete chunk at the end of a recording is ignored.
+		"""
+		samples = _samples(200)
+		data = self._write([samples[:100], samples[100:]])
+
+		_, blocks = W.read_compressed(StringIO(data[:-1]))
+		self.assertEqual(numpy.concatenate(list(blocks)).tolist(),
+				samples[:100].tolist())
+
+	def test_not_compressed(self):
+		"""
+		Other files are rejected.
+		"""
+		self.assertRaises(W.CorruptRecording, W.read_compressed,
+				StringIO("RIFF\0\0\0\0WAVEfmt "))
+
+	def test_filename(self):
+		"""
+		Files opened by name are closed once they've been read.
+		"""
+		handles = []
+
+		def tracking_open(*args):
+			handle = open(*args)
+			handles.append(handle)
+			return handle
+
+		W.open = tracking_open
+		self.addCleanup(delattr, W, "open")
+
+		fd, path = mkstemp()
+		self.addCleanup(os.unlink, path)
+		with os.fdopen(fd, "wb") as handle:
+			handle.write(self._write([_samples(100)]))
+
+		_, blocks = W.read_compressed(path)
+		self.assertEqual(len(list(blocks)), 1)
+		self.assertTrue(handles[0].closed)
+
+		with open(path, "wb") as handle:
+			handle.write("RIFF")
+		self.assertRaises(W.CorruptRecording, W.read_compressed, path)
+		self.assertTrue(handles[1].closed)
+
+	def test_compressed_to_wave(self):
+		"""
+		Compressed recordings can be turned into .wav files.
+		"""
+		samples = _samples(1000)
+		source = StringIO(self._write([samples]))
+		dest = StringIO()
+		dest.close = lambda: None
+
+		W.compressed_to_wave(source, dest)
+
+		dest.seek(0)
+		reader = wave.open(dest, "rb")
+		data = numpy.frombuffer(reader.readframes(1000),
+				dtype='<i2').reshape(-1, 2)
+		self.assertEqual(data.tolist(), samples.tolist())
+
+	def test_set_audio_sink_format(self):
+		"""
+		set_audio_sink() can write compressed recordings.
+		"""
+		core = FakeCore()
+		handle = StringIO()
+		handle.close = lambda: None
+		recorder = W.set_audio_sink(core, handle, W.FORMAT_COMPRESSED)
+
+		core.audio_sample(1, 0xFFFF)
+		recorder.close()
+
+		handle.seek(0)
+		_, blocks = W.read_compressed(handle)
+		self.assertEqual([b.tolist() for b in blocks], [[[1, -1]]])
+
+
+if __name__ == "__main__":
+	unittest.main()
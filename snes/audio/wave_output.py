@@ -1,12 +1,27 @@
 """
 .wav output for SNES audio.
+
+Samples are collected into blocks as they arrive from libsnes, and written out
+by a background thread, so that recording doesn't slow down emulation.
+
+As well as .wav files, audio can be recorded in a simple lossless compressed
+format (see CompressedWriter), which is usually much smaller than the
+equivalent .wav file. Use compressed_to_wave() to turn it back into a .wav
+file.
 """
 import wave
 import struct
+import array
+import sys
+import threading
+import Queue
+import zlib
 from itertools import izip
 from tempfile import mkstemp
 import os
 import os.path
+import numpy
+from snes import exceptions as EX
 
 SNES_OUTPUT_FREQUENCY = 32040 # Hz
 
@@ -15,33 +30,393 @@ SNES_OUTPUT_FREQUENCY = 32040 # Hz
 # signed/unsigned conversions.
 sndstruct = struct.Struct('<HH')
 
+# The number of stereo samples collected before they're handed to the writer
+# thread; a little under four frames' worth.
+DEFAULT_BLOCK_SIZE = 2048
+
+# The number of blocks that may be waiting for the writer thread. If the
+# writer falls further behind than this, emulation waits for it to catch up
+# rather than losing audio.
+DEFAULT_QUEUE_BLOCKS = 64
+
+FORMAT_WAVE = "wav"
+FORMAT_COMPRESSED = "wavz"
+
+# The compressed format begins with a header containing a magic number,
+# a format version and the sample rate. It's followed by any number of
+# chunks, each of which is a chunk header containing the number of stereo
+# samples and the length of the compressed data, followed by the compressed
+# data itself.
+#
+# Each chunk holds the differences between consecutive samples in each
+# channel (the first sample in a chunk is relative to the last sample in the
+# previous chunk), as int16 values. The low bytes of all the differences are
+# stored first, then the high bytes, and the whole lot is zlib-compressed.
+# Audio changes slowly enough that most of the high bytes are 0x00 or 0xFF,
+# which compresses very well.
+COMPRESSED_MAGIC = "SNDZ"
+COMPRESSED_VERSION = 1
+compressed_header = struct.Struct('<4sBI')
+compressed_chunk_header = struct.Struct('<II')
+
+
+class CorruptRecording(EX.SNESException):
+	"""
+	A compressed audio recording is not in the expected format.
+	"""
+
+
+class WaveWriter(object):
+	"""
+	Writes blocks of stereo samples to a .wav file.
+	"""
+
+	def __init__(self, filenameOrHandle, frequency=SNES_OUTPUT_FREQUENCY):
+		"""
+		Open the given .wav file for writing.
+
+		"filenameOrHandle" should be either a string representing the
+		filename where audio data should be written, or a file-handle opened
+		in "wb" mode.
+		"""
+		self._wave = wave.open(filenameOrHandle, "wb")
+		self._wave.setnchannels(2)
+		self._wave.setsampwidth(2)
+		self._wave.setframerate(frequency)
+		self._wave.setcomptype('NONE', 'not compressed')
+
+	def write(self, samples):
+		"""
+		Write the given samples, an int16 numpy array of shape (n, 2).
+		"""
+		# We can safely use .writeframesraw() here because the header will be
+		# corrected once we call .close()
+		self._wave.writeframesraw(samples.astype('<i2').tostring())
+
+	def close(self):
+		self._wave.close()
+
 
-def set_audio_sink(core, filenameOrHandle):
+def _encode_chunk(samples, previous):
 	"""
-	Records SNES audio to the given .wav file.
+	Return the compressed form of the given samples.
+
+	"samples" should be an int16 numpy array of shape (n, 2), and "previous"
+	the last stereo sample before them.
+	"""
+	deltas = numpy.empty_like(samples)
+	deltas[0] = samples[0] - previous
+	numpy.subtract(samples[1:], samples[:-1], deltas[1:])
+
+	deltas = deltas.astype(numpy.uint16).ravel()
+	planes = numpy.concatenate([deltas & 0xff, deltas >> 8])
+
+	return zlib.compress(planes.astype(numpy.uint8).tostring())
+
+
+def _decode_chunk(data, count, previous):
+	"""
+	Return the samples in the given compressed chunk.
+
+	The reverse of _encode_chunk(); "count" is the number of stereo samples
+	in the chunk.
+	"""
+	try:
+		planes = numpy.frombuffer(zlib.decompress(data), dtype=numpy.uint8)
+	except zlib.error, e:
+		raise CorruptRecording("Can't decompress chunk: %s" % (e,))
+
+	if len(planes) != count * 4:
+		raise CorruptRecording("Chunk has %d bytes of samples, expected %d"
+				% (len(planes), count * 4))
+
+	deltas = (planes[:count * 2].astype(numpy.uint16)
+			| (planes[count * 2:].astype(numpy.uint16) << 8))
+	deltas = deltas.view(numpy.int16).reshape(count, 2)
+
+	# int16 arithmetic wraps around, just like it did when encoding.
+	return numpy.cumsum(deltas, axis=0, dtype=numpy.int16) + previous
+
+
+class CompressedWriter(object):
+	"""
+	Writes blocks of stereo samples to a compressed audio file.
+
+	Each block is compressed and written as soon as it's received, so if
+	recording is interrupted, everything up to the last complete block can
+	still be read back.
+	"""
+
+	def __init__(self, filenameOrHandle, frequency=SNES_OUTPUT_FREQUENCY):
+		"""
+		Open the given file for writing.
+
+		"filenameOrHandle" should be either a string representing the
+		filename where audio data should be written, or a file-handle opened
+		in "wb" mode.
+		"""
+		if isinstance(filenameOrHandle, basestring):
+			self._handle = open(filenameOrHandle, "wb")
+			self._owns_handle = True
+		else:
+			self._handle = filenameOrHandle
+			self._owns_handle = False
+
+		self._previous = numpy.zeros(2, dtype=numpy.int16)
+
+		self._handle.write(compressed_header.pack(COMPRESSED_MAGIC,
+			COMPRESSED_VERSION, frequency))
+
+	def write(self, samples):
+		"""
+		Write the given samples, an int16 numpy array of shape (n, 2).
+		"""
+		if not len(samples):
+			return
+
+		data = _encode_chunk(samples, self._previous)
+		self._previous = samples[-1].copy()
+
+		self._handle.write(compressed_chunk_header.pack(len(samples),
+			len(data)))
+		self._handle.write(data)
+
+	def close(self):
+		if self._owns_handle:
+			self._handle.close()
+		else:
+			self._handle.flush()
+
+
+def read_compressed(filenameOrHandle):
+	"""
+	Read a file written by CompressedWriter.
+
+	"filenameOrHandle" should be either a string representing the filename
+	to read, or a file-handle opened in "rb" mode.
+
+	Returns a tuple of (frequency, blocks), where "frequency" is the sample
+	rate in Hz and "blocks" is an iterator of int16 numpy arrays of shape
+	(n, 2). An incomplete chunk at the end of the file (perhaps because
+	recording was interrupted) is ignored.
+
+	If a filename was given, the file is closed once every block has been
+	read, or the iterator is closed.
+
+	Raises CorruptRecording if the file is not a compressed recording.
+	"""
+	if isinstance(filenameOrHandle, basestring):
+		handle = open(filenameOrHandle, "rb")
+		owns_handle = True
+	else:
+		handle = filenameOrHandle
+		owns_handle = False
+
+	try:
+		header = handle.read(compressed_header.size)
+		if len(header) != compressed_header.size:
+			raise CorruptRecording("File too short")
+
+		magic, version, frequency = compressed_header.unpack(header)
+		if magic != COMPRESSED_MAGIC:
+			raise CorruptRecording("Not a compressed audio recording")
+		if version != COMPRESSED_VERSION:
+			raise CorruptRecording("Unsupported version %d" % (version,))
+	except:
+		if owns_handle:
+			handle.close()
+		raise
+
+	def blocks():
+		previous = numpy.zeros(2, dtype=numpy.int16)
+
+		try:
+			while True:
+				chunk_header = handle.read(compressed_chunk_header.size)
+				if len(chunk_header) != compressed_chunk_header.size:
+					break
+
+				count, length = compressed_chunk_header.unpack(chunk_header)
+				data = handle.read(length)
+				if len(data) != length:
+					break
+
+				samples = _decode_chunk(data, count, previous)
+				previous = samples[-1]
+
+				yield samples
+		finally:
+			if owns_handle:
+				handle.close()
+
+	return frequency, blocks()
+
+
+def compressed_to_wave(source, dest):
+	"""
+	Convert a file written by CompressedWriter into a .wav file.
+
+	"source" and "dest" may each be a filename or a file-handle.
+	"""
+	frequency, blocks = read_compressed(source)
+
+	writer = WaveWriter(dest, frequency)
+	try:
+		for samples in blocks:
+			writer.write(samples)
+	finally:
+		writer.close()
+
+
+class AudioRecorder(object):
+	"""
+	Records stereo samples using a writer, on a background thread.
+
+	Samples are collected into blocks of "block_size" stereo samples, and
+	each complete block is passed to the writer's write() method on another
+	thread. Call close() when recording is finished, to write any remaining
+	samples and close the writer.
+
+	If the writer raises an exception, it's re-raised from the next call to
+	flush() or close().
+	"""
+
+	def __init__(self, writer, block_size=DEFAULT_BLOCK_SIZE,
+			queue_blocks=DEFAULT_QUEUE_BLOCKS, typecode='H'):
+		"""
+		Start recording.
+
+		"writer" should be an object with write() and close() methods, like
+		WaveWriter or CompressedWriter.
+
+		"queue_blocks" is the number of blocks that may be waiting to be
+		written before audio_sample() waits for the writer to catch up.
+
+		"typecode" describes the samples passed to audio_sample(); as for
+		snes.audio.ringbuffer.AudioRingBuffer, use 'H' for snes.core and 'h'
+		for retro.core.
+		"""
+		self.writer = writer
+		self.block_size = block_size
+		self._typecode = typecode
+		self._block = array.array(typecode)
+		self._queue = Queue.Queue(queue_blocks)
+		self._error = None
+		self._closed = False
+
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	@property
+	def queue_depth(self):
+		"""
+		The number of blocks waiting to be written.
+		"""
+		return self._queue.qsize()
+
+	def _run(self):
+		while True:
+			block = self._queue.get()
+			if block is None:
+				break
+
+			if self._error is not None:
+				# Keep draining the queue so nobody waits forever.
+				continue
+
+			try:
+				samples = numpy.frombuffer(block,
+						dtype=numpy.int16).reshape(-1, 2)
+				self.writer.write(samples)
+			except Exception:
+				self._error = sys.exc_info()
+
+	def _check_error(self):
+		if self._error is not None:
+			error, self._error = self._error, None
+			raise error[0], error[1], error[2]
+
+	def audio_sample(self, left, right):
+		"""
+		Accept a single stereo sample from libsnes.
+
+		This is suitable for passing to core.EmulatedSNES.set_audio_sample_cb.
+		"""
+		block = self._block
+		block.append(left)
+		block.append(right)
+
+		if len(block) >= self.block_size * 2:
+			self.flush()
+
+	def flush(self):
+		"""
+		Hand any collected samples to the writer thread.
+		"""
+		self._check_error()
+
+		if not self._block:
+			return
+
+		self._queue.put(self._block)
+		self._block = array.array(self._typecode)
+
+	def close(self):
+		"""
+		Write any remaining samples, wait for the writer thread to finish,
+		and close the writer.
+		"""
+		if self._closed:
+			return
+		self._closed = True
+
+		try:
+			self.flush()
+		finally:
+			self._queue.put(None)
+			self._thread.join()
+			self.writer.close()
+
+		self._check_error()
+
+
+def set_audio_sink(core, filenameOrHandle, format=None, typecode='H'):
+	"""
+	Records SNES audio to the given file.
 
 	"core" should be an instance of snes.core.EmulatedSNES.
 
 	"filenameOrHandle" should be either a string representing the filename
 	where audio data should be written, or a file-handle opened in "wb" mode.
 
-	Audio data will be written to the given file as a 32040Hz 16-bit stereo
-	.wav file, using the 'wave' module from the Python standard library.
+	"format" should be FORMAT_WAVE or FORMAT_COMPRESSED. If None, the format
+	is FORMAT_COMPRESSED if the filename ends with ".wavz", and FORMAT_WAVE
+	otherwise.
+
+	By default, audio data will be written to the given file as a 32040Hz
+	16-bit stereo .wav file, using the 'wave' module from the Python standard
+	library.
 
-	Returns the wave.Wave_write instance used to write the SNES audio.
+	Returns the AudioRecorder instance used to record the SNES audio. Call
+	its close() method when you're done, to finish writing the file.
 	"""
-	res = wave.open(filenameOrHandle, "wb")
-	res.setnchannels(2)
-	res.setsampwidth(2)
-	res.setframerate(SNES_OUTPUT_FREQUENCY)
-	res.setcomptype('NONE', 'not compressed')
+	if format is None:
+		if isinstance(filenameOrHandle, basestring) and \
+				filenameOrHandle.endswith("." + FORMAT_COMPRESSED):
+			format = FORMAT_COMPRESSED
+		else:
+			format = FORMAT_WAVE
 
-	def audio_sample(left, right):
-		# We can safely use .writeframesraw() here because the header will be
-		# corrected once we call .close()
-		res.writeframesraw(sndstruct.pack(left, right))
+	if format == FORMAT_WAVE:
+		writer = WaveWriter(filenameOrHandle)
+	elif format == FORMAT_COMPRESSED:
+		writer = CompressedWriter(filenameOrHandle)
+	else:
+		raise ValueError("Unknown audio format %r" % (format,))
 
-	core.set_audio_sample_cb(audio_sample)
+	res = AudioRecorder(writer, typecode=typecode)
 
-	return res
+	core.set_audio_sample_cb(res.audio_sample)
 
+	return res
@@ -170,6 +170,9 @@ class EmulatedSNES(W.LowLevelWrapper):
 	_input_poll_wrapper = None
 	_input_state_wrapper = None
 
+	# Created the first time somebody asks for it.
+	_frame_bus = None
+
 	def __init__(self, libname):
 		"""
 		Construct and return a wrapper for the given libsnes library.
@@ -255,6 +258,23 @@ class EmulatedSNES(W.LowLevelWrapper):
 			raise EX.CartridgeAlreadyLoaded("This method requires that no "
 					"cartridge be loaded!")
 
+	@property
+	def frame_bus(self):
+		"""
+		A snes.video.bus.FrameBus that shares video frames between any number
+		of consumers.
+
+		The bus is created, and made the video refresh callback, the first
+		time it's asked for. If you call set_video_refresh_cb() yourself after
+		that, call the bus' attach() method to reconnect it.
+		"""
+		if self._frame_bus is None:
+			# Only import the video code if somebody actually wants it.
+			from snes.video.bus import FrameBus
+			self._frame_bus = FrameBus(self)
+
+		return self._frame_bus
+
 	# Python wrapper functions that handle all the ctypes callback casting.
 
 	def set_video_refresh_cb(self, callback):
@@ -499,6 +519,37 @@ class EmulatedSNES(W.LowLevelWrapper):
 			raise EX.SNESException("problem in serialize")
 		return buf.raw
 
+	def serialize_size(self):
+		"""
+		Returns the size, in bytes, of the emulated SNES's serialized state.
+
+		Requires that a cartridge be loaded.
+		"""
+		return self._lib.snes_serialize_size()
+
+	def serialize_into(self, buffer):
+		"""
+		Serializes the state of the emulated SNES into an existing buffer.
+
+		"buffer" should be a ctypes array at least serialize_size() bytes
+		long, such as one returned by ctypes.create_string_buffer(). Reusing
+		the same buffer avoids allocating and copying a new string every
+		time, which matters when saving state every frame.
+
+		The buffer can be handed to unserialize() later, just like the
+		string returned by serialize().
+
+		Requires that a cartridge be loaded.
+		"""
+		size = self._lib.snes_serialize_size()
+		if ctypes.sizeof(buffer) < size:
+			raise ValueError("Buffer of %d bytes is too small for %d bytes "
+					"of state" % (ctypes.sizeof(buffer), size))
+
+		res = self._lib.snes_serialize(ctypes.cast(buffer, W.data_p), size)
+		if not res:
+			raise EX.SNESException("problem in serialize")
+
 	def unserialize(self, state):
 		"""
 		Restores the state of the emulated SNES from a string.
@@ -0,0 +1,338 @@
+"""
+A content-addressed store of expected ("golden") video frames.
+
+Each golden frame is kept on disk exactly once, compressed, and named after
+the digest of its raw pixel data. A separate index maps test names to frame
+digests, so identical frames shared by many tests (or many cartridges) only
+cost one file, and checking a frame against its golden copy is usually just
+a matter of comparing two digests.
+
+Frames are first stored as individual files. Calling GoldenStore.pack()
+gathers them all into a single snes.video.archive file, which shares the
+tiles that golden frames have in common and so takes up much less room.
+"""
+import os
+import os.path
+import json
+import struct
+import zlib
+from tempfile import mkstemp
+from snes import exceptions as EX
+from snes.video import pil_output
+from snes.video.frame import Frame
+from snes.video.archive import ArchiveWriter, ArchiveReader
+
+INDEX_VERSION = 1
+
+FRAME_MAGIC = 'SNFR'
+FRAME_HEADER = struct.Struct('<4sHHB')
+
+FLAG_HIRES = 1
+FLAG_INTERLACE = 2
+FLAG_OVERSCAN = 4
+
+
+class CorruptStore(EX.SNESException):
+	"""
+	The golden store on disk is damaged or in an unknown format.
+	"""
+
+
+def encode_frame(frame):
+	"""
+	Return the given Frame as a compressed string.
+	"""
+	flags = 0
+	if frame.hires:
+		flags |= FLAG_HIRES
+	if frame.interlace:
+		flags |= FLAG_INTERLACE
+	if frame.overscan:
+		flags |= FLAG_OVERSCAN
+
+	header = FRAME_HEADER.pack(FRAME_MAGIC, frame.width, frame.height, flags)
+
+	return zlib.compress(header + frame.tostring(), 9)
+
+
+def decode_frame(data):
+	"""
+	Return the Frame represented by a string from encode_frame().
+	"""
+	data = zlib.decompress(data)
+
+	magic, width, height, flags = FRAME_HEADER.unpack_from(data)
+	if magic != FRAME_MAGIC:
+		raise CorruptStore("Frame has bad magic %r, expected %r"
+				% (magic, FRAME_MAGIC))
+
+	res = Frame.fromstring(data[FRAME_HEADER.size:], width, height)
+	res.hires = bool(flags & FLAG_HIRES)
+	res.interlace = bool(flags & FLAG_INTERLACE)
+	res.overscan = bool(flags & FLAG_OVERSCAN)
+
+	return res
+
+
+def _write_atomically(filename, data):
+	"""
+	Replace the contents of the given file, without leaving it half-written.
+	"""
+	fd, tempname = mkstemp(dir=os.path.dirname(filename))
+	try:
+		with os.fdopen(fd, "wb") as handle:
+			handle.write(data)
+		os.rename(tempname, filename)
+	except:
+		os.unlink(tempname)
+		raise
+
+
+class GoldenStore(object):
+	"""
+	A directory of golden frames, and an index mapping names to them.
+
+	Typical usage goes like this:
+
+		1. Construct a GoldenStore pointing at a directory.
+		2. Construct GoldenFrameTests (see snes.testing) that refer to it, and
+		   run them.
+		3. If the store was constructed with accept=True, call save() to
+		   record the frames that were accepted.
+
+	When tests run in other processes (see snes.testrunner), each process
+	has its own copy of the store. Frames accepted in a worker are written
+	to disk there, but only its copy of the index knows about them, so the
+	worker passes take_accepted() back to be given to record() in the
+	process that calls save().
+	"""
+
+	def __init__(self, path, accept=False):
+		"""
+		Open (or create) the golden store in the given directory.
+
+		"path" is the directory containing the store.
+
+		"accept" should be True if the frames currently produced should be
+		accepted as the new golden frames. In that case, check() always
+		passes, and any frame that didn't match is recorded in the store
+		(call save() to make the changes permanent).
+		"""
+		self.path = path
+		self.accept_all = accept
+		self._index_path = os.path.join(path, "index.json")
+		self._frames_path = os.path.join(path, "frames")
+		self._pack_path = os.path.join(path, "frames.snfa")
+		self._pack = None
+		self._packed = None
+		self._dirty = False
+		self._accepted = []
+
+		if not os.path.isdir(self._frames_path):
+			os.makedirs(self._frames_path)
+
+		if os.path.exists(self._index_path):
+			with open(self._index_path, "rb") as handle:
+				try:
+					index = json.load(handle)
+				except ValueError, e:
+					raise CorruptStore("Can't read index %r: %s"
+							% (self._index_path, e))
+
+			if index.get("version") != INDEX_VERSION:
+				raise CorruptStore("Index %r has version %r, expected %r"
+						% (self._index_path, index.get("version"),
+							INDEX_VERSION))
+
+			self._index = index["frames"]
+		else:
+			self._index = {}
+
+	def _frame_path(self, digest):
+		return os.path.join(self._frames_path, digest[:2], digest)
+
+	def _packed_frames(self):
+		"""
+		Return a dict mapping the digest of each packed frame to its number
+		in the pack.
+		"""
+		if self._packed is None:
+			self._packed = {}
+			if os.path.exists(self._pack_path):
+				self._pack = ArchiveReader(self._pack_path)
+				for number in xrange(len(self._pack)):
+					self._packed[self._pack.tag(number)] = number
+
+		return self._packed
+
+	def _has_frame(self, digest):
+		return os.path.exists(self._frame_path(digest)) \
+				or digest in self._packed_frames()
+
+	def get_digest(self, name):
+		"""
+		Return the digest of the golden frame with the given name, or None.
+		"""
+		return self._index.get(name)
+
+	def load(self, digest):
+		"""
+		Return the Frame with the given digest.
+		"""
+		filename = self._frame_path(digest)
+		if not os.path.exists(filename):
+			number = self._packed_frames().get(digest)
+			if number is not None:
+				return self._pack[number]
+
+		with open(filename, "rb") as handle:
+			return decode_frame(handle.read())
+
+	def accept(self, name, frame):
+		"""
+		Record the given Frame as the golden frame with the given name.
+		"""
+		digest = frame.digest
+		filename = self._frame_path(digest)
+
+		# If some other name already refers to this exact frame, we don't need
+		# to store it again.
+		if not self._has_frame(digest):
+			if not os.path.isdir(os.path.dirname(filename)):
+				os.makedirs(os.path.dirname(filename))
+			_write_atomically(filename, encode_frame(frame))
+
+		self.record(name, digest)
+
+	def record(self, name, digest):
+		"""
+		Name the stored frame with the given digest.
+
+		The frame must already be on disk, for example because another
+		process accepted it.
+		"""
+		if self._index.get(name) != digest:
+			self._index[name] = digest
+			self._accepted.append( (name, digest) )
+			self._dirty = True
+
+	def take_accepted(self):
+		"""
+		Return a list of the (name, digest) pairs changed since the last call.
+		"""
+		res, self._accepted = self._accepted, []
+		return res
+
+	def check(self, name, frame, max_delta=0, max_pixels=0, min_psnr=None):
+		"""
+		Compare the given Frame to the golden frame with the given name.
+
+		"max_delta", "max_pixels" and "min_psnr" describe how different the
+		frames may be while still passing. See
+		pil_output.ImageDifference.is_within() for details.
+
+		Returns a (result, reason) tuple, where "result" is True for pass or
+		False for fail, and "reason" is an empty string (if the test passed)
+		or a description of the failure (if the test failed).
+		"""
+		expected = self.get_digest(name)
+
+		if expected == frame.digest:
+			return (True, "")
+
+		if self.accept_all:
+			self.accept(name, frame)
+			return (True, "")
+
+		if expected is None:
+			return (False, "No golden frame named %r" % (name,))
+
+		# The frames differ, so now we have to decode the golden frame and
+		# figure out how badly.
+		difference = pil_output.describe_difference(frame.image,
+				self.load(expected).image, max_delta, max_pixels, min_psnr)
+
+		if difference is None:
+			return (True, "")
+
+		return (False, difference)
+
+	def save(self):
+		"""
+		Write any changes to the index to disk.
+		"""
+		if not self._dirty:
+			return
+
+		_write_atomically(self._index_path, json.dumps({
+				"version": INDEX_VERSION,
+				"frames": self._index,
+			}, indent=1, sort_keys=True))
+		self._dirty = False
+
+	def pack(self):
+		"""
+		Gather every frame named in the index into a single archive.
+
+		Frames that are no longer named in the index are left out of the new
+		archive, and the individual files of packed frames are deleted.
+
+		Returns the number of frames in the archive.
+		"""
+		digests = []
+		for name in sorted(self._index):
+			digest = self._index[name]
+			if digest not in digests:
+				digests.append(digest)
+
+		fd, tempname = mkstemp(dir=self.path)
+		os.close(fd)
+		writer = None
+		try:
+			writer = ArchiveWriter(tempname)
+			for digest in digests:
+				writer.add_frame(self.load(digest), str(digest))
+			writer.close()
+			writer = None
+
+			# The old archive must be closed before it can be replaced.
+			if self._pack is not None:
+				self._pack.close()
+			os.rename(tempname, self._pack_path)
+		except Exception:
+			if writer is not None:
+				writer.close()
+			os.unlink(tempname)
+			raise
+		finally:
+			if self._pack is not None:
+				self._pack.close()
+			self._pack = None
+			self._packed = None
+
+		for digest in digests:
+			filename = self._frame_path(digest)
+			if os.path.exists(filename):
+				os.unlink(filename)
+
+		return len(digests)
+
+	def prune(self):
+		"""
+		Delete any stored frames that are no longer named in the index.
+
+		Frames in the archive written by pack() are only removed when pack()
+		is next called.
+
+		Returns the number of frames deleted.
+		"""
+		wanted = set(self._index.values())
+		count = 0
+
+		for dirpath, dirnames, filenames in os.walk(self._frames_path):
+			for filename in filenames:
+				if filename not in wanted:
+					os.unlink(os.path.join(dirpath, filename))
+					count += 1
+
+		return count
@@ -0,0 +1,213 @@
+"""
+Frame pacing for real-time playback.
+
+A SNES doesn't run at exactly 60 (or 50) frames per second: an NTSC console
+produces 21477272 / 357366, or about 60.0988, frames per second, and a PAL
+one about 50.007. Pacing emulation at a rounded rate slowly drifts away from
+the audio, which is produced at its own exact rate.
+
+FramePacer keeps emulation on schedule:
+
+	- Each frame's deadline is worked out from the start of the schedule,
+	  rather than from when the last frame happened to finish, so the
+	  errors of individual sleeps don't accumulate.
+
+	- precise_sleep() sleeps for most of the wait, and yields the CPU in a
+	  loop for the last little bit, since the operating system's sleep can
+	  overshoot by a millisecond or more.
+
+	- Optionally, the schedule follows the audio clock: if more audio is
+	  queued up than wanted, frames are stretched slightly so less is
+	  produced, and vice versa. That keeps audio latency steady, even though
+	  the sound card's clock never quite matches the computer's.
+
+core_timing() works out the exact frame rate and sample rate of a core.
+"""
+import time
+
+# The exact timing of the SNES: the master clock rate divided by the number
+# of master clock cycles in a (non-interlaced) frame.
+SNES_NTSC_FRAME_RATE = 21477272.0 / 357366
+SNES_PAL_FRAME_RATE = 21281370.0 / 425568
+
+SNES_SAMPLE_RATE = 32040 # Hz
+
+# precise_sleep() stops sleeping, and starts yielding, this long before it's
+# due to wake up.
+SPIN_TIME = 0.0015 # seconds
+
+# If a frame is this late, the pacer gives up trying to catch up, and starts
+# a new schedule from now.
+MAX_LAG = 0.25 # seconds
+
+# When following the audio clock, frames are stretched or shrunk by this
+# fraction of their length for each frame's worth of excess or missing
+# queued audio...
+AUDIO_GAIN = 0.005
+
+# ...but never by more than this fraction.
+MAX_AUDIO_SKEW = 0.005
+
+
+def core_timing(core):
+	"""
+	Return the (frame rate, sample rate) of a core, in Hz.
+
+	"core" should be an instance of snes.core.EmulatedSNES or
+	retro.core.EmulatedSystem with a cartridge loaded, or anything that
+	stands in for one. libretro cores report their exact timing; for libsnes
+	cores, the exact timing of the SNES region they report is used.
+	"""
+	get_system_av_info = getattr(core, "get_system_av_info", None)
+	if get_system_av_info is not None:
+		timing = get_system_av_info().timing
+		if timing.fps > 0:
+			return timing.fps, timing.sample_rate
+
+	if core.get_refresh_rate() == 50:
+		return SNES_PAL_FRAME_RATE, SNES_SAMPLE_RATE
+
+	return SNES_NTSC_FRAME_RATE, SNES_SAMPLE_RATE
+
+
+def precise_sleep(seconds, clock=time.time, sleep=time.sleep):
+	"""
+	Sleep for the given number of seconds, more accurately than time.sleep().
+	"""
+	deadline = clock() + seconds
+
+	if seconds > SPIN_TIME:
+		sleep(seconds - SPIN_TIME)
+
+	while clock() < deadline:
+		# Let other threads (such as a ThreadedPresenter) run.
+		sleep(0)
+
+
+class FramePacer(object):
+	"""
+	Works out when each frame is due, and waits for it.
+
+	The following attributes are available:
+
+		"period" is the length of a frame, in seconds.
+
+		"deadline" is when the current frame is due, or None before the
+		schedule starts.
+
+		"resets" is the number of times the pacer fell more than MAX_LAG
+		behind, and started a new schedule.
+	"""
+
+	def __init__(self, frame_rate, clock=time.time, sleep=precise_sleep):
+		"""
+		"frame_rate" is the number of frames per second, such as the first
+		value returned by core_timing().
+
+		"clock" returns the current time in seconds, and "sleep" sleeps for
+		a given number of seconds.
+		"""
+		self.period = 1.0 / frame_rate
+		self.deadline = None
+		self.resets = 0
+
+		self._clock = clock
+		self._sleep = sleep
+		self._audio = None
+		self._audio_target = None
+		self._audio_rate = None
+
+	def sync_to_audio(self, output, target_depth=None, sample_rate=None):
+		"""
+		Follow the audio clock of the given audio output.
+
+		"output" has a "queue_depth" attribute giving the number of stereo
+		samples waiting to be played, such as a
+		snes.audio.pygame_output.PygameAudioOutput. Pass None to stop
+		following the audio clock.
+
+		If the output has an "adjust_rate" attribute, it's set to False
+		while the pacer follows the output, so the output doesn't also try
+		to steer its queue depth by resampling.
+
+		"target_depth" is the number of queued samples to aim for. It
+		defaults to two of the output's blocks ("latency" samples each).
+
+		"sample_rate" is the rate at which the queued samples are played.
+		It defaults to the output's "device_frequency".
+		"""
+		if self._audio is not None and hasattr(self._audio, "adjust_rate"):
+			self._audio.adjust_rate = True
+
+		self._audio = output
+		if output is None:
+			return
+
+		if hasattr(output, "adjust_rate"):
+			output.adjust_rate = False
+
+		if target_depth is None:
+			target_depth = 2 * output.latency
+		if sample_rate is None:
+			sample_rate = output.device_frequency
+
+		self._audio_target = target_depth
+		self._audio_rate = float(sample_rate)
+
+	def reset(self, now=None):
+		"""
+		Start a new schedule, with the current frame due now.
+		"""
+		if now is None:
+			now = self._clock()
+
+		self.deadline = now
+
+	def lateness(self, now=None):
+		"""
+		Return how many seconds behind schedule the current frame is.
+
+		The result is negative if the frame isn't due yet.
+		"""
+		if now is None:
+			now = self._clock()
+
+		if self.deadline is None:
+			self.reset(now)
+
+		return now - self.deadline
+
+	def _next_period(self):
+		if self._audio is None:
+			return self.period
+
+		# How many frames' worth of audio too much is queued.
+		excess = ((self._audio.queue_depth - self._audio_target)
+				/ self._audio_rate / self.period)
+		skew = max(-MAX_AUDIO_SKEW, min(MAX_AUDIO_SKEW, excess * AUDIO_GAIN))
+
+		return self.period * (1 + skew)
+
+	def wait(self):
+		"""
+		Move on to the next frame, and wait until it's due.
+
+		Returns the number of seconds slept.
+		"""
+		now = self._clock()
+		if self.deadline is None:
+			self.reset(now)
+
+		self.deadline += self._next_period()
+
+		delay = self.deadline - now
+		if delay > 0:
+			self._sleep(delay)
+			return delay
+
+		if -delay > MAX_LAG:
+			# Too far behind to catch up; carry on from here.
+			self.resets += 1
+			self.deadline = now
+
+		return 0.0
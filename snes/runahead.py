@@ -0,0 +1,186 @@
+"""
+Run-ahead, to hide a game's internal input lag.
+
+Many games take a frame or two to react to the controller: the frame in
+which a button is pressed looks just like the one before it. Run-ahead hides
+that lag by showing the future. For each frame, RunAhead:
+
+	1. Runs the real frame, with its audio but without its video.
+	2. Saves the emulated SNES's state.
+	3. Runs "frames" more frames with the same input and no audio, and
+	   presents the video of the last one.
+	4. Restores the saved state, ready for the next real frame.
+
+The player sees the game as it will be a few frames from now, so their
+input appears to take effect sooner. Emulating several frames for every one
+displayed is expensive, so RunAhead keeps track of how long it takes: if
+"max_cost" is given and the host can't keep up, run-ahead switches itself
+off.
+
+Input must be the same for the frames run ahead as for the real frame, so
+run-ahead suits live controllers, but not movie playback that reads new input
+each time it's asked (as snes.input.bsv_input does).
+
+State is saved into the same buffer every frame (see the core's
+serialize_into()), so run-ahead doesn't allocate anything as it goes.
+
+RunAhead stands in for the core, so outputs (and a snes.runloop.RunLoop)
+should be set up on it rather than on the core itself:
+
+	ahead = RunAhead(core, frames=1, max_cost=0.8 / 60)
+	loop = RunLoop(ahead)
+	pygame_output.set_video_refresh_cb(loop, paint_frame)
+"""
+import ctypes
+import time
+
+# How many frames the average cost is taken over.
+DEFAULT_COST_WINDOW = 60
+
+
+def _ignore(*args):
+	pass
+
+
+class RunAhead(object):
+	"""
+	Runs a core a few frames ahead of its real state.
+
+	The following attributes are available:
+
+		"frames" is the number of frames to run ahead; 0 runs frames
+		normally.
+
+		"enabled" is False if run-ahead is switched off. It's switched off
+		automatically if it costs more than "max_cost"; set it to True to
+		try again.
+
+		"last_cost" is how long the most recent frame took, including the
+		frames run ahead and saving and restoring state, in seconds.
+
+		"mean_cost" is the average of "last_cost" over the last
+		"cost_window" frames or so.
+	"""
+
+	def __init__(self, core, frames=1, max_cost=None,
+			cost_window=DEFAULT_COST_WINDOW, clock=time.time):
+		"""
+		Prepare to run the given core ahead.
+
+		"core" should be an instance of snes.core.EmulatedSNES or
+		retro.core.EmulatedSystem with a cartridge loaded.
+
+		"max_cost" is the longest that each frame may take, on average, in
+		seconds; usually a little less than the length of a frame. If None,
+		run-ahead is never switched off automatically.
+
+		"cost_window" is the number of frames the average cost is taken
+		over. Run-ahead isn't switched off until that many frames have run.
+
+		"clock" returns the current time in seconds.
+		"""
+		self.core = core
+		self.frames = frames
+		self.max_cost = max_cost
+		self.cost_window = cost_window
+		self.enabled = True
+
+		self.last_cost = 0.0
+		self.mean_cost = 0.0
+
+		self._clock = clock
+		self._measured = 0
+		self._state = None
+		self._present = True
+
+		self._video_callback = None
+		self._audio_callback = None
+
+	def __getattr__(self, name):
+		return getattr(self.core, name)
+
+	def set_video_refresh_cb(self, callback):
+		"""
+		Set the callback that presents frames.
+
+		"callback" is as for the core's set_video_refresh_cb(); while
+		running ahead, it's only given the last frame run ahead.
+		"""
+		self._video_callback = callback
+		self.core.set_video_refresh_cb(self._video_refresh)
+
+	def set_audio_sample_cb(self, callback):
+		"""
+		Set the callback that plays audio samples.
+
+		"callback" is as for the core's set_audio_sample_cb(); it's only
+		given the audio of real frames.
+		"""
+		self._audio_callback = callback
+		self.core.set_audio_sample_cb(callback)
+
+	def _video_refresh(self, *args):
+		if self._present and self._video_callback is not None:
+			self._video_callback(*args)
+
+	def _get_state_buffer(self):
+		size = self.core.serialize_size()
+		if self._state is None or ctypes.sizeof(self._state) != size:
+			self._state = ctypes.create_string_buffer(size)
+		return self._state
+
+	def _set_audio(self, callback):
+		if self._audio_callback is not None:
+			self.core.set_audio_sample_cb(callback)
+
+	def run(self):
+		"""
+		Run a single real frame, and present a frame from the future.
+		"""
+		if not self.enabled or self.frames <= 0:
+			self._present = True
+			self.core.run()
+			return
+
+		start = self._clock()
+		state = None
+
+		try:
+			# The real frame.
+			self._present = False
+			self.core.run()
+
+			# Only restore the buffer once it holds this frame's state.
+			buffer = self._get_state_buffer()
+			self.core.serialize_into(buffer)
+			state = buffer
+
+			# The future.
+			self._set_audio(_ignore)
+			for remaining in xrange(self.frames, 0, -1):
+				self._present = (remaining == 1)
+				self.core.run()
+		finally:
+			self._present = True
+			self._set_audio(self._audio_callback)
+
+			# Back to reality, even if the future went wrong.
+			if state is not None:
+				self.core.unserialize(state)
+
+		self._record_cost(self._clock() - start)
+
+	def _record_cost(self, cost):
+		self.last_cost = cost
+
+		self._measured += 1
+		weight = 1.0 / min(self._measured, self.cost_window)
+		self.mean_cost += (cost - self.mean_cost) * weight
+
+		if (self.max_cost is not None
+				and self._measured >= self.cost_window
+				and self.mean_cost > self.max_cost):
+			# The host can't afford it.
+			self.enabled = False
+			self._measured = 0
+			self.mean_cost = 0.0
@@ -0,0 +1,234 @@
+"""
+A run loop for interactive front-ends.
+
+The demo front-ends used to run one frame and present one frame, over and
+over. That's fine on a fast machine, but on a slow one the game runs in slow
+motion, and there's no way to hurry through a long movie.
+
+RunLoop runs the emulated SNES at its exact frame rate instead, paced by a
+snes.pacing.FramePacer:
+
+	- If the host falls behind (because emulating and presenting a frame
+	  takes longer than the SNES would), frames are run with video delivery
+	  suppressed until it catches up, up to "max_frameskip" frames in a row.
+	  Emulation stays real-time; only the picture gets choppier.
+
+	- If the host is ahead, it sleeps until the next frame is due. Call
+	  sync_to_audio() to keep the schedule in step with the sound card.
+
+	- In fast-forward mode, frames are run as fast as possible, audio is
+	  muted, and only one frame per refresh period of real time is
+	  presented.
+
+RunLoop stands in for the core, so video and audio outputs should be set up
+on it rather than on the core itself:
+
+	loop = RunLoop(core)
+	pygame_output.set_video_refresh_cb(loop, paint_frame)
+	audio = pygame_audio.set_audio_sample_cb(loop)
+	loop.sync_to_audio(audio)
+
+	while running:
+		loop.run_frame()
+
+The "fps" attribute reports the effective emulated frame rate, updated about
+once a second.
+"""
+import time
+from snes import pacing
+
+# The most frames in a row that are run without being presented, while
+# catching up.
+DEFAULT_MAX_FRAMESKIP = 4
+
+# How often the fps statistics are updated.
+FPS_INTERVAL = 1.0 # seconds
+
+
+def _ignore(*args):
+	pass
+
+
+class RunLoop(object):
+	"""
+	Runs an emulated SNES in real time, skipping frames when necessary.
+
+	The following attributes are available:
+
+		"fps" is the number of frames emulated per second of real time,
+		measured over the last FPS_INTERVAL or so.
+
+		"presented_fps" is the number of those frames that were presented.
+
+		"frames_run" and "frames_skipped" count every frame run, and every
+		frame run without being presented.
+
+		"pacer" is the snes.pacing.FramePacer that schedules frames.
+	"""
+
+	def __init__(self, core, max_frameskip=DEFAULT_MAX_FRAMESKIP,
+			mute_fast_forward=True, clock=time.time,
+			sleep=pacing.precise_sleep):
+		"""
+		Prepare to run the given core.
+
+		"core" should be an instance of snes.core.EmulatedSNES or
+		retro.core.EmulatedSystem with a cartridge loaded, or anything that
+		stands in for one, such as a snes.video.presenter.ThreadedPresenter.
+
+		"max_frameskip" is the most frames in a row that may be run without
+		presenting them. 0 disables frameskip.
+
+		If "mute_fast_forward" is False, audio is still delivered while
+		fast-forwarding, which is useful when it's being recorded.
+
+		"clock" and "sleep" are the functions used to tell and pass the
+		time.
+		"""
+		self.core = core
+		self.max_frameskip = max_frameskip
+		self.mute_fast_forward = mute_fast_forward
+		self.pacer = pacing.FramePacer(pacing.core_timing(core)[0], clock,
+				sleep)
+		self.period = self.pacer.period
+
+		self._clock = clock
+
+		self._video_callback = None
+		self._audio_callback = None
+		self._present = True
+		self._fast_forward = False
+
+		self._started = False
+		self._present_deadline = None
+		self._skipped = 0
+
+		self.frames_run = 0
+		self.frames_skipped = 0
+		self.fps = 0.0
+		self.presented_fps = 0.0
+		self._fps_start = None
+		self._fps_frames = 0
+		self._fps_presented = 0
+
+	def __getattr__(self, name):
+		return getattr(self.core, name)
+
+	def set_video_refresh_cb(self, callback):
+		"""
+		Set the callback that presents frames.
+
+		"callback" is as for the core's set_video_refresh_cb(); it isn't
+		called for skipped frames.
+		"""
+		self._video_callback = callback
+		self.core.set_video_refresh_cb(self._video_refresh)
+
+	def set_audio_sample_cb(self, callback):
+		"""
+		Set the callback that plays audio samples.
+
+		"callback" is as for the core's set_audio_sample_cb(); it isn't
+		called while fast-forwarding, unless "mute_fast_forward" is False.
+		"""
+		self._audio_callback = callback
+		self._update_audio()
+
+	def _update_audio(self):
+		if self._audio_callback is None:
+			return
+
+		if self._fast_forward and self.mute_fast_forward:
+			self.core.set_audio_sample_cb(_ignore)
+		else:
+			# Samples go straight to the real callback, so there's no
+			# overhead for each one.
+			self.core.set_audio_sample_cb(self._audio_callback)
+
+	def _video_refresh(self, *args):
+		if self._present and self._video_callback is not None:
+			self._video_callback(*args)
+
+	@property
+	def fast_forward(self):
+		"""
+		True if frames are run as fast as possible.
+
+		Set it to switch fast-forward mode on or off.
+		"""
+		return self._fast_forward
+
+	@fast_forward.setter
+	def fast_forward(self, value):
+		self._fast_forward = bool(value)
+		self._update_audio()
+
+		# Start pacing afresh, rather than trying to catch up (or wait for)
+		# frames run at the other speed.
+		self._started = False
+
+	def sync_to_audio(self, output, target_depth=None, sample_rate=None):
+		"""
+		Keep the schedule in step with the given audio output's clock.
+
+		The parameters are as for snes.pacing.FramePacer.sync_to_audio().
+		"""
+		self.pacer.sync_to_audio(output, target_depth, sample_rate)
+
+	def _should_present(self, now):
+		if self._fast_forward:
+			if now < self._present_deadline:
+				return False
+
+			self._present_deadline += self.period
+			if now > self._present_deadline:
+				self._present_deadline = now
+			return True
+
+		late = self.pacer.lateness(now)
+		return late < self.period or self._skipped >= self.max_frameskip
+
+	def run_frame(self):
+		"""
+		Run a single frame, then wait until the next is due.
+
+		Returns True if the frame was presented, False if it was skipped.
+		"""
+		now = self._clock()
+		if not self._started:
+			self._started = True
+			self.pacer.reset(now)
+			self._present_deadline = now
+		self._update_fps(now)
+
+		self._present = self._should_present(now)
+		self.core.run()
+		self.frames_run += 1
+		self._fps_frames += 1
+
+		if self._present:
+			self._skipped = 0
+			self._fps_presented += 1
+		else:
+			self._skipped += 1
+			self.frames_skipped += 1
+
+		if not self._fast_forward:
+			self.pacer.wait()
+
+		return self._present
+
+	def _update_fps(self, now):
+		if self._fps_start is None:
+			self._fps_start = now
+
+		elapsed = now - self._fps_start
+		if elapsed < FPS_INTERVAL:
+			return
+
+		self.fps = self._fps_frames / elapsed
+		self.presented_fps = self._fps_presented / elapsed
+
+		self._fps_start = now
+		self._fps_frames = 0
+		self._fps_presented = 0
@@ -1,5 +1,6 @@
 #!/usr/bin/python
 import unittest
+import ctypes
 from snes import exceptions as EX
 from snes.test import util
 
@@ -133,6 +134,23 @@ class TestSNESCore(util.SNESTestCase):
 				60,
 			)
 
+	def test_serialize_into(self):
+		"""
+		State can be saved into, and restored from, a reusable buffer.
+		"""
+		self._loadTestCart()
+
+		buf = ctypes.create_string_buffer(self.core.serialize_size())
+		self.core.serialize_into(buf)
+		self.assertEqual(buf.raw, self.core.serialize())
+
+		self.core.run()
+		self.core.unserialize(buf)
+		self.assertEqual(self.core.serialize(), buf.raw)
+
+		self.assertRaises(ValueError, self.core.serialize_into,
+				ctypes.create_string_buffer(1))
+
 	def test_get_library_info(self):
 		"""
 		libsnes can identify itself with plausible info.
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+import unittest
+import os
+import os.path
+import shutil
+from tempfile import mkdtemp
+import numpy
+from snes import golden, testing
+from snes.video.frame import Frame
+
+class TestGoldenStore(unittest.TestCase):
+
+	def setUp(self):
+		self.path = mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def _make_test_frame(self, colour=0x7C00):
+		pixels = numpy.zeros( (4, 8), dtype=numpy.uint16 )
+		pixels[1,2] = colour
+		return Frame(pixels)
+
+	def _count_stored_frames(self):
+		return sum(
+				len(filenames)
+				for _, _, filenames in os.walk(os.path.join(self.path, "frames"))
+			)
+
+	def test_frame_encoding(self):
+		"""
+		decode_frame() reverses encode_frame().
+		"""
+		original = self._make_test_frame()
+		original.overscan = True
+
+		actual = golden.decode_frame(golden.encode_frame(original))
+
+		self.assertEqual(actual.pixels.tolist(), original.pixels.tolist())
+		self.assertEqual(actual.hires, False)
+		self.assertEqual(actual.interlace, False)
+		self.assertEqual(actual.overscan, True)
+
+	def test_missing_frame(self):
+		"""
+		Checking against a frame that isn't in the store fails.
+		"""
+		store = golden.GoldenStore(self.path)
+
+		self.assertEqual(
+				store.check("missing", self._make_test_frame()),
+				(False, "No golden frame named 'missing'"),
+			)
+
+	def test_accept_and_check(self):
+		"""
+		Accepted frames are saved, and later checks compare against them.
+		"""
+		store = golden.GoldenStore(self.path, accept=True)
+		self.assertEqual(
+				store.check("test", self._make_test_frame()),
+				(True, ""),
+			)
+		store.save()
+
+		store = golden.GoldenStore(self.path)
+		self.assertEqual(
+				store.check("test", self._make_test_frame()),
+				(True, ""),
+			)
+
+		result, reason = store.check("test", self._make_test_frame(0x03E0))
+		self.assertEqual(result, False)
+		self.assertTrue(reason.startswith("Image differences found."),
+				reason)
+
+		# ...unless the difference is within tolerance.
+		self.assertEqual(
+				store.check("test", self._make_test_frame(0x03E0),
+					max_pixels=1),
+				(True, ""),
+			)
+
+	def test_record(self):
+		"""
+		Frames accepted by one copy of a store can be recorded by another.
+		"""
+		worker = golden.GoldenStore(self.path, accept=True)
+		parent = golden.GoldenStore(self.path, accept=True)
+
+		worker.check("test", self._make_test_frame())
+		accepted = worker.take_accepted()
+		self.assertEqual(accepted,
+				[("test", self._make_test_frame().digest)])
+		self.assertEqual(worker.take_accepted(), [])
+
+		for name, digest in accepted:
+			parent.record(name, digest)
+		parent.save()
+
+		store = golden.GoldenStore(self.path)
+		self.assertEqual(store.check("test", self._make_test_frame()),
+				(True, ""))
+
+	def test_deduplication(self):
+		"""
+		Identical frames under different names are only stored once.
+		"""
+		store = golden.GoldenStore(self.path)
+		store.accept("first", self._make_test_frame())
+		store.accept("second", self._make_test_frame())
+
+		self.assertEqual(store.get_digest("first"),
+				store.get_digest("second"))
+		self.assertEqual(self._count_stored_frames(), 1)
+
+		store.accept("second", self._make_test_frame(0x03E0))
+		self.assertEqual(self._count_stored_frames(), 2)
+
+		# Frames nobody refers to any more can be removed.
+		store.accept("first", self._make_test_frame(0x03E0))
+		self.assertEqual(store.prune(), 1)
+		self.assertEqual(self._count_stored_frames(), 1)
+
+	def test_pack(self):
+		"""
+		Packed frames can still be loaded and checked.
+		"""
+		store = golden.GoldenStore(self.path)
+		store.accept("first", self._make_test_frame())
+		store.accept("second", self._make_test_frame(0x03E0))
+		store.accept("third", self._make_test_frame(0x03E0))
+		store.save()
+
+		self.assertEqual(store.pack(), 2)
+		self.assertEqual(self._count_stored_frames(), 0)
+
+		store = golden.GoldenStore(self.path)
+		self.assertEqual(store.check("first", self._make_test_frame()),
+				(True, ""))
+		self.assertEqual(store.load(store.get_digest("third")).pixels.tolist(),
+				self._make_test_frame(0x03E0).pixels.tolist())
+
+		# Packed frames aren't stored again.
+		store.accept("fourth", self._make_test_frame())
+		self.assertEqual(self._count_stored_frames(), 0)
+
+		# Frames nobody refers to are left out of the next pack.
+		store.accept("first", self._make_test_frame(0x001F))
+		store.accept("fourth", self._make_test_frame(0x001F))
+		self.assertEqual(self._count_stored_frames(), 1)
+		self.assertEqual(store.pack(), 2)
+		self.assertEqual(self._count_stored_frames(), 0)
+
+	def test_pack_error(self):
+		"""
+		If packing fails, the old archive is kept and nothing is left open.
+		"""
+		store = golden.GoldenStore(self.path)
+		store.accept("first", self._make_test_frame())
+		store.pack()
+		store.accept("second", self._make_test_frame(0x03E0))
+
+		# Looking for "second" in the archive opened it.
+		old_pack = store._pack
+		self.assertTrue(old_pack is not None)
+
+		def broken(digest):
+			raise IOError("disk on fire")
+
+		load = store.load
+		store.load = broken
+		self.assertRaises(IOError, store.pack)
+		store.load = load
+
+		self.assertEqual(store._pack, None)
+		self.assertRaises(ValueError, old_pack.tag, 0)
+		self.assertEqual(sorted(os.listdir(self.path)),
+				["frames", "frames.snfa"])
+		self.assertEqual(store.load(store.get_digest("first")).pixels.tolist(),
+				self._make_test_frame().pixels.tolist())
+
+	def test_golden_frame_test(self):
+		"""
+		GoldenFrameTest checks frames against a GoldenStore.
+		"""
+		store = golden.GoldenStore(self.path)
+		store.accept("test", self._make_test_frame())
+
+		ft = testing.GoldenFrameTest(store, "test")
+		self.assertEqual(ft.count_tests(), 1)
+
+		self.assertEqual(
+				list(ft.test(self._make_test_frame())),
+				[("video frame", True, "")],
+			)
+
+		self.assertEqual(
+				list(ft.test(self._make_test_frame(0x03E0)))[0][:2],
+				("video frame", False),
+			)
+
+		ts = testing.TestScript()
+		ts.add_frametest(1, ft)
+		ts.add_frametest(2, testing.GoldenFrameTest(store, "other"))
+		ts.add_frametest(3, testing.FrameTest(None))
+		self.assertEqual(ts.golden_stores(), [store])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+import unittest
+from retro.globals import retro_system_av_info
+from snes import pacing as P
+
+
+class FakeClock(object):
+	"""
+	A clock whose sleeps overshoot by "overshoot" seconds, and whose zero
+	sleeps (yields) take "tick" seconds.
+	"""
+
+	def __init__(self, overshoot=0.0, tick=0.0001):
+		self.now = 0.0
+		self.overshoot = overshoot
+		self.tick = tick
+		self.sleeps = []
+
+	def clock(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		if seconds:
+			self.now += seconds + self.overshoot
+		else:
+			self.now += self.tick
+
+
+class FakeAudio(object):
+
+	latency = 512
+	device_frequency = 48000
+
+	def __init__(self, queue_depth):
+		self.queue_depth = queue_depth
+		self.adjust_rate = True
+
+
+class FakeSNES(object):
+
+	def __init__(self, refresh_rate):
+		self.refresh_rate = refresh_rate
+
+	def get_refresh_rate(self):
+		return self.refresh_rate
+
+
+class FakeRetro(FakeSNES):
+
+	def get_system_av_info(self):
+		res = retro_system_av_info()
+		res.timing.fps = 59.94
+		res.timing.sample_rate = 44100.0
+		return res
+
+
+class TestCoreTiming(unittest.TestCase):
+
+	def test_snes(self):
+		"""
+		libsnes cores run at the SNES's exact rate for their region.
+		"""
+		rate, sample_rate = P.core_timing(FakeSNES(60))
+		self.assertAlmostEqual(rate, 60.0988, 4)
+		self.assertEqual(sample_rate, 32040)
+
+		rate, sample_rate = P.core_timing(FakeSNES(50))
+		self.assertAlmostEqual(rate, 50.007, 3)
+
+	def test_retro(self):
+		"""
+		libretro cores report their own timing.
+		"""
+		self.assertEqual(P.core_timing(FakeRetro(60)), (59.94, 44100.0))
+
+
+class TestPreciseSleep(unittest.TestCase):
+
+	def test_precise_sleep(self):
+		"""
+		precise_sleep() yields for the last part of the wait, instead of
+		oversleeping.
+		"""
+		clock = FakeClock(overshoot=0.001)
+
+		P.precise_sleep(0.01, clock.clock, clock.sleep)
+
+		self.assertAlmostEqual(clock.sleeps[0], 0.01 - P.SPIN_TIME)
+		self.assertTrue(0.01 <= clock.now < 0.0102)
+
+		# Short sleeps are all yielding.
+		clock = FakeClock()
+		P.precise_sleep(0.001, clock.clock, clock.sleep)
+		self.assertEqual(set(clock.sleeps), set([0]))
+
+
+class TestFramePacer(unittest.TestCase):
+
+	def test_no_drift(self):
+		"""
+		Oversleeping one frame is made up for by the next.
+		"""
+		clock = FakeClock(overshoot=0.002)
+		pacer = P.FramePacer(50, clock.clock, clock.sleep)
+
+		pacer.reset()
+		for _ in xrange(50):
+			pacer.wait()
+
+		self.assertAlmostEqual(pacer.deadline, 1.0)
+		self.assertAlmostEqual(clock.now, 1.002)
+		self.assertAlmostEqual(clock.sleeps[1], 0.018)
+
+	def test_lateness(self):
+		"""
+		Frames that are late aren't waited for, unless they're hopelessly
+		late.
+		"""
+		clock = FakeClock()
+		pacer = P.FramePacer(50, clock.clock, clock.sleep)
+		pacer.reset()
+
+		clock.now = 0.05
+		self.assertAlmostEqual(pacer.lateness(), 0.05)
+		self.assertEqual(pacer.wait(), 0.0)
+		self.assertAlmostEqual(pacer.deadline, 0.02)
+
+		clock.now = 1.0
+		pacer.wait()
+		self.assertEqual(pacer.resets, 1)
+		self.assertEqual(pacer.deadline, 1.0)
+
+	def test_audio_sync(self):
+		"""
+		Frames are stretched when too much audio is queued, and shrunk when
+		too little is.
+		"""
+		clock = FakeClock()
+		pacer = P.FramePacer(50, clock.clock, clock.sleep)
+		audio = FakeAudio(1024)
+		pacer.sync_to_audio(audio)
+
+		pacer.reset()
+		pacer.wait()
+		self.assertAlmostEqual(pacer.deadline, 0.02)
+
+		audio.queue_depth = 1024 + 480
+		pacer.wait()
+		self.assertAlmostEqual(pacer.deadline - 0.02, 0.02 * 1.0025)
+
+		audio.queue_depth = 0
+		pacer.wait()
+		self.assertAlmostEqual(pacer.deadline - 0.02 * 2.0025,
+				0.02 * (1 - P.MAX_AUDIO_SKEW))
+
+		# Only the pacer steers the queue depth.
+		self.assertFalse(audio.adjust_rate)
+
+		pacer.sync_to_audio(None)
+		self.assertTrue(audio.adjust_rate)
+		pacer.wait()
+		self.assertAlmostEqual(pacer.deadline - 0.02 * (3.0025 - 0.005),
+				0.02)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+import struct
+import unittest
+from snes import runahead as R
+
+_state_struct = struct.Struct('<I')
+
+
+class FakeCore(object):
+	"""
+	A core whose state is just the number of frames it has run.
+	"""
+
+	def __init__(self):
+		self.frame = 0
+		self.video_refresh = None
+		self.audio_sample = None
+
+	def set_video_refresh_cb(self, callback):
+		self.video_refresh = callback
+
+	def set_audio_sample_cb(self, callback):
+		self.audio_sample = callback
+
+	def run(self):
+		self.frame += 1
+		self.audio_sample(self.frame, 0)
+		self.video_refresh(self.frame, 256, 224, False, False, False, 1024)
+
+	def serialize_size(self):
+		return _state_struct.size
+
+	def serialize_into(self, buffer):
+		_state_struct.pack_into(buffer, 0, self.frame)
+
+	def unserialize(self, state):
+		self.frame, = _state_struct.unpack_from(state)
+
+
+class FakeClock(object):
+
+	def __init__(self, step):
+		self.now = 0.0
+		self.step = step
+
+	def clock(self):
+		self.now += self.step
+		return self.now
+
+
+class TestRunAhead(unittest.TestCase):
+
+	def setUp(self):
+		self.core = FakeCore()
+		self.clock = FakeClock(0.01)
+
+		self.frames = []
+		self.samples = []
+
+	def make(self, **kwargs):
+		res = R.RunAhead(self.core, clock=self.clock.clock, **kwargs)
+		res.set_video_refresh_cb(lambda data, *args: self.frames.append(data))
+		res.set_audio_sample_cb(
+				lambda left, right: self.samples.append(left))
+		return res
+
+	def test_run_ahead(self):
+		"""
+		The future is shown, but only real frames are heard and kept.
+		"""
+		ahead = self.make(frames=2)
+
+		for _ in xrange(3):
+			ahead.run()
+
+		self.assertEqual(self.frames, [3, 4, 5])
+		self.assertEqual(self.samples, [1, 2, 3])
+		self.assertEqual(self.core.frame, 3)
+
+		# The state buffer is reused.
+		state = ahead._state
+		ahead.run()
+		self.assertTrue(ahead._state is state)
+
+	def test_disabled(self):
+		"""
+		With run-ahead disabled, frames are run normally.
+		"""
+		ahead = self.make(frames=0)
+		ahead.run()
+		ahead.frames = 1
+		ahead.enabled = False
+		ahead.run()
+
+		self.assertEqual(self.frames, [1, 2])
+		self.assertEqual(self.samples, [1, 2])
+
+	def test_cost(self):
+		"""
+		Run-ahead switches itself off if it costs too much.
+		"""
+		ahead = self.make(max_cost=0.005, cost_window=4)
+
+		for _ in xrange(3):
+			ahead.run()
+			self.assertTrue(ahead.enabled)
+		self.assertAlmostEqual(ahead.last_cost, 0.01)
+		self.assertAlmostEqual(ahead.mean_cost, 0.01)
+
+		ahead.run()
+		self.assertFalse(ahead.enabled)
+
+		self.frames[:] = []
+		ahead.run()
+		self.assertEqual(self.frames, [5])
+
+	def test_affordable(self):
+		"""
+		Run-ahead stays on while the host can afford it.
+		"""
+		ahead = self.make(max_cost=0.02, cost_window=4)
+
+		for _ in xrange(10):
+			ahead.run()
+
+		self.assertTrue(ahead.enabled)
+
+	def test_error(self):
+		"""
+		If running ahead fails, the real state and audio are put back.
+		"""
+		ahead = self.make()
+		ahead.run()
+
+		def broken(*args):
+			raise ValueError("broken")
+
+		ahead.set_video_refresh_cb(broken)
+		self.assertRaises(ValueError, ahead.run)
+
+		self.assertEqual(self.core.frame, 2)
+		self.assertEqual(self.samples, [1, 2])
+		self.assertTrue(self.core.audio_sample is ahead._audio_callback)
+
+	def test_serialize_error(self):
+		"""
+		If saving state fails, no stale state is restored.
+		"""
+		ahead = self.make()
+		ahead.run()
+
+		def broken(buffer):
+			raise ValueError("broken")
+
+		self.core.serialize_into = broken
+		self.assertRaises(ValueError, ahead.run)
+
+		self.assertEqual(self.core.frame, 2)
+		self.assertEqual(self.samples, [1, 2])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+import unittest
+from snes import runloop as R
+
+
+class FakeClock(object):
+
+	def __init__(self):
+		self.now = 0.0
+		self.slept = []
+
+	def clock(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.slept.append(seconds)
+		self.now += seconds
+
+
+class FakeAVInfo(object):
+
+	class timing(object):
+		fps = 50.0
+		sample_rate = 32000.0
+
+
+class FakeCore(object):
+	"""
+	A 50Hz core whose frames take "frame_time" seconds to run.
+	"""
+
+	def __init__(self, clock):
+		self.clock = clock
+		self.frame_time = 0.0
+		self.video_refresh = None
+		self.audio_sample = None
+
+	def get_system_av_info(self):
+		return FakeAVInfo()
+
+	def set_video_refresh_cb(self, callback):
+		self.video_refresh = callback
+
+	def set_audio_sample_cb(self, callback):
+		self.audio_sample = callback
+
+	def run(self):
+		self.clock.now += self.frame_time
+		self.audio_sample(1, 2)
+		self.video_refresh(None, 256, 224, False, False, False, 1024)
+
+
+class TestRunLoop(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.core = FakeCore(self.clock)
+		self.loop = R.RunLoop(self.core, clock=self.clock.clock,
+				sleep=self.clock.sleep)
+
+		self.frames = []
+		self.samples = []
+		self.loop.set_video_refresh_cb(
+				lambda *args: self.frames.append(args))
+		self.loop.set_audio_sample_cb(
+				lambda left, right: self.samples.append(left))
+
+	def test_real_time(self):
+		"""
+		Fast hosts wait for each frame, and present every one.
+		"""
+		self.core.frame_time = 0.005
+
+		for _ in xrange(100):
+			self.assertTrue(self.loop.run_frame())
+
+		self.assertEqual(len(self.frames), 100)
+		self.assertEqual(self.loop.frames_skipped, 0)
+		self.assertAlmostEqual(self.clock.now, 2.0)
+		self.assertAlmostEqual(self.loop.fps, 50.0)
+
+	def test_frameskip(self):
+		"""
+		Slow hosts skip presenting frames to keep up.
+		"""
+		def slow_present(*args):
+			self.frames.append(args)
+			self.clock.now += 0.025
+
+		self.loop.set_video_refresh_cb(slow_present)
+
+		for _ in xrange(100):
+			self.loop.run_frame()
+
+		# Presenting takes a quarter longer than a frame, so about one frame
+		# in five is skipped, but every frame is still run in real time.
+		self.assertEqual(self.loop.frames_run, 100)
+		self.assertEqual(len(self.samples), 100)
+		self.assertAlmostEqual(self.loop.frames_skipped, 20, delta=2)
+		self.assertAlmostEqual(self.clock.now, 2.0, delta=0.05)
+
+	def test_max_frameskip(self):
+		"""
+		No more than max_frameskip frames are skipped in a row.
+		"""
+		self.core.frame_time = 0.1
+		self.loop.max_frameskip = 2
+
+		presented = [self.loop.run_frame() for _ in xrange(10)]
+
+		# After falling more than MAX_LAG behind, the loop stops trying to
+		# catch up, and presents the next frame.
+		self.assertEqual(presented,
+				[True, False, False, True, True, False, False, True, True,
+					False])
+
+	def test_fast_forward(self):
+		"""
+		Fast-forward runs frames flat out, muted, presenting one per
+		refresh period.
+		"""
+		self.core.frame_time = 0.0045
+		self.loop.fast_forward = True
+
+		for _ in xrange(400):
+			self.loop.run_frame()
+
+		self.assertEqual(self.clock.slept, [])
+		self.assertEqual(self.samples, [])
+		self.assertEqual(len(self.frames), 90)
+		self.assertAlmostEqual(self.loop.fps, 1 / 0.0045, 3)
+		self.assertAlmostEqual(self.loop.presented_fps, 50.0, delta=1)
+
+		self.loop.fast_forward = False
+		self.loop.run_frame()
+		self.assertEqual(len(self.samples), 1)
+		self.assertEqual(len(self.frames), 91)
+
+	def test_unmuted_fast_forward(self):
+		"""
+		Audio can be kept while fast-forwarding.
+		"""
+		self.loop.mute_fast_forward = False
+		self.loop.fast_forward = True
+		self.loop.run_frame()
+
+		self.assertEqual(self.samples, [1])
+
+
+if __name__ == "__main__":
+	unittest.main()
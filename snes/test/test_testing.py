@@ -47,16 +47,102 @@ class TestFrameTest(unittest.TestCase):
 
 		# Make a bad frame that differs in dimensions, so that we get a string
 		# difference that we can predict.
-		badFrame = self.goodFrame.resize( (256, 448) )
+		badFrame = self.goodFrame.resize( (256, 239) )
 
 		testiter = ft.test(badFrame)
 
 		self.assertEqual(
 				testiter.next(),
 				("video frame", False,
-					"Images have different sizes (256x448 vs. 256x224)"),
+					"Images have different sizes (256x239 vs. 256x224)"),
 			)
 
+		# An interlaced frame of the same picture is not a difference.
+		interlacedFrame = self.goodFrame.resize( (256, 448) )
+
+		self.assertEqual(
+				ft.test(interlacedFrame).next(),
+				("video frame", True, ""),
+			)
+
+	def test_video_tests_tolerance(self):
+		"""
+		A FrameTest with a tolerance passes frames that are close enough.
+		"""
+		ft = testing.FrameTest(util.TEST_GOOD_FRAME_PATH, max_pixels=1)
+
+		nearFrame = self.goodFrame.convert("RGB")
+		r, g, b = nearFrame.getpixel((0,0))
+		nearFrame.putpixel((0,0), (r ^ 0xff, g, b))
+
+		self.assertEqual(
+				ft.test(nearFrame).next(),
+				("video frame", True, ""),
+			)
+
+		# Two pixels is too many, though.
+		nearFrame.putpixel((1,0), (r ^ 0xff, g, b))
+
+		testname, result, reason = ft.test(nearFrame).next()
+		self.assertEqual(result, False)
+		self.assertTrue(reason.startswith("Image differences found."),
+				reason)
+
+	def test_cache_key(self):
+		"""
+		FrameTests checking different things have different cache keys.
+		"""
+		key = testing.FrameTest(util.TEST_GOOD_FRAME_PATH).cache_key()
+
+		self.assertEqual(key,
+				testing.FrameTest(util.TEST_GOOD_FRAME_PATH).cache_key())
+
+		self.assertNotEqual(key,
+				testing.FrameTest(util.TEST_BAD_FRAME_PATH).cache_key())
+
+		self.assertNotEqual(key,
+				testing.FrameTest(util.TEST_GOOD_FRAME_PATH,
+					max_pixels=1).cache_key())
+
+		self.assertNotEqual(key, testing.FrameTest().cache_key())
+
+
+class TestCheckpointCache(unittest.TestCase):
+
+	def test_find(self):
+		"""
+		CheckpointCache.find returns the latest state in the given range.
+		"""
+		cache = testing.CheckpointCache()
+		cache.store("a", 300, "state-a-300")
+		cache.store("a", 600, "state-a-600")
+		cache.store("b", 450, "state-b-450")
+
+		self.assertEqual(cache.find("a", 0, 900), (600, "state-a-600"))
+		self.assertEqual(cache.find("a", 0, 599), (300, "state-a-300"))
+		self.assertEqual(cache.find("a", 0, 300), (300, "state-a-300"))
+		self.assertEqual(cache.find("a", 0, 299), None)
+
+		# States we've already passed aren't useful.
+		self.assertEqual(cache.find("a", 300, 599), None)
+
+		# States from other prefixes aren't useful either.
+		self.assertEqual(cache.find("b", 0, 900), (450, "state-b-450"))
+		self.assertEqual(cache.find("c", 0, 900), None)
+
+	def test_limit(self):
+		"""
+		CheckpointCache discards the oldest states beyond its limit.
+		"""
+		cache = testing.CheckpointCache(limit=2)
+		cache.store("a", 300, "state-a-300")
+		cache.store("a", 600, "state-a-600")
+		cache.store("a", 900, "state-a-900")
+
+		self.assertEqual(cache.find("a", 0, 599), None)
+		self.assertEqual(cache.find("a", 0, 600), (600, "state-a-600"))
+		self.assertEqual(cache.find("a", 0, 900), (900, "state-a-900"))
+
 
 class TestTestScript(util.SNESTestCase):
 
@@ -137,6 +223,44 @@ class TestTestScript(util.SNESTestCase):
 				results[1][3],
 			)
 
+	def test_checkpoints(self):
+		"""
+		TestScripts sharing a CheckpointCache skip frames already emulated.
+		"""
+		checkpoints = testing.CheckpointCache()
+
+		ts1 = self._make_dummy_test_script()
+		ts1.add_frametest(30, testing.FrameTest())
+		self.assertEqual(list(ts1.test(self.core, checkpoints)), [])
+
+		ts2 = self._make_dummy_test_script()
+		ts2.add_frametest(60, testing.FrameTest(util.TEST_GOOD_FRAME_PATH))
+		self.assertEqual(ts1.prefix_key(), ts2.prefix_key())
+
+		self.assertEqual(
+				list(ts2.test(self.core, checkpoints)),
+				[(60, "video frame", True, "")],
+			)
+
+		# Starting from ts1's checkpoint at frame 30, ts2 should have saved
+		# a checkpoint of its own.
+		self.assertEqual(checkpoints.find(ts2.prefix_key(), 30, 60)[0], 60)
+
+	def test_prefix_key(self):
+		"""
+		TestScripts that set up the SNES differently have different prefixes.
+		"""
+		ts1 = self._make_dummy_test_script()
+		ts2 = self._make_dummy_test_script()
+		self.assertEqual(ts1.prefix_key(), ts2.prefix_key())
+
+		ts2.set_controllers(core.DEVICE_JOYPAD)
+		self.assertNotEqual(ts1.prefix_key(), ts2.prefix_key())
+
+		ts2.set_controllers(core.DEVICE_NONE, core.DEVICE_NONE)
+		ts2.load_cartridge_normal("not a real cartridge")
+		self.assertNotEqual(ts1.prefix_key(), ts2.prefix_key())
+
 	def test_set_controllers(self):
 		"""
 		TestScript.set_controllers stores the values it's given.
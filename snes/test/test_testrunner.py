@@ -0,0 +1,319 @@
+#!/usr/bin/python
+import unittest
+import os.path
+import shutil
+import warnings
+from tempfile import mkdtemp
+from snes import core, golden, testing, testrunner
+from snes.test import util
+
+class RunnerTestCase(util.SNESTestCase):
+
+	def setUp(self):
+		# Find a libsnes implementation the workers can use, then release it
+		# so they can load it themselves.
+		util.SNESTestCase.setUp(self)
+		self.libname = self.core._libname
+		self.core.close()
+
+	def tearDown(self):
+		pass
+
+	def _make_test_script(self, frames):
+		ts = testing.TestScript()
+
+		with open(util.TEST_ROM_PATH, "rb") as handle:
+			ts.load_cartridge_normal(handle.read())
+
+		ts.set_controllers(core.DEVICE_NONE, core.DEVICE_NONE)
+
+		for frame_num, path in frames:
+			ts.add_frametest(frame_num, testing.FrameTest(path))
+
+		return ts
+
+
+class TestMakeTasks(unittest.TestCase):
+
+	def _make_test_script(self, cartridge, frame_num):
+		ts = testing.TestScript()
+		ts.load_cartridge_normal(cartridge)
+		ts.set_controllers(core.DEVICE_NONE, core.DEVICE_NONE)
+		ts.add_frametest(frame_num, testing.FrameTest())
+		return ts
+
+	def test_grouping(self):
+		"""
+		Scripts with a common prefix are run together, shortest first.
+		"""
+		scripts = [
+				self._make_test_script("cart A", 900),
+				self._make_test_script("cart B", 100),
+				self._make_test_script("cart A", 300),
+				self._make_test_script("cart A", 600),
+			]
+
+		self.assertEqual(
+				testrunner._make_tasks(scripts, True),
+				[[2, 3, 0], [1]],
+			)
+
+	def test_splitting(self):
+		"""
+		Groups are split so every worker has something to do.
+		"""
+		scripts = [
+				self._make_test_script("cart A", frame_num)
+				for frame_num in (500, 100, 400, 200, 300)
+			]
+
+		self.assertEqual(
+				testrunner._make_tasks(scripts, True, processes=2),
+				[[4, 2, 0], [1, 3]],
+			)
+		self.assertEqual(
+				testrunner._make_tasks(scripts, True, processes=4),
+				[[2, 0], [4], [3], [1]],
+			)
+
+		# There's no point splitting a group for a single worker, or
+		# splitting single scripts.
+		self.assertEqual(len(testrunner._make_tasks(scripts, True)), 1)
+		self.assertEqual(
+				len(testrunner._make_tasks(scripts, True, processes=10)), 5)
+
+	def test_no_grouping(self):
+		"""
+		Without checkpoints, every script is run separately.
+		"""
+		scripts = [
+				self._make_test_script("cart A", 900),
+				self._make_test_script("cart A", 300),
+			]
+
+		self.assertEqual(
+				testrunner._make_tasks(scripts, False),
+				[[0], [1]],
+			)
+
+
+class TestResultCache(unittest.TestCase):
+
+	def setUp(self):
+		self.path = mkdtemp()
+		self.cache = testrunner.ResultCache(self.path)
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def _make_test_script(self, cartridge="cart A", expected=None):
+		ts = testing.TestScript()
+		ts.load_cartridge_normal(cartridge)
+		ts.set_controllers(core.DEVICE_NONE, core.DEVICE_NONE)
+		ts.add_frametest(60, testing.FrameTest(expected))
+		return ts
+
+	def test_library_digest(self):
+		"""
+		library_digest hashes library files, and gives up on missing ones.
+		"""
+		libname = os.path.join(self.path, "libsnes-test.so")
+		with open(libname, "wb") as handle:
+			handle.write("not really a library")
+
+		self.assertEqual(testrunner.library_digest(libname),
+				"829a1502f894fa8252dadd44a7b7bc8e5e341074")
+
+		self.assertEqual(
+				testrunner.library_digest(os.path.join(self.path, "missing")),
+				None,
+			)
+
+	def test_resolve_library(self):
+		"""
+		Bare library names are resolved the way the dynamic loader does it.
+		"""
+		# zlib is about as widely installed as a shared library gets.
+		path = testrunner.resolve_library("libz.so.1", "zlibVersion")
+		if path is None:
+			self.skipTest("libz.so.1 can't be loaded")
+
+		self.assertTrue(os.path.isabs(path), path)
+		self.assertEqual(path, os.path.realpath(path))
+		self.assertEqual(testrunner.library_digest("libz.so.1", "zlibVersion"),
+				testrunner.library_digest(path))
+
+		self.assertEqual(testrunner.resolve_library("libsnes-missing.so"),
+				None)
+
+	def test_unknown_library(self):
+		"""
+		If the library can't be found, the runner warns that nothing will be
+		cached.
+		"""
+		runner = testrunner.ParallelTestRunner("libsnes-missing.so",
+				cache=self.cache)
+
+		with warnings.catch_warnings(record=True) as caught:
+			warnings.simplefilter("always")
+			list(runner.run([]))
+
+		self.assertEqual(len(caught), 1)
+		self.assertTrue("won't be cached" in str(caught[0].message))
+
+	def test_round_trip(self):
+		"""
+		Results put into the cache can be retrieved.
+		"""
+		key = self.cache.make_key("libdigest", self._make_test_script())
+		self.assertEqual(self.cache.get(key), None)
+
+		self.cache.put(key, [(60, "video frame", True, "")])
+		self.assertEqual(self.cache.get(key), [(60, "video frame", True, "")])
+
+	def test_invalidation(self):
+		"""
+		Changing the library, cartridge or expected frames changes the key.
+		"""
+		key = self.cache.make_key("libdigest", self._make_test_script())
+
+		self.assertEqual(key,
+				self.cache.make_key("libdigest", self._make_test_script()))
+
+		self.assertNotEqual(key,
+				self.cache.make_key("otherlib", self._make_test_script()))
+
+		self.assertNotEqual(key,
+				self.cache.make_key("libdigest",
+					self._make_test_script(cartridge="cart B")))
+
+		self.assertNotEqual(key,
+				self.cache.make_key("libdigest",
+					self._make_test_script(
+						expected=util.TEST_GOOD_FRAME_PATH)))
+
+		# If we can't identify the library, we can't cache anything.
+		self.assertEqual(
+				self.cache.make_key(None, self._make_test_script()),
+				None,
+			)
+
+
+class TestParallelTestRunner(RunnerTestCase):
+
+	def test_run(self):
+		"""
+		ParallelTestRunner runs every script and reports every result.
+		"""
+		scripts = [
+				self._make_test_script([(60, util.TEST_GOOD_FRAME_PATH)]),
+				self._make_test_script([(61, util.TEST_BAD_FRAME_PATH)]),
+				self._make_test_script([(62, util.TEST_GOOD_FRAME_PATH)]),
+			]
+
+		runner = testrunner.ParallelTestRunner(self.libname, processes=2)
+		results = sorted(runner.run(scripts))
+
+		self.assertEqual(len(results), 3)
+		self.assertEqual(results[0], (0, 60, "video frame", True, ""))
+		self.assertEqual(results[1][:4], (1, 61, "video frame", False))
+		self.assertEqual(results[2], (2, 62, "video frame", True, ""))
+
+		self.assertEqual(sorted(runner.wall_times.keys()), [0, 1, 2])
+
+	def test_cache(self):
+		"""
+		ParallelTestRunner skips scripts that have already passed.
+		"""
+		scripts = [
+				self._make_test_script([(60, util.TEST_GOOD_FRAME_PATH)]),
+				self._make_test_script([(61, util.TEST_BAD_FRAME_PATH)]),
+			]
+
+		path = mkdtemp()
+		try:
+			cache = testrunner.ResultCache(path)
+
+			runner = testrunner.ParallelTestRunner(self.libname, cache=cache)
+			list(runner.run(scripts))
+			self.assertEqual(runner.cached, set())
+
+			# The passing script is cached, the failing one isn't.
+			results = sorted(runner.run(scripts))
+			self.assertEqual(runner.cached, set([0]))
+			self.assertEqual(results[0], (0, 60, "video frame", True, ""))
+			self.assertEqual(results[1][:4], (1, 61, "video frame", False))
+			self.assertEqual(sorted(runner.wall_times.keys()), [1])
+
+			# With force, everything is run again.
+			runner.force = True
+			list(runner.run(scripts))
+			self.assertEqual(runner.cached, set())
+		finally:
+			shutil.rmtree(path)
+
+	def test_accept(self):
+		"""
+		Golden frames accepted by the workers are saved by the parent.
+		"""
+		path = mkdtemp()
+		try:
+			store = golden.GoldenStore(os.path.join(path, "golden"))
+			cache = testrunner.ResultCache(os.path.join(path, "cache"))
+
+			scripts = []
+			for frame_num in (60, 61):
+				ts = self._make_test_script([])
+				ts.add_frametest(frame_num,
+						testing.GoldenFrameTest(store, "frame %d" % frame_num))
+				scripts.append(ts)
+
+			runner = testrunner.ParallelTestRunner(self.libname, processes=2,
+					cache=cache, accept=True)
+			results = sorted(runner.run(scripts))
+			self.assertTrue(all(res[3] for res in results), results)
+			self.assertEqual(runner.accepted, 2)
+
+			# Accepted results aren't cached.
+			self.assertEqual(os.listdir(cache.path), [])
+
+			store = golden.GoldenStore(os.path.join(path, "golden"))
+			self.assertTrue(store.get_digest("frame 60") is not None)
+			self.assertTrue(store.get_digest("frame 61") is not None)
+		finally:
+			shutil.rmtree(path)
+
+	def test_failfast(self):
+		"""
+		With failfast set, ParallelTestRunner stops at the first failure.
+		"""
+		scripts = [
+				self._make_test_script([
+					(60, util.TEST_BAD_FRAME_PATH),
+					(61, util.TEST_BAD_FRAME_PATH),
+				]),
+			]
+
+		runner = testrunner.ParallelTestRunner(self.libname, failfast=True)
+		results = list(runner.run(scripts))
+
+		self.assertEqual(len(results), 1)
+		self.assertEqual(results[0][:4], (0, 60, "video frame", False))
+
+	def test_errors(self):
+		"""
+		Exceptions raised by a TestScript are reported as failures.
+		"""
+		# This script has no cartridge, so it raises TestSetupError.
+		scripts = [testing.TestScript()]
+
+		runner = testrunner.ParallelTestRunner(self.libname)
+		results = list(runner.run(scripts))
+
+		self.assertEqual(len(results), 1)
+		self.assertEqual(results[0][:4], (0, None, "error", False))
+		self.assertTrue("TestSetupError" in results[0][4], results[0][4])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,5 +1,6 @@
 #!/usr/bin/python
 import unittest
+import ctypes
 from snes import util
 
 class TestFramebufferDecoding(unittest.TestCase):
@@ -61,6 +62,39 @@ class TestFramebufferDecoding(unittest.TestCase):
 
 		self.assertEqual(actual_frame, expected_frame)
 
+	def test_frame_to_array(self):
+		"""
+		snes_framebuffer_to_array views the visible pixels of a frame.
+		"""
+		snes_frame = (ctypes.c_uint16 * 8)(
+				0x7C00, 0x03E0, 0x0000, 0x0000, # Red  Green Pad Pad
+				0x001F, 0x0000, 0x0000, 0x0000, # Blue Black Pad Pad
+			)
+
+		for data in (
+				list(snes_frame),
+				ctypes.cast(snes_frame, ctypes.POINTER(ctypes.c_uint16)),
+				ctypes.addressof(snes_frame),
+			):
+			actual = util.snes_framebuffer_to_array(data, 2, 2, 4)
+
+			self.assertEqual(actual.tolist(), [
+					[0x7C00, 0x03E0],
+					[0x001F, 0x0000],
+				])
+
+	def test_array_to_RGB888(self):
+		"""
+		snes_array_to_RGB888 decodes pixels just like _decode_pixel().
+		"""
+		pixels = [[0x7C00, 0x03E0, 0x001F], [0x0000, 0x7FFF, 0x4210]]
+
+		actual = util.snes_array_to_RGB888(pixels)
+
+		self.assertEqual(actual.shape, (2, 3, 3))
+		self.assertEqual(actual.tostring(),
+				"".join(util._decode_pixel(p) for row in pixels for p in row))
+
 
 if __name__ == "__main__":
 	unittest.main()
@@ -3,10 +3,12 @@ Classes and functions for testing SNES software.
 """
 from tempfile import mkdtemp
 import os.path
+import hashlib
 from PIL import Image
 from snes import core as C
 from snes import exceptions as EX
 from snes.video import pil_output
+from snes.video import frame as frame_output
 
 DEVICE_NAME_TO_ID = {
 		"none": C.DEVICE_NONE,
@@ -25,15 +27,36 @@ class TestSetupError(Exception):
 
 class FrameTest(object):
 
-	def __init__(self, expected_video_file=None):
+	def __init__(self, expected_video_file=None, max_delta=0, max_pixels=0,
+			min_psnr=None):
+		"""
+		Set up a test of a single frame of SNES output.
+
+		"expected_video_file" should be the filename (or file-like object) of
+		an image containing the expected video frame. If None, the video frame
+		is not tested.
+
+		"max_delta", "max_pixels" and "min_psnr" describe how much the actual
+		video frame may differ from the expected one while still passing. See
+		pil_output.ImageDifference.is_within() for details. By default, the
+		frames must be identical.
+		"""
 		if expected_video_file is not None:
 			self.expected_video = Image.open(expected_video_file)
 		else:
 			self.expected_video = None
 
+		self.max_delta = max_delta
+		self.max_pixels = max_pixels
+		self.min_psnr = min_psnr
+
 	def _test_video(self, video_frame):
+		if isinstance(video_frame, frame_output.Frame):
+			video_frame = video_frame.image
+
 		difference = pil_output.describe_difference(video_frame,
-				self.expected_video)
+				self.expected_video, self.max_delta, self.max_pixels,
+				self.min_psnr)
 
 		if difference is None:
 			return ("video frame", True, "")
@@ -63,6 +86,137 @@ class FrameTest(object):
 
 		return count
 
+	def cache_key(self):
+		"""
+		Returns a string identifying exactly what this FrameTest checks.
+
+		Two FrameTests with the same cache_key() will always give the same
+		results for the same frame. If that can't be guaranteed, returns None.
+		"""
+		hasher = hashlib.sha1(repr( (self.__class__.__name__,
+			self.max_delta, self.max_pixels, self.min_psnr) ))
+
+		if self.expected_video:
+			hasher.update(repr( (self.expected_video.mode,
+				self.expected_video.size) ))
+			hasher.update(self.expected_video.tostring())
+
+		return hasher.hexdigest()
+
+
+class GoldenFrameTest(FrameTest):
+	"""
+	Compares a frame of SNES output to a frame in a golden.GoldenStore.
+
+	Since the golden frame is only decoded if its digest differs from that of
+	the actual frame, this is much cheaper than comparing to an image file.
+	"""
+
+	def __init__(self, store, name, max_delta=0, max_pixels=0, min_psnr=None):
+		"""
+		Set up a test of a single frame of SNES output.
+
+		"store" should be the snes.golden.GoldenStore containing the expected
+		video frame.
+
+		"name" should be the name of the expected frame in the store.
+
+		"max_delta", "max_pixels" and "min_psnr" behave just as they do for
+		FrameTest.
+		"""
+		FrameTest.__init__(self, None, max_delta, max_pixels, min_psnr)
+		self.store = store
+		self.name = name
+
+	def _test_video(self, video_frame):
+		result, reason = self.store.check(self.name, video_frame,
+				self.max_delta, self.max_pixels, self.min_psnr)
+
+		return ("video frame", result, reason)
+
+	def test(self, video_frame):
+		"""
+		Compare our expected state to that of the emulated SNES.
+
+		Yields a sequence of (testname, result, reason) tuples, just like
+		FrameTest.test(), except that "video_frame" must be
+		a snes.video.frame.Frame.
+		"""
+		yield self._test_video(video_frame)
+
+	def count_tests(self):
+		return 1
+
+	def cache_key(self):
+		if self.store.accept_all:
+			# The whole point is to record whatever the frame turns out to be.
+			return None
+
+		return hashlib.sha1(repr( (self.__class__.__name__,
+			self.store.get_digest(self.name), self.max_delta, self.max_pixels,
+			self.min_psnr) )).hexdigest()
+
+
+class CheckpointCache(object):
+	"""
+	Saved SNES states, shared between TestScripts with a common prefix.
+
+	States are keyed by a TestScript's prefix_key() and the number of frames
+	emulated before the state was saved.
+	"""
+
+	def __init__(self, limit=None):
+		"""
+		Create an empty cache.
+
+		"limit" is the maximum number of states to keep. If more are stored,
+		the oldest are discarded. If None, every state is kept.
+		"""
+		self.limit = limit
+		self._states = {}
+		self._order = []
+
+	def store(self, prefix, frame_count, state):
+		"""
+		Save the given state, taken after "frame_count" frames were emulated.
+		"""
+		key = (prefix, frame_count)
+		if key not in self._states:
+			self._order.append(key)
+		self._states[key] = state
+
+		if self.limit is not None:
+			while len(self._order) > self.limit:
+				del self._states[self._order.pop(0)]
+
+	def find(self, prefix, after, until):
+		"""
+		Find the latest usable state with the given prefix.
+
+		Returns a (frame_count, state) tuple for the state with the largest
+		frame_count greater than "after" and no greater than "until", or None
+		if there isn't one.
+		"""
+		best = None
+		for (key_prefix, frame_count) in self._states:
+			if key_prefix != prefix:
+				continue
+			if after < frame_count <= until and (best is None
+					or frame_count > best):
+				best = frame_count
+
+		if best is None:
+			return None
+
+		return (best, self._states[ (prefix, best) ])
+
+	def clear(self):
+		"""
+		Discard all saved states.
+		"""
+		self._states = {}
+		self._order = []
+
 
 class TestScript(object):
 
@@ -73,7 +227,7 @@ class TestScript(object):
 		self.frametests = {}
 		self._max_frame_number = 0
 
-	def test(self, core):
+	def test(self, core, checkpoints=None):
 		"""
 		Set up the SNES, run our per-frame tests
 
@@ -82,6 +236,12 @@ class TestScript(object):
 		a string describing the kind of test, "result" is True for pass or
 		False for fail, and "reason" is an empty string (if the test passed) or
 		a description of the failure (if the test failed).
+
+		"checkpoints" may be a CheckpointCache shared between TestScripts.
+		If so, the state of the SNES is saved to it just before each tested
+		frame, and if another TestScript with the same prefix_key() has
+		already saved a state between our tested frames, we start from there
+		instead of emulating the intervening frames ourselves.
 		"""
 		if self.cartridge_loading_info is None:
 			raise TestSetupError("Must load a cartridge before testing")
@@ -94,7 +254,8 @@ class TestScript(object):
 		except EX.NoCartridgeLoaded:
 			pass
 
-		core.set_video_refresh_cb(lambda *args: None)
+		bus = core.frame_bus
+		bus.attach()
 		core.set_audio_sample_cb(lambda *args: None)
 		core.set_input_poll_cb(lambda: None)
 		core.set_input_state_cb(lambda *args: 0)
@@ -107,31 +268,52 @@ class TestScript(object):
 		load_func = getattr(core, func_name)
 		load_func(*args, **kwargs)
 
-		# Because we want to capture the image frame handed to the callback,
-		# and because Python doesn't (yet) have a way for nested functions to
-		# set to variables in their parent functions, we'll make our callback
-		# modify a variable in the outer scope instead.
-		video_frame = []
-		def video_refresh(image):
-			video_frame.append(image)
-
-		for frame_num in range(self._max_frame_number+1):
-			if frame_num in self.frametests:
-				# Set up the SNES to capture the information we need to test
-				# this upcoming frame.
-				video_frame = []
-				pil_output.set_video_refresh_cb(core, video_refresh)
+		if checkpoints is not None:
+			prefix = self.prefix_key()
+
+		# How many frames the SNES has emulated so far.
+		frame_count = 0
+
+		for frame_num in sorted(self.frametests):
+			if checkpoints is not None:
+				# If some other TestScript has already emulated further than we
+				# have, skip ahead.
+				checkpoint = checkpoints.find(prefix, frame_count, frame_num)
+				if checkpoint is not None:
+					frame_count, state = checkpoint
+					core.unserialize(state)
+
+			while frame_count < frame_num:
+				core.run()
+				frame_count += 1
+
+			if checkpoints is not None:
+				checkpoints.store(prefix, frame_num, core.serialize())
+
+			# Capture the upcoming frame; the bus doesn't copy the frames in
+			# between.
+			video_frame = bus.capture_next()
 
 			core.run()
+			frame_count += 1
 
-			if frame_num in self.frametests:
-				# Run the tests for this frame.
-				frametest = self.frametests[frame_num]
-				for testname, result, reason in frametest.test(video_frame[0]):
-					yield (frame_num, testname, result, reason)
+			# Run the tests for this frame.
+			frametest = self.frametests[frame_num]
+			for testname, result, reason in frametest.test(video_frame.frame):
+				yield (frame_num, testname, result, reason)
 
-				# ...then put things back the way they were.
-				core.set_video_refresh_cb(lambda *args: None)
+	def golden_stores(self):
+		"""
+		Returns a list of the golden.GoldenStores this TestScript checks
+		frames against.
+		"""
+		res = []
+		for frame_num in sorted(self.frametests):
+			store = getattr(self.frametests[frame_num], "store", None)
+			if store is not None and store not in res:
+				res.append(store)
+
+		return res
 
 	def count_tests(self):
 		"""
@@ -139,6 +321,56 @@ class TestScript(object):
 		"""
 		return sum(ft.count_tests() for ft in self.frametests.values())
 
+	def count_frames(self):
+		"""
+		Returns the number of frames this TestScript emulates.
+		"""
+		return self._max_frame_number + 1
+
+	def prefix_key(self):
+		"""
+		Returns a string identifying how this TestScript sets up the SNES.
+
+		TestScripts with the same prefix_key() load the same cartridge in the
+		same way with the same controllers, so the SNES will be in the same
+		state after the same number of frames.
+		"""
+		func_name, args, kwargs = self.cartridge_loading_info
+
+		hasher = hashlib.sha1()
+		hasher.update(repr( (func_name, len(args), sorted(kwargs.keys()),
+			self.port_1_device, self.port_2_device) ))
+
+		for arg in list(args) + [kwargs[k] for k in sorted(kwargs.keys())]:
+			hasher.update(repr(arg))
+
+		return hasher.hexdigest()
+
+	def cache_key(self):
+		"""
+		Returns a string identifying everything this TestScript does.
+
+		Two TestScripts with the same cache_key() set up the SNES the same way
+		and perform the same tests on the same frames, so they'll give the
+		same results with the same libsnes library. If any of the FrameTests
+		can't guarantee that, returns None.
+		"""
+		hasher = hashlib.sha1(self.prefix_key())
+
+		for frame_num in sorted(self.frametests):
+			frametest = self.frametests[frame_num]
+			get_key = getattr(frametest, "cache_key", None)
+			if get_key is None:
+				return None
+
+			key = get_key()
+			if key is None:
+				return None
+
+			hasher.update("%d:%s;" % (frame_num, key))
+
+		return hasher.hexdigest()
+
 	def load_cartridge_normal(self, *args, **kwargs):
 		"""
 		Load the given cartridge in the SNES while this test script runs.
@@ -0,0 +1,580 @@
+"""
+Run many TestScripts at once, spread across several processes.
+
+A single copy of a libsnes library can only emulate a single SNES per process
+(see core.EmulatedSNES), so to use more than one CPU core we start several
+worker processes, each with its own copy of the library, and hand the
+TestScripts out between them.
+
+The workers are started with fork(), so the TestScripts don't need to be
+picklable, but this module only works on platforms that have fork().
+
+TestScripts that set up the SNES the same way (see TestScript.prefix_key())
+are run by the same worker, one after another, sharing a CheckpointCache so
+that each one can pick up where the previous ones left off. If there are
+fewer such groups than workers, the largest groups are split into runs of
+shorter and longer scripts, so every worker has something to do.
+
+If given a ResultCache, the runner skips TestScripts that have already passed
+with exactly the same libsnes library, cartridge, script and expected frames.
+The library is identified by the contents of the file the dynamic loader
+actually loads for it (see resolve_library()); if that can't be worked out,
+results aren't cached.
+
+Golden frames accepted by the workers (see golden.GoldenStore) are sent back
+to this process, which records them in its own copy of each store's index
+and saves it.
+"""
+import ctypes
+import multiprocessing
+import Queue
+import os
+import os.path
+import json
+import hashlib
+import time
+import traceback
+import warnings
+from tempfile import mkstemp
+from snes import core as C
+from snes import testing
+
+# Bump this whenever the meaning of a cached result changes, so that old
+# results are ignored.
+RESULT_CACHE_VERSION = 1
+
+# The most saved states each worker keeps for its CheckpointCache. Scripts are
+# run shortest first, so it's the most recent states that are useful.
+CHECKPOINT_LIMIT = 64
+
+# A function every libsnes library exports, used to find out which file
+# a library was loaded from.
+_LIBRARY_SYMBOL = "snes_library_id"
+
+# The kinds of messages workers send back to the parent process.
+_MSG_RESULT = "result"
+_MSG_ERROR = "error"
+_MSG_ACCEPTED = "accepted"
+_MSG_DONE = "done"
+
+# How long to wait for a message before checking whether the workers are still
+# alive.
+_POLL_INTERVAL = 1.0
+
+
+def _run_worker(libname, scripts, stores, tasks, results, use_checkpoints):
+	"""
+	Run TestScripts in a worker process until told to stop.
+
+	"stores" is a list of the golden.GoldenStores the scripts use.
+
+	"tasks" is a queue of lists of indexes into "scripts". A task of None
+	means there are no more scripts to run.
+
+	"results" is a queue of (message-type, script-index, data) tuples
+	describing the progress of each script.
+	"""
+	core = C.EmulatedSNES(libname)
+
+	# Forget anything accepted before we were started; the parent already
+	# knows about it.
+	for store in stores:
+		store.take_accepted()
+
+	try:
+		while True:
+			task = tasks.get()
+			if task is None:
+				break
+
+			if use_checkpoints:
+				checkpoints = testing.CheckpointCache(CHECKPOINT_LIMIT)
+			else:
+				checkpoints = None
+
+			for index in task:
+				start = time.time()
+				try:
+					for res in scripts[index].test(core, checkpoints):
+						results.put( (_MSG_RESULT, index, res) )
+				except Exception:
+					results.put( (_MSG_ERROR, index, traceback.format_exc()) )
+
+				# Our copies of the stores' indexes are thrown away when we
+				# exit, so pass on any frames that were accepted.
+				for number, store in enumerate(stores):
+					accepted = store.take_accepted()
+					if accepted:
+						results.put( (_MSG_ACCEPTED, index,
+							(number, accepted)) )
+
+				results.put( (_MSG_DONE, index, time.time() - start) )
+	finally:
+		core.close()
+
+
+class _DlInfo(ctypes.Structure):
+	_fields_ = [
+			("dli_fname", ctypes.c_char_p),
+			("dli_fbase", ctypes.c_void_p),
+			("dli_sname", ctypes.c_char_p),
+			("dli_saddr", ctypes.c_void_p),
+		]
+
+
+def loaded_library_path(lib, symbol=_LIBRARY_SYMBOL):
+	"""
+	Return the absolute filename of a loaded shared library.
+
+	"lib" is a ctypes library, and "symbol" the name of a function it
+	exports. The dynamic loader is asked which file that function was loaded
+	from.
+
+	Returns None if the platform can't tell us (it has no dladdr()).
+	"""
+	dladdr = getattr(ctypes.CDLL(None), "dladdr", None)
+	if dladdr is None:
+		return None
+
+	address = ctypes.cast(getattr(lib, symbol), ctypes.c_void_p)
+	info = _DlInfo()
+	if not dladdr(address, ctypes.byref(info)) or not info.dli_fname:
+		return None
+
+	return os.path.realpath(info.dli_fname)
+
+
+def _resolve_worker(libname, symbol, conn):
+	"""
+	Load the given library, and send the filename it came from down "conn".
+	"""
+	try:
+		path = loaded_library_path(ctypes.CDLL(libname), symbol)
+	except (OSError, AttributeError):
+		path = None
+
+	conn.send(path)
+	conn.close()
+
+
+def resolve_library(libname, symbol=_LIBRARY_SYMBOL):
+	"""
+	Return the absolute filename of the file loaded for the given library.
+
+	"libname" is a library filename, as passed to core.EmulatedSNES. If it
+	includes a directory, that's the file. Otherwise, the library is loaded
+	in a short-lived child process and the dynamic loader is asked where it
+	found it, so its own search order (ld.so.cache, multiarch directories,
+	and so on) is followed exactly, without loading the library here.
+
+	"symbol" is the name of a function the library exports.
+
+	Returns None if the library can't be found or loaded.
+	"""
+	if os.path.dirname(libname):
+		if not os.path.isfile(libname):
+			return None
+		return os.path.realpath(libname)
+
+	receiver, sender = multiprocessing.Pipe(duplex=False)
+	child = multiprocessing.Process(target=_resolve_worker,
+			args=(libname, symbol, sender))
+	child.start()
+	sender.close()
+
+	try:
+		path = receiver.recv()
+	except EOFError:
+		# The child died without telling us.
+		path = None
+
+	child.join()
+	receiver.close()
+
+	return path
+
+
+def library_digest(libname, symbol=_LIBRARY_SYMBOL):
+	"""
+	Return a hex digest of the contents of the given libsnes library.
+
+	"libname" and "symbol" are as for resolve_library(); the file it returns
+	is the one hashed.
+
+	Returns None if the library file can't be found.
+	"""
+	path = resolve_library(libname, symbol)
+	if path is None:
+		return None
+
+	hasher = hashlib.sha1()
+	with open(path, "rb") as handle:
+		for block in iter(lambda: handle.read(65536), ""):
+			hasher.update(block)
+
+	return hasher.hexdigest()
+
+
+class ResultCache(object):
+	"""
+	An on-disk record of TestScripts that have passed.
+
+	Results are keyed by a digest of everything that could affect them: the
+	libsnes library, and the TestScript's cache_key() (which covers the
+	cartridge, controllers, tested frames and expected output). Changing any
+	of those produces a different key, so stale results are never used.
+
+	Only TestScripts whose tests all passed are recorded, since failures
+	usually need investigating (and their reasons refer to temporary files
+	that may no longer exist).
+	"""
+
+	def __init__(self, path):
+		"""
+		Open (or create) the result cache in the given directory.
+		"""
+		self.path = path
+
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+	def make_key(self, lib_digest, script):
+		"""
+		Return the cache key for the given TestScript and library digest.
+
+		Returns None if the results can't be cached.
+		"""
+		if lib_digest is None:
+			return None
+
+		try:
+			script_key = script.cache_key()
+		except Exception:
+			# This script is probably not set up properly; let it be run so
+			# the problem is reported.
+			return None
+
+		if script_key is None:
+			return None
+
+		return hashlib.sha1("%d:%s:%s" % (RESULT_CACHE_VERSION, lib_digest,
+			script_key)).hexdigest()
+
+	def _result_path(self, key):
+		return os.path.join(self.path, key[:2], key + ".json")
+
+	def get(self, key):
+		"""
+		Return the cached results for the given key, or None.
+
+		The results are a list of (frame#, testname, result, reason) tuples.
+		"""
+		try:
+			with open(self._result_path(key), "rb") as handle:
+				data = json.load(handle)
+		except (IOError, ValueError):
+			return None
+
+		if data.get("version") != RESULT_CACHE_VERSION:
+			return None
+
+		return [tuple(res) for res in data["results"]]
+
+	def put(self, key, results):
+		"""
+		Record the given results under the given key.
+		"""
+		filename = self._result_path(key)
+		if not os.path.isdir(os.path.dirname(filename)):
+			os.makedirs(os.path.dirname(filename))
+
+		fd, tempname = mkstemp(dir=os.path.dirname(filename))
+		try:
+			with os.fdopen(fd, "wb") as handle:
+				json.dump({
+						"version": RESULT_CACHE_VERSION,
+						"results": [list(res) for res in results],
+					}, handle)
+			os.rename(tempname, filename)
+		except:
+			os.unlink(tempname)
+			raise
+
+
+def _golden_stores(scripts):
+	"""
+	Return a list of the golden.GoldenStores used by the given TestScripts.
+	"""
+	res = []
+	for script in scripts:
+		for store in script.golden_stores():
+			if store not in res:
+				res.append(store)
+
+	return res
+
+
+def _make_tasks(scripts, use_checkpoints, processes=1):
+	"""
+	Divide the given TestScripts into lists of indexes for workers to run.
+
+	If "use_checkpoints" is True, scripts with the same prefix_key() are
+	grouped together, shortest first, so later scripts can start from the
+	checkpoints saved by earlier ones. The groups that will take longest are
+	handed out first, so they don't hold up the end of the run.
+
+	If that makes fewer tasks than "processes", the groups with the most
+	scripts are split in two, the shorter scripts in one task and the longer
+	in the other, until there are enough tasks to go round. The task with
+	the longer scripts has to emulate the frames before them itself, but
+	that's no more than the unsplit group would have taken anyway, and its
+	tests run alongside the other task's.
+	"""
+	if not use_checkpoints:
+		return [[index] for index in xrange(len(scripts))]
+
+	groups = {}
+	for index, script in enumerate(scripts):
+		try:
+			prefix = script.prefix_key()
+		except Exception:
+			# This script is probably not set up properly; let the worker
+			# report the problem.
+			prefix = index
+		groups.setdefault(prefix, []).append(index)
+
+	tasks = [
+			sorted(group, key=lambda index: scripts[index].count_frames())
+			for group in groups.values()
+		]
+
+	while len(tasks) < processes:
+		largest = max(tasks, key=len)
+		if len(largest) < 2:
+			break
+
+		tasks.remove(largest)
+		middle = len(largest) // 2
+		tasks.extend([largest[:middle], largest[middle:]])
+
+	tasks.sort(key=lambda task: scripts[task[-1]].count_frames(),
+			reverse=True)
+
+	return tasks
+
+
+class ParallelTestRunner(object):
+	"""
+	Runs a collection of TestScripts in parallel.
+
+	After run() has finished, the following attributes are available:
+
+		"wall_times" is a dict mapping the index of each TestScript that ran
+		to completion to the number of seconds it took to run.
+
+		"cached" is a set of the indexes of TestScripts whose results came
+		from the ResultCache, rather than being run.
+
+		"accepted" is the number of golden frames that were accepted.
+	"""
+
+	def __init__(self, libname, processes=None, failfast=False,
+			checkpoints=True, cache=None, force=False, accept=False):
+		"""
+		Set up a test runner.
+
+		"libname" is the filename of the libsnes implementation each worker
+		process should load. It should not be loaded in this process when
+		run() is called.
+
+		"processes" is the number of worker processes to use. If None, one
+		worker is started per CPU.
+
+		"failfast" should be True if all testing should stop after the first
+		failure.
+
+		"checkpoints" should be True if TestScripts with a common prefix
+		should share saved states, rather than each emulating every frame
+		from power-on.
+
+		"cache" may be a ResultCache. If so, TestScripts that have passed
+		before are not run again, and their results are reported from the
+		cache. TestScripts that pass are added to it. If the file the
+		library is loaded from can't be found, a RuntimeWarning is issued
+		and nothing is cached.
+
+		"force" should be True if every TestScript should be run, even if
+		its results are cached. The cache is still updated.
+
+		"accept" should be True if the frames currently produced should be
+		accepted as the new golden frames of every golden.GoldenStore the
+		TestScripts use (see GoldenStore's "accept" parameter) while run()
+		is running. Every TestScript is run, and the cache is neither read
+		nor updated. The stores are saved when run() finishes.
+		"""
+		if processes is None:
+			processes = multiprocessing.cpu_count()
+
+		self.libname = libname
+		self.processes = processes
+		self.failfast = failfast
+		self.checkpoints = checkpoints
+		self.cache = cache
+		self.force = force
+		self.accept = accept
+		self.wall_times = {}
+		self.cached = set()
+		self.accepted = 0
+
+	def run(self, scripts):
+		"""
+		Run the given TestScripts.
+
+		Yields a sequence of (script#, frame#, testname, result, reason)
+		tuples as tests complete, where "script#" is the index of the
+		TestScript in "scripts" and the other fields are as described for
+		TestScript.test(). Results from each script are yielded in order, but
+		results from different scripts may be interleaved.
+
+		If a TestScript raises an exception, a result with a "frame#" of None,
+		a "testname" of "error", and the traceback as the "reason" is yielded.
+		"""
+		scripts = list(scripts)
+		self.wall_times = {}
+		self.cached = set()
+		self.accepted = 0
+
+		# Work out which scripts we can skip. Accepted results say nothing
+		# about whether a script passes, so they're never cached.
+		cache_keys = {}
+		if self.cache is not None and not self.accept:
+			lib_digest = library_digest(self.libname)
+			if lib_digest is None:
+				warnings.warn("Can't tell which file libsnes library %r is "
+						"loaded from, so results won't be cached"
+						% (self.libname,), RuntimeWarning)
+
+			for index, script in enumerate(scripts):
+				key = self.cache.make_key(lib_digest, script)
+				if key is None:
+					continue
+
+				cache_keys[index] = key
+
+				if self.force:
+					continue
+
+				cached_results = self.cache.get(key)
+				if cached_results is None:
+					continue
+
+				self.cached.add(index)
+				for res in cached_results:
+					yield (index,) + res
+
+		to_run = [
+				index for index in xrange(len(scripts))
+				if index not in self.cached
+			]
+
+		stores = _golden_stores(scripts)
+		was_accepting = [store.accept_all for store in stores]
+		if self.accept:
+			for store in stores:
+				store.accept_all = True
+
+		try:
+			if to_run:
+				for res in self._run_workers(scripts, stores, to_run,
+						cache_keys):
+					yield res
+		finally:
+			for store, accept_all in zip(stores, was_accepting):
+				store.accept_all = accept_all
+				store.save()
+
+	def _run_workers(self, scripts, stores, to_run, cache_keys):
+		"""
+		Run the given TestScripts in worker processes, yielding results as
+		for run().
+		"""
+		tasks = multiprocessing.Queue()
+		results = multiprocessing.Queue()
+
+		task_list = [
+				[to_run[i] for i in task]
+				for task in _make_tasks([scripts[i] for i in to_run],
+					self.checkpoints, self.processes)
+			]
+		for task in task_list:
+			tasks.put(task)
+
+		workers = []
+		for _ in xrange(min(self.processes, len(task_list))):
+			tasks.put(None)
+			worker = multiprocessing.Process(target=_run_worker,
+					args=(self.libname, scripts, stores, tasks, results,
+						self.checkpoints))
+			worker.daemon = True
+			worker.start()
+			workers.append(worker)
+
+		# The results of each script, so we can cache them if they pass.
+		script_results = dict( (index, []) for index in cache_keys )
+		outstanding = set(to_run)
+		try:
+			while outstanding:
+				try:
+					msg_type, index, data = results.get(
+							timeout=_POLL_INTERVAL)
+				except Queue.Empty:
+					if any(worker.is_alive() for worker in workers):
+						continue
+
+					# All the workers have died without finishing their work.
+					# Let's blame the remaining scripts.
+					for index in sorted(outstanding):
+						yield (index, None, "error", False,
+								"Worker process died")
+						if self.failfast:
+							return
+					return
+
+				if msg_type == _MSG_RESULT:
+					yield (index,) + tuple(data)
+
+					if index in script_results:
+						script_results[index].append(tuple(data))
+
+					if self.failfast and not data[2]:
+						return
+
+				elif msg_type == _MSG_ERROR:
+					yield (index, None, "error", False, data)
+
+					# Don't cache scripts that blew up.
+					script_results.pop(index, None)
+
+					if self.failfast:
+						return
+
+				elif msg_type == _MSG_ACCEPTED:
+					number, accepted = data
+					for name, digest in accepted:
+						stores[number].record(name, digest)
+					self.accepted += len(accepted)
+
+				elif msg_type == _MSG_DONE:
+					self.wall_times[index] = data
+					outstanding.discard(index)
+
+					script_res = script_results.pop(index, None)
+					if script_res is not None and all(
+							res[2] for res in script_res):
+						self.cache.put(cache_keys[index], script_res)
+
+		finally:
+			for worker in workers:
+				if worker.is_alive():
+					worker.terminate()
+				worker.join()
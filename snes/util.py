@@ -1,6 +1,8 @@
 """
 Common functions useful with libsnes.
 """
+import ctypes
+import numpy
 
 def _decode_pixel(pixel):
 	"""
@@ -16,20 +18,69 @@ def _decode_pixel(pixel):
 			(b | (b >> 5)),
 		)
 
-_rgb_lookup = [_decode_pixel(_p) for _p in xrange(32768)]
-
 def snes_framebuffer_to_RGB888(data, width, height, pitch):
 	"""
-	Quick and hacky way to convert libsnes video data to RGB888 data.
+	Convert libsnes video data to a string of RGB888 data.
+
+	The parameters are as for snes_framebuffer_to_array().
+	"""
+	return snes_array_to_RGB888(
+			snes_framebuffer_to_array(data, width, height, pitch)).tostring()
+
+
+def snes_framebuffer_to_array(data, width, height, pitch):
+	"""
+	Return the visible pixels of libsnes video data as a numpy array.
+
+	"data" may be the pixel pointer handed to a video refresh callback, the
+	integer address of the pixel data, or any sequence of pixel values.
+
+	"pitch" is the number of pixels from the beginning of one line to the
+	beginning of the next.
 
-	Despite the word 'quick', it's actually incredibly slow. Python is not the
-	best language to use for bitbanging, it seems.
+	Returns a uint16 array of shape (height, width). When "data" is a pointer
+	or an address, the array is a view of libsnes' framebuffer rather than
+	a copy, so it's only valid until the video refresh callback returns.
 	"""
-	res = ''.join(
-			_rgb_lookup[data[pitch * y + x]]
-			for y in xrange(height)
-			for x in xrange(width)
+	size = pitch * (height - 1) + width
+
+	if isinstance(data, ctypes._Pointer):
+		data = ctypes.addressof(data.contents)
+
+	if isinstance(data, (int, long)):
+		pixels = numpy.frombuffer(
+				(ctypes.c_uint16 * size).from_address(data),
+				dtype=numpy.uint16,
+			)
+	else:
+		pixels = numpy.asarray(data, dtype=numpy.uint16).ravel()[:size]
+
+	# Step a whole pitch between rows, without reaching past the end of the
+	# last visible row.
+	pixels = numpy.lib.stride_tricks.as_strided(pixels,
+			shape=(height, width),
+			strides=(pitch * pixels.itemsize, pixels.itemsize),
 		)
 
-	return res
+	return pixels
+
+
+def snes_array_to_RGB888(pixels):
+	"""
+	Convert an array of SNES pixels to RGB888.
 
+	"pixels" should be a uint16 numpy array of any shape, such as the one
+	returned by snes_framebuffer_to_array().
+
+	Returns a uint8 array with the same shape as "pixels" plus a final
+	dimension of 3, holding the red, green and blue values of each pixel.
+	"""
+	pixels = numpy.asarray(pixels, dtype=numpy.uint16)
+
+	res = numpy.empty(pixels.shape + (3,), dtype=numpy.uint8)
+	for channel, shift in enumerate((10, 5, 0)):
+		value = (pixels >> shift) & 0x1f
+		# Scale 5-bit values up to 8 bits the same way _decode_pixel() does.
+		res[..., channel] = (value << 3) | (value >> 2)
+
+	return res
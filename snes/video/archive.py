@@ -0,0 +1,556 @@
+"""
+A compact, lossless archive format for SNES video frames.
+
+SNES frames are built out of 8x8 tiles, most of which use only a handful of
+the 32768 possible colours, and most of which are exactly the same from one
+frame to the next. This format takes advantage of both:
+
+	- Each frame is divided into 8x8 tiles. Every distinct tile is stored
+	  only once in the whole archive, and each frame is stored as a list of
+	  tile numbers.
+
+	- Each stored tile has its own small palette, and its pixels are stored
+	  as 0, 1, 2, 4 or 8-bit indexes into that palette, depending on how many
+	  colours it uses.
+
+An index at the end of the archive records where each frame is, so any frame
+can be read without reading the frames before it. ArchiveReader reads the
+archive through mmap, so only the parts that are needed are ever read from
+disk. If the archive was never closed properly (so there is no index), the
+reader rebuilds the index by scanning the file.
+
+The archive consists of a header, followed by a sequence of records. Each
+record begins with a record header giving its type and the length of the rest
+of the record:
+
+	RECORD_TILES records hold a batch of new tiles: the number of the first
+	tile in the batch, the number of tiles, and then (compressed) the colour
+	count of each tile, each tile's palette, and each tile's packed pixel
+	indexes.
+
+	RECORD_FRAME records hold a frame: its dimensions and flags, an optional
+	tag, and (compressed) the tile number of each tile in the frame, in
+	row-major order. Any new tiles a frame uses are written before it.
+
+	RECORD_INDEX records hold the offsets of every frame and tile batch in
+	the archive. The archive ends with a trailer giving the offset of the
+	index.
+"""
+import mmap
+import struct
+import zlib
+import numpy
+from snes import exceptions as EX
+from snes.video.frame import Frame
+
+ARCHIVE_MAGIC = "SNFA"
+ARCHIVE_VERSION = 1
+TRAILER_MAGIC = "SNFI"
+
+archive_header = struct.Struct('<4sB')
+record_header = struct.Struct('<BI')
+tiles_header = struct.Struct('<II')
+frame_header = struct.Struct('<HHBH')
+index_header = struct.Struct('<II')
+archive_trailer = struct.Struct('<Q4s')
+
+RECORD_TILES = 1
+RECORD_FRAME = 2
+RECORD_INDEX = 3
+
+FLAG_HIRES = 1
+FLAG_INTERLACE = 2
+FLAG_OVERSCAN = 4
+
+TILE_SIZE = 8
+TILE_PIXELS = TILE_SIZE * TILE_SIZE
+
+# The writer remembers every tile it has stored, so it can refer back to
+# them. To keep memory use bounded during very long captures, it forgets them
+# all once it has stored this many; tiles seen after that are stored again.
+DEFAULT_MAX_TILES = 1 << 20
+
+# The number of decoded tile batches the reader keeps around.
+_BATCH_CACHE_SIZE = 64
+
+# The number of bits needed for each pixel index, given the number of colours
+# in a tile's palette (which may be anything from 1 to 64).
+_INDEX_BITS = numpy.array([0, 0, 1, 2, 2] + [4] * 12 + [8] * 48,
+		dtype=numpy.intp)
+
+
+class CorruptArchive(EX.SNESException):
+	"""
+	An archive is not in the expected format.
+	"""
+
+
+def split_tiles(pixels):
+	"""
+	Divide a (height, width) array of pixels into 8x8 tiles.
+
+	Returns a uint16 array of shape (n, 64), with one row per tile in
+	row-major order. If the frame isn't a whole number of tiles, the tiles on
+	the right and bottom edges are padded with zeros.
+	"""
+	height, width = pixels.shape
+	rows = -(-height // TILE_SIZE)
+	columns = -(-width // TILE_SIZE)
+
+	if (rows * TILE_SIZE, columns * TILE_SIZE) != (height, width):
+		padded = numpy.zeros( (rows * TILE_SIZE, columns * TILE_SIZE),
+				dtype=numpy.uint16 )
+		padded[:height, :width] = pixels
+		pixels = padded
+
+	tiles = pixels.reshape(rows, TILE_SIZE, columns, TILE_SIZE)
+
+	return tiles.transpose(0, 2, 1, 3).reshape(-1, TILE_PIXELS)
+
+
+def join_tiles(tiles, width, height):
+	"""
+	The reverse of split_tiles().
+	"""
+	rows = -(-height // TILE_SIZE)
+	columns = -(-width // TILE_SIZE)
+
+	pixels = tiles.reshape(rows, columns, TILE_SIZE, TILE_SIZE)
+	pixels = pixels.transpose(0, 2, 1, 3).reshape(rows * TILE_SIZE,
+			columns * TILE_SIZE)
+
+	return pixels[:height, :width]
+
+
+def encode_tiles(tiles):
+	"""
+	Return the given tiles as a string of palette-indexed tile data.
+
+	"tiles" should be a uint16 array of shape (n, 64), as returned by
+	split_tiles().
+	"""
+	count = len(tiles)
+	rows = numpy.arange(count)[:, numpy.newaxis]
+
+	# Each tile's palette is its sorted, distinct colours, and each pixel is
+	# stored as the position of its colour in the palette.
+	order = numpy.argsort(tiles, axis=1, kind='mergesort')
+	ordered = tiles[rows, order]
+
+	is_new = numpy.ones(ordered.shape, dtype=bool)
+	is_new[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+
+	colours = is_new.sum(axis=1)
+	palettes = ordered[is_new]
+
+	indexes = numpy.empty(tiles.shape, dtype=numpy.uint8)
+	indexes[rows, order] = numpy.cumsum(is_new, axis=1) - 1
+
+	# Pack the indexes of tiles that need the same number of bits together,
+	# then put each tile's packed bytes back in order.
+	bits = _INDEX_BITS[colours]
+	packed_sizes = bits * (TILE_PIXELS // 8)
+	offsets = numpy.cumsum(packed_sizes) - packed_sizes
+	packed = numpy.zeros(packed_sizes.sum(), dtype=numpy.uint8)
+
+	for width in (1, 2, 4, 8):
+		selected = numpy.flatnonzero(bits == width)
+		if not len(selected):
+			continue
+
+		per_byte = 8 // width
+		values = indexes[selected].reshape(len(selected), -1, per_byte)
+
+		group = numpy.zeros(values.shape[:2], dtype=numpy.uint8)
+		for position in xrange(per_byte):
+			group |= values[:, :, position] << (width * position)
+
+		positions = offsets[selected][:, numpy.newaxis] \
+				+ numpy.arange(group.shape[1])
+		packed[positions] = group
+
+	return "".join([
+			(colours - 1).astype(numpy.uint8).tostring(),
+			palettes.astype('<u2').tostring(),
+			packed.tostring(),
+		])
+
+
+def decode_tiles(data, count):
+	"""
+	The reverse of encode_tiles(); "count" is the number of tiles in "data".
+	"""
+	colours = numpy.frombuffer(data, dtype=numpy.uint8,
+			count=count).astype(numpy.intp) + 1
+	palette_count = colours.sum()
+
+	palettes = numpy.frombuffer(data, dtype='<u2', count=palette_count,
+			offset=count).astype(numpy.uint16)
+	packed = numpy.frombuffer(data, dtype=numpy.uint8,
+			offset=count + palette_count * 2)
+
+	bits = _INDEX_BITS[colours]
+	packed_sizes = bits * (TILE_PIXELS // 8)
+	offsets = numpy.cumsum(packed_sizes) - packed_sizes
+	if packed_sizes.sum() != len(packed):
+		raise CorruptArchive("Tile batch has %d bytes of pixels, expected %d"
+				% (len(packed), packed_sizes.sum()))
+
+	# Tiles with a single colour need no indexes at all.
+	indexes = numpy.zeros( (count, TILE_PIXELS), dtype=numpy.intp )
+
+	for width in (1, 2, 4, 8):
+		selected = numpy.flatnonzero(bits == width)
+		if not len(selected):
+			continue
+
+		per_byte = 8 // width
+		positions = offsets[selected][:, numpy.newaxis] \
+				+ numpy.arange(width * TILE_PIXELS // 8)
+		group = packed[positions]
+
+		shifts = numpy.arange(per_byte) * width
+		values = (group[:, :, numpy.newaxis] >> shifts) & ((1 << width) - 1)
+		indexes[selected] = values.reshape(len(selected), TILE_PIXELS)
+
+	palette_offsets = numpy.cumsum(colours) - colours
+
+	return palettes[palette_offsets[:, numpy.newaxis] + indexes]
+
+
+def _frame_flags(frame):
+	flags = 0
+	if frame.hires:
+		flags |= FLAG_HIRES
+	if frame.interlace:
+		flags |= FLAG_INTERLACE
+	if frame.overscan:
+		flags |= FLAG_OVERSCAN
+
+	return flags
+
+
+class ArchiveWriter(object):
+	"""
+	Writes frames to an archive file.
+
+	Frames are written as soon as they're added, so if writing is
+	interrupted, every complete frame can still be read. Call close() to
+	write the index.
+
+	The following attributes are available:
+
+		"tiles_stored" is the number of tiles written to the archive.
+
+		"tiles_reused" is the number of tiles in added frames that were
+		already in the archive.
+	"""
+
+	def __init__(self, filename, max_tiles=DEFAULT_MAX_TILES):
+		"""
+		Create a new archive with the given filename.
+
+		"max_tiles" is the number of distinct tiles to remember before
+		starting afresh; see DEFAULT_MAX_TILES.
+		"""
+		self.max_tiles = max_tiles
+		self.tiles_stored = 0
+		self.tiles_reused = 0
+
+		self._handle = open(filename, "wb")
+		self._handle.write(archive_header.pack(ARCHIVE_MAGIC,
+			ARCHIVE_VERSION))
+
+		self._tile_numbers = {}
+		self._frame_offsets = []
+		self._batch_offsets = []
+		self._batch_starts = []
+
+		self._previous_tiles = None
+		self._previous_numbers = None
+
+	def __len__(self):
+		return len(self._frame_offsets)
+
+	def _write_record(self, record_type, payload):
+		offset = self._handle.tell()
+		self._handle.write(record_header.pack(record_type, len(payload)))
+		self._handle.write(payload)
+		return offset
+
+	def add_frame(self, frame, tag=""):
+		"""
+		Add the given Frame to the archive.
+
+		"tag" is an optional string (of up to 65535 bytes) to store with the
+		frame.
+
+		Returns the number of the frame within the archive.
+		"""
+		tiles = split_tiles(frame.pixels)
+		numbers = numpy.empty(len(tiles), dtype=numpy.uint32)
+
+		# Most tiles haven't changed since the previous frame, and we can
+		# find those without looking anything up.
+		previous = self._previous_tiles
+		if previous is not None and previous.shape == tiles.shape:
+			unchanged = (tiles == previous).all(axis=1)
+			numbers[unchanged] = self._previous_numbers[unchanged]
+			changed = numpy.flatnonzero(~unchanged)
+		else:
+			changed = numpy.arange(len(tiles))
+
+		if len(self._tile_numbers) + len(changed) > self.max_tiles:
+			self._tile_numbers.clear()
+
+		first_new = self.tiles_stored
+		new_tiles = []
+		for position in changed:
+			key = tiles[position].tostring()
+			number = self._tile_numbers.get(key)
+			if number is None:
+				number = first_new + len(new_tiles)
+				self._tile_numbers[key] = number
+				new_tiles.append(position)
+			numbers[position] = number
+
+		self.tiles_reused += len(tiles) - len(new_tiles)
+
+		if new_tiles:
+			payload = tiles_header.pack(first_new, len(new_tiles)) \
+					+ zlib.compress(encode_tiles(tiles[new_tiles]))
+			self._batch_offsets.append(
+					self._write_record(RECORD_TILES, payload))
+			self._batch_starts.append(first_new)
+			self.tiles_stored += len(new_tiles)
+
+		payload = "".join([
+				frame_header.pack(frame.width, frame.height,
+					_frame_flags(frame), len(tag)),
+				tag,
+				zlib.compress(numbers.astype('<u4').tostring()),
+			])
+		self._frame_offsets.append(self._write_record(RECORD_FRAME, payload))
+
+		self._previous_tiles = tiles
+		self._previous_numbers = numbers
+
+		return len(self._frame_offsets) - 1
+
+	def close(self):
+		"""
+		Write the index, and close the archive.
+		"""
+		if self._handle is None:
+			return
+
+		payload = index_header.pack(len(self._frame_offsets),
+				len(self._batch_offsets)) + zlib.compress("".join([
+					numpy.array(self._frame_offsets, dtype='<u8').tostring(),
+					numpy.array(self._batch_offsets, dtype='<u8').tostring(),
+					numpy.array(self._batch_starts, dtype='<u4').tostring(),
+				]))
+		offset = self._write_record(RECORD_INDEX, payload)
+		self._handle.write(archive_trailer.pack(offset, TRAILER_MAGIC))
+
+		self._handle.close()
+		self._handle = None
+
+
+class ArchiveReader(object):
+	"""
+	Reads frames from an archive file.
+
+	Frames can be read in any order by number (reader[n]), or in order by
+	iterating over the reader.
+	"""
+
+	def __init__(self, filename):
+		"""
+		Open the archive with the given filename.
+
+		Raises CorruptArchive if the file isn't an archive.
+		"""
+		with open(filename, "rb") as handle:
+			handle.seek(0, 2)
+			if handle.tell() < archive_header.size:
+				raise CorruptArchive("File too short")
+
+			self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version = archive_header.unpack_from(self._map)
+		if magic != ARCHIVE_MAGIC:
+			raise CorruptArchive("Not a frame archive")
+		if version != ARCHIVE_VERSION:
+			raise CorruptArchive("Unsupported version %d" % (version,))
+
+		if not self._read_index():
+			self._scan()
+
+		self._batches = {}
+
+	def _read_record(self, offset):
+		"""
+		Return the type and payload of the record at the given offset.
+		"""
+		end = offset + record_header.size
+		if end > len(self._map):
+			raise CorruptArchive("Record at %d is incomplete" % (offset,))
+
+		record_type, length = record_header.unpack_from(self._map, offset)
+		if end + length > len(self._map):
+			raise CorruptArchive("Record at %d is incomplete" % (offset,))
+
+		return record_type, self._map[end:end + length]
+
+	def _read_index(self):
+		"""
+		Read the index at the end of the archive, if there is one.
+
+		Returns False if the archive has no index.
+		"""
+		if len(self._map) < archive_header.size + archive_trailer.size:
+			return False
+
+		offset, magic = archive_trailer.unpack_from(self._map,
+				len(self._map) - archive_trailer.size)
+		if magic != TRAILER_MAGIC:
+			return False
+
+		record_type, payload = self._read_record(offset)
+		if record_type != RECORD_INDEX:
+			raise CorruptArchive("Index at %d is not an index" % (offset,))
+
+		frames, batches = index_header.unpack_from(payload)
+		data = zlib.decompress(payload[index_header.size:])
+
+		self._frame_offsets = numpy.frombuffer(data, dtype='<u8',
+				count=frames).astype(numpy.int64)
+		self._batch_offsets = numpy.frombuffer(data, dtype='<u8',
+				count=batches, offset=frames * 8).astype(numpy.int64)
+		self._batch_starts = numpy.frombuffer(data, dtype='<u4',
+				count=batches, offset=(frames + batches) * 8).astype(
+					numpy.int64)
+
+		return True
+
+	def _scan(self):
+		"""
+		Rebuild the index by reading every record in the archive.
+
+		An incomplete record at the end of the archive is ignored.
+		"""
+		frame_offsets = []
+		batch_offsets = []
+		batch_starts = []
+
+		offset = archive_header.size
+		while offset + record_header.size <= len(self._map):
+			record_type, length = record_header.unpack_from(self._map, offset)
+			end = offset + record_header.size + length
+			if end > len(self._map):
+				break
+
+			if record_type == RECORD_FRAME:
+				frame_offsets.append(offset)
+			elif record_type == RECORD_TILES:
+				batch_offsets.append(offset)
+				batch_starts.append(tiles_header.unpack_from(self._map,
+					offset + record_header.size)[0])
+
+			offset = end
+
+		self._frame_offsets = numpy.array(frame_offsets, dtype=numpy.int64)
+		self._batch_offsets = numpy.array(batch_offsets, dtype=numpy.int64)
+		self._batch_starts = numpy.array(batch_starts, dtype=numpy.int64)
+
+	def __len__(self):
+		return len(self._frame_offsets)
+
+	def __iter__(self):
+		for index in xrange(len(self)):
+			yield self[index]
+
+	def _batch(self, batch):
+		"""
+		Return the decoded tiles of the given tile batch.
+		"""
+		res = self._batches.get(batch)
+		if res is not None:
+			return res
+
+		record_type, payload = self._read_record(
+				int(self._batch_offsets[batch]))
+		if record_type != RECORD_TILES:
+			raise CorruptArchive("Record %d is not a tile batch" % (batch,))
+
+		_, count = tiles_header.unpack_from(payload)
+		res = decode_tiles(zlib.decompress(payload[tiles_header.size:]),
+				count)
+
+		if len(self._batches) >= _BATCH_CACHE_SIZE:
+			self._batches.clear()
+		self._batches[batch] = res
+
+		return res
+
+	def _tiles(self, numbers):
+		"""
+		Return the tiles with the given numbers.
+		"""
+		batches = numpy.searchsorted(self._batch_starts, numbers,
+				side='right') - 1
+		if len(batches) and batches.min() < 0:
+			raise CorruptArchive("Frame refers to a missing tile")
+
+		res = numpy.empty( (len(numbers), TILE_PIXELS), dtype=numpy.uint16 )
+		for batch in numpy.unique(batches):
+			selected = (batches == batch)
+			tiles = self._batch(batch)
+			local = numbers[selected] - self._batch_starts[batch]
+			if local.max() >= len(tiles):
+				raise CorruptArchive("Frame refers to a missing tile")
+			res[selected] = tiles[local]
+
+		return res
+
+	def _read_frame(self, index):
+		record_type, payload = self._read_record(
+				int(self._frame_offsets[index]))
+		if record_type != RECORD_FRAME:
+			raise CorruptArchive("Record %d is not a frame" % (index,))
+
+		width, height, flags, tag_length = frame_header.unpack_from(payload)
+		start = frame_header.size
+
+		return (width, height, flags, payload[start:start + tag_length],
+				payload[start + tag_length:])
+
+	def tag(self, index):
+		"""
+		Return the tag stored with the given frame.
+		"""
+		return self._read_frame(index)[3]
+
+	def __getitem__(self, index):
+		"""
+		Return the Frame with the given number.
+		"""
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError("Frame %d not in archive" % (index,))
+
+		width, height, flags, _, data = self._read_frame(index)
+
+		numbers = numpy.frombuffer(zlib.decompress(data),
+				dtype='<u4').astype(numpy.int64)
+		pixels = join_tiles(self._tiles(numbers), width, height)
+
+		return Frame(numpy.ascontiguousarray(pixels),
+				hires=bool(flags & FLAG_HIRES),
+				interlace=bool(flags & FLAG_INTERLACE),
+				overscan=bool(flags & FLAG_OVERSCAN))
+
+	def close(self):
+		self._map.close()
@@ -0,0 +1,179 @@
+"""
+Shares each SNES video frame between any number of consumers.
+
+A core only has one video refresh callback, so the set_video_refresh_cb()
+functions of the various video outputs replace each other. A FrameBus takes
+over the core's callback and hands each frame to everybody who's interested:
+
+	- Subscribers added with subscribe() are called with every frame, as a
+	  snes.video.frame.Frame. There's only one Frame per video frame, so
+	  conversions to other formats (Frame.rgb888, Frame.image, and so on) are
+	  done once, no matter how many subscribers want them.
+
+	- capture_next() is a one-shot subscription that captures just the next
+	  frame.
+
+	- tap() returns an object that looks enough like the core for any of the
+	  video outputs' set_video_refresh_cb() functions, so those outputs can
+	  run side by side; they get the raw frame data, as usual.
+
+The bus only copies a frame out of libsnes' framebuffer if somebody has
+subscribed to Frames or asked to capture one.
+"""
+from snes.video.frame import ChangeDetector, capture
+
+
+class FrameCapture(object):
+	"""
+	A request to capture the next video frame.
+
+	"frame" is None until the frame arrives, then the captured Frame.
+	"""
+
+	def __init__(self, callback=None):
+		self.frame = None
+		self.callback = callback
+
+	@property
+	def done(self):
+		return self.frame is not None
+
+
+class _Tap(object):
+	"""
+	Stands in for a core, passing video callbacks to a FrameBus.
+
+	Everything except set_video_refresh_cb() is passed on to the real core.
+	"""
+
+	def __init__(self, bus):
+		self._bus = bus
+		self._callback = None
+
+	def set_video_refresh_cb(self, callback):
+		if self._callback is not None:
+			self._bus._raw.remove(self._callback)
+
+		self._callback = callback
+		self._bus._raw.append(callback)
+
+	def close(self):
+		"""
+		Stop passing frames to this tap's callback.
+		"""
+		if self._callback is not None:
+			self._bus._raw.remove(self._callback)
+			self._callback = None
+
+	def __getattr__(self, name):
+		return getattr(self._bus.core, name)
+
+
+class FrameBus(object):
+	"""
+	Hands each video frame from a core to any number of consumers.
+	"""
+
+	def __init__(self, core):
+		"""
+		Take over the video refresh callback of the given core.
+
+		"core" should be an instance of snes.core.EmulatedSNES, or anything
+		else with a compatible set_video_refresh_cb() method. Usually you
+		want the bus from its "frame_bus" property, rather than making your
+		own.
+		"""
+		self.core = core
+
+		self._subscribers = []
+		self._captures = []
+		self._raw = []
+
+		self._detector = ChangeDetector()
+		self._previous = None
+
+		self.attach()
+
+	def attach(self):
+		"""
+		Make this bus the core's video refresh callback again.
+
+		This is only needed if something else has called the core's
+		set_video_refresh_cb() since the bus was created.
+		"""
+		self.core.set_video_refresh_cb(self.video_refresh)
+
+	def subscribe(self, callback):
+		"""
+		Call "callback" with a Frame for every video frame.
+
+		Returns "callback", for passing to unsubscribe() later.
+		"""
+		self._subscribers.append(callback)
+		return callback
+
+	def unsubscribe(self, callback):
+		"""
+		Stop calling a callback passed to subscribe().
+		"""
+		self._subscribers.remove(callback)
+
+	def capture_next(self, callback=None):
+		"""
+		Capture the next video frame.
+
+		Returns a FrameCapture whose "frame" attribute will hold the Frame
+		once it arrives. If "callback" is given, it's also called with the
+		Frame.
+		"""
+		res = FrameCapture(callback)
+		self._captures.append(res)
+		return res
+
+	def tap(self):
+		"""
+		Return a stand-in for the core to pass to a video output.
+
+		For example, pygame_output.set_video_refresh_cb(bus.tap(), paint)
+		shows every frame with pygame, without stopping anybody else from
+		getting them too. Call the tap's close() method to disconnect it.
+		"""
+		return _Tap(self)
+
+	def video_refresh(self, data, width, height, hires, interlace, overscan,
+			pitch):
+		"""
+		Hand a frame of libsnes video data to everybody interested.
+
+		This is suitable for passing to core.EmulatedSNES.set_video_refresh_cb.
+		"""
+		for callback in list(self._raw):
+			callback(data, width, height, hires, interlace, overscan, pitch)
+
+		if not (self._subscribers or self._captures):
+			# Nobody wants a Frame, so don't copy one. Since nobody saw this
+			# one, the next can't be passed off as a repeat of it.
+			self._previous = None
+			return
+
+		unchanged = self._detector.unchanged(data, width, height, pitch)
+		if unchanged and self._previous is not None:
+			frame = self._previous.repeat()
+		elif data is None:
+			# A repeat of a frame we didn't keep.
+			return
+		else:
+			frame = capture(data, width, height, hires, interlace, overscan,
+					pitch)
+
+		self._previous = frame
+
+		captures, self._captures = self._captures, []
+
+		for callback in list(self._subscribers):
+			callback(frame)
+
+		for request in captures:
+			request.frame = frame
+			if request.callback is not None:
+				request.callback(frame)
@@ -0,0 +1,302 @@
+"""
+Colour correction for SNES video frames.
+
+The SNES produces 15-bit pixels, with five bits for each of red, green and
+blue. The simplest way to display them (and the way snes.util has always
+done it) is to stretch each channel to eight bits by repeating its highest
+bits, but that's not how they looked on a television: the SNES's output
+curve isn't linear, and a CRT's gamma isn't the same as an sRGB monitor's.
+
+A ColorProfile describes how to convert SNES pixels for display:
+
+	"curve" maps each 5-bit channel value to a brightness. CURVE_RAW is
+	the plain bit-repeating conversion, and CURVE_SNES is the curve bsnes
+	uses to mimic a SNES on a television.
+
+	"gamma", if given, is the gamma of the display the curve was meant for
+	(2.2 to 2.5, for a CRT). Colours are converted to linear light with it,
+	adjusted, and converted back with the sRGB transfer function, so they
+	look right on a modern monitor.
+
+	"brightness" multiplies every channel, and "saturation" moves each
+	colour towards (below 1.0) or away from (above 1.0) the grey of the
+	same luminance.
+
+Since there are only 32768 possible pixels, all that arithmetic is done
+once per profile, building a lookup table with the RGB888 colour of every
+pixel; converting a frame is then a single numpy.take(), whatever the
+profile. Tables are cached in memory, and on disk (in DEFAULT_CACHE_DIR, by
+default) so they needn't be built again next time.
+"""
+import hashlib
+import os
+import os.path
+from tempfile import mkstemp
+import numpy
+from snes.util import snes_array_to_RGB888
+
+CURVE_RAW = "raw"
+CURVE_SNES = "snes"
+
+# The brightness of each 5-bit channel value, out of 255.
+CURVES = {
+		CURVE_RAW: [(value << 3) | (value >> 2) for value in xrange(32)],
+		CURVE_SNES: [
+			0x00, 0x01, 0x03, 0x06, 0x0a, 0x0f, 0x15, 0x1c,
+			0x24, 0x2d, 0x37, 0x42, 0x4e, 0x5b, 0x69, 0x78,
+			0x88, 0x90, 0x98, 0xa0, 0xa8, 0xb0, 0xb8, 0xc0,
+			0xc8, 0xd0, 0xd8, 0xe0, 0xe8, 0xf0, 0xf8, 0xff,
+		],
+	}
+
+# Rec. 709 luminance weights, for working out the grey that saturation
+# moves colours towards.
+_LUMINANCE = numpy.array([0.2126, 0.7152, 0.0722])
+
+# Bump this whenever the way tables are built changes, so that old tables
+# on disk are ignored.
+TABLE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(
+		os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+		"snes", "color",
+	)
+
+# Tables that have already been loaded or built, keyed by profile key.
+_tables = {}
+
+
+class ColorProfile(object):
+	"""
+	Describes how to convert SNES pixels to RGB888 for display.
+
+	See the module documentation for the meaning of each parameter. The
+	default profile converts pixels exactly as snes.util does.
+	"""
+
+	def __init__(self, curve=CURVE_RAW, gamma=None, brightness=1.0,
+			saturation=1.0):
+		if curve not in CURVES:
+			raise ValueError("Unknown colour curve %r" % (curve,))
+
+		self.curve = curve
+		self.gamma = gamma
+		self.brightness = brightness
+		self.saturation = saturation
+
+	@property
+	def key(self):
+		"""
+		A string that identifies this profile's lookup table.
+		"""
+		return "curve=%s gamma=%r brightness=%r saturation=%r" % (
+				self.curve, self.gamma, self.brightness, self.saturation,
+			)
+
+	def __eq__(self, other):
+		return isinstance(other, ColorProfile) and self.key == other.key
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash(self.key)
+
+	def __repr__(self):
+		return "<ColorProfile: %s>" % (self.key,)
+
+	def build_table(self):
+		"""
+		Return this profile's lookup table, building it from scratch.
+
+		The table is a uint8 array of shape (32768, 3), holding the red,
+		green and blue values each pixel is converted to.
+		"""
+		pixels = numpy.arange(32768, dtype=numpy.uint16)
+		curve = numpy.array(CURVES[self.curve], dtype=numpy.float64) / 255
+
+		levels = numpy.empty( (32768, 3), dtype=numpy.float64 )
+		for channel, shift in enumerate((10, 5, 0)):
+			levels[:, channel] = curve[(pixels >> shift) & 0x1f]
+
+		if self.gamma is not None:
+			levels **= self.gamma
+
+		levels *= self.brightness
+
+		if self.saturation != 1.0:
+			grey = levels.dot(_LUMINANCE)[:, None]
+			levels -= grey
+			levels *= self.saturation
+			levels += grey
+
+		numpy.clip(levels, 0.0, 1.0, levels)
+
+		if self.gamma is not None:
+			levels = _srgb_encode(levels)
+
+		return numpy.rint(levels * 255).astype(numpy.uint8)
+
+
+def _srgb_encode(levels):
+	"""
+	Convert linear light levels between 0 and 1 to sRGB values.
+	"""
+	return numpy.where(levels <= 0.0031308,
+			levels * 12.92,
+			1.055 * levels ** (1 / 2.4) - 0.055,
+		)
+
+
+DEFAULT_PROFILE = ColorProfile()
+
+# Some useful profiles, by name.
+PROFILES = {
+		"raw": DEFAULT_PROFILE,
+		"crt": ColorProfile(gamma=2.5),
+		"snes": ColorProfile(CURVE_SNES),
+	}
+
+
+def _table_path(cache_dir, profile):
+	key = hashlib.sha1("%d:%s" % (TABLE_VERSION, profile.key)).hexdigest()
+	return os.path.join(cache_dir, key + ".npy")
+
+
+def _load_table(path):
+	try:
+		res = numpy.load(path)
+	except (IOError, ValueError):
+		return None
+
+	if res.shape != (32768, 3) or res.dtype != numpy.uint8:
+		return None
+
+	return res
+
+
+def _save_table(path, table):
+	"""
+	Write a table to disk, if we can. A table that can't be saved is just
+	built again next time.
+	"""
+	try:
+		cache_dir = os.path.dirname(path)
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+
+		fd, tempname = mkstemp(dir=cache_dir)
+	except (IOError, OSError):
+		return
+
+	try:
+		with os.fdopen(fd, "wb") as handle:
+			numpy.save(handle, table)
+		os.rename(tempname, path)
+	except (IOError, OSError):
+		os.unlink(tempname)
+
+
+def lookup_table(profile=None, cache_dir=None):
+	"""
+	Return the lookup table for the given ColorProfile.
+
+	"profile" defaults to DEFAULT_PROFILE. The table is as described in
+	ColorProfile.build_table(), and is shared with everybody else who asks
+	for the same profile, so it mustn't be modified.
+
+	"cache_dir" is the directory tables are saved in and loaded from. If
+	None, DEFAULT_CACHE_DIR is used; if False, tables are neither loaded
+	from nor saved to disk.
+	"""
+	if profile is None:
+		profile = DEFAULT_PROFILE
+
+	res = _tables.get(profile.key)
+	if res is not None:
+		return res
+
+	if cache_dir is None:
+		cache_dir = DEFAULT_CACHE_DIR
+
+	if cache_dir is not False:
+		path = _table_path(cache_dir, profile)
+		res = _load_table(path)
+
+	if res is None:
+		res = profile.build_table()
+		if cache_dir is not False:
+			_save_table(path, res)
+
+	res.flags.writeable = False
+	_tables[profile.key] = res
+
+	return res
+
+
+def packed_table(profile=None, masks=(0xFF0000, 0x00FF00, 0x0000FF),
+		cache_dir=None):
+	"""
+	Return a lookup table of the colours of a profile packed into uint32s.
+
+	"masks" are the red, green and blue masks of the packed pixels, such as
+	those of a 32-bit pygame.Surface. Each channel must be eight bits wide.
+
+	Returns a uint32 array of shape (32768,). Use it with convert() to
+	convert frames straight into a 32-bit surface.
+	"""
+	table = lookup_table(profile, cache_dir).astype(numpy.uint32)
+
+	res = numpy.zeros(32768, dtype=numpy.uint32)
+	for channel, mask in enumerate(masks):
+		shift = _lowest_bit(mask)
+		res |= table[:, channel] << shift
+
+	return res
+
+
+def _lowest_bit(mask):
+	shift = 0
+	while mask and not mask & (1 << shift):
+		shift += 1
+	return shift
+
+
+def convert(pixels, table, out=None):
+	"""
+	Convert an array of SNES pixels with a lookup table.
+
+	"pixels" is a uint16 array of any shape, such as the one returned by
+	snes.util.snes_framebuffer_to_array(). "table" is a table returned by
+	lookup_table() or packed_table().
+
+	"out", if given, is an array to store the result in: the shape of
+	"pixels", plus the shape of one entry of the table.
+
+	Returns the converted array.
+	"""
+	pixels = numpy.asarray(pixels, dtype=numpy.uint16)
+
+	if out is None:
+		out = numpy.empty(pixels.shape + table.shape[1:], dtype=table.dtype)
+
+	# With mode="wrap", numpy.take() writes straight into "out" rather
+	# than into a temporary buffer, and ignores the unused top bit of each
+	# pixel, just like snes.util does.
+	numpy.take(table, pixels, axis=0, out=out, mode="wrap")
+
+	return out
+
+
+def to_RGB888(pixels, profile=None, cache_dir=None):
+	"""
+	Convert an array of SNES pixels to RGB888, using the given ColorProfile.
+
+	This returns the same thing as snes.util.snes_array_to_RGB888(), but
+	with the profile's colour correction.
+	"""
+	if profile is None or profile == DEFAULT_PROFILE:
+		# Decoding the bits directly is a little quicker than a table.
+		return snes_array_to_RGB888(pixels)
+
+	return convert(pixels, lookup_table(profile, cache_dir))
@@ -0,0 +1,147 @@
+"""
+Tracks which parts of the SNES screen change from one frame to the next.
+
+The SNES draws its screen out of 8x8 tiles, and during typical gameplay most
+of them are the same from one frame to the next. DirtyTracker compares each
+frame with the previous one and reports which 8x8 tiles have changed, as a
+2D array of booleans (a "dirty tile bitmap"), and dirty_rects() turns that
+bitmap into a short list of rectangles covering the changed tiles. Outputs
+can use them to copy, upload or redraw only the parts of the screen that
+actually changed.
+"""
+import math
+import numpy
+from snes.util import snes_framebuffer_to_array
+
+TILE_SIZE = 8
+
+# If a frame has more dirty rectangles than this, it's usually cheaper to
+# update the whole screen than each rectangle individually.
+DEFAULT_MAX_RECTS = 32
+
+
+class DirtyTracker(object):
+	"""
+	Compares each frame with the previous one, 8x8 tile by 8x8 tile.
+
+	The following attributes are available:
+
+		"pixels" is a uint16 array holding the visible pixels of the most
+		recent frame. Its width and height are rounded up to a multiple of
+		the tile size, with the extra pixels set to zero.
+	"""
+
+	def __init__(self):
+		self.pixels = None
+		self._size = None
+		self._changed = None
+
+	def update(self, data, width, height, pitch):
+		"""
+		Compare the given video data with the previous frame.
+
+		The parameters are the same as the ones passed to the callback given
+		to core.EmulatedSNES.set_video_refresh_cb(). "data" may be None, as
+		libretro cores pass for a repeated frame.
+
+		Returns a boolean array with one element per 8x8 tile of the frame,
+		of shape (rows, columns), that's True for each tile whose pixels have
+		changed. Every tile is dirty in the first frame, and whenever the
+		frame's dimensions change. No tile is dirty if "data" is None.
+		"""
+		rows = -(-height // TILE_SIZE)
+		columns = -(-width // TILE_SIZE)
+
+		if data is None:
+			return numpy.zeros( (rows, columns), dtype=bool )
+
+		pixels = snes_framebuffer_to_array(data, width, height, pitch)
+
+		if self._size != (width, height):
+			self._size = (width, height)
+			self.pixels = numpy.zeros( (rows * TILE_SIZE, columns * TILE_SIZE),
+					dtype=numpy.uint16 )
+			self.pixels[:height, :width] = pixels
+			self._changed = numpy.zeros(self.pixels.shape, dtype=bool)
+
+			return numpy.ones( (rows, columns), dtype=bool )
+
+		# The padding around the visible area never changes, so it stays
+		# False in self._changed.
+		visible = self.pixels[:height, :width]
+		numpy.not_equal(visible, pixels, self._changed[:height, :width])
+		visible[...] = pixels
+
+		tiles = self._changed.reshape(rows, TILE_SIZE, columns, TILE_SIZE)
+
+		return tiles.any(axis=3).any(axis=1)
+
+
+def dirty_rects(dirty, width, height, scale_x=1, scale_y=1,
+		max_rects=DEFAULT_MAX_RECTS):
+	"""
+	Return a list of rectangles covering the dirty tiles in a bitmap.
+
+	"dirty" is a dirty tile bitmap, as returned by DirtyTracker.update().
+
+	"width" and "height" are the dimensions of the frame; rectangles are
+	clipped to them.
+
+	"scale_x" and "scale_y" are multiplied into the rectangles' coordinates,
+	for frames that will be shown at a different size (such as hi-res frames
+	scaled down to 256 pixels wide). Scaled rectangles are rounded outwards.
+
+	If there would be more than "max_rects" rectangles, a single rectangle
+	covering all of them is returned instead.
+
+	Each rectangle is an (x, y, width, height) tuple.
+	"""
+	# Find runs of dirty tiles in each row, and merge each run with an
+	# identical run directly above it.
+	rows, columns = dirty.shape
+	padded = numpy.zeros( (rows, columns + 2), dtype=numpy.int8 )
+	padded[:, 1:-1] = dirty
+	edges = numpy.diff(padded, axis=1)
+
+	finished = []
+	open_rects = {}
+	for row in xrange(rows):
+		starts = numpy.flatnonzero(edges[row] == 1)
+		ends = numpy.flatnonzero(edges[row] == -1)
+
+		still_open = {}
+		for run in zip(starts.tolist(), ends.tolist()):
+			first_row = open_rects.pop(run, row)
+			still_open[run] = first_row
+
+		for (start, end), first_row in open_rects.items():
+			finished.append( (start, first_row, end, row) )
+
+		open_rects = still_open
+
+	for (start, end), first_row in open_rects.items():
+		finished.append( (start, first_row, end, rows) )
+
+	if not finished:
+		return []
+
+	if len(finished) > max_rects:
+		finished = [(
+				min(r[0] for r in finished),
+				min(r[1] for r in finished),
+				max(r[2] for r in finished),
+				max(r[3] for r in finished),
+			)]
+
+	finished.sort(key=lambda rect: (rect[1], rect[0]))
+
+	res = []
+	for left, top, right, bottom in finished:
+		left = int(math.floor(left * TILE_SIZE * scale_x))
+		top = int(math.floor(top * TILE_SIZE * scale_y))
+		right = int(math.ceil(min(right * TILE_SIZE, width) * scale_x))
+		bottom = int(math.ceil(min(bottom * TILE_SIZE, height) * scale_y))
+
+		res.append( (left, top, right - left, bottom - top) )
+
+	return res
@@ -0,0 +1,279 @@
+"""
+Raw SNES video frames, captured for later processing.
+
+Unlike the other video outputs, this one doesn't convert the frame to any
+particular format; it just copies the visible pixels out of libsnes'
+framebuffer, so they can be hashed, stored or converted later.
+
+Games often produce the same frame many times in a row (on menus, while
+paused, or during fades). ChangeDetector notices this cheaply, so that video
+outputs can skip converting or copying a frame they've already handled.
+"""
+import hashlib
+import struct
+import numpy
+from snes.util import snes_framebuffer_to_array, snes_array_to_RGB888
+
+# Identifies the dimensions of a frame, for hashing purposes.
+_digest_struct = struct.Struct('<HH')
+
+
+class Frame(object):
+	"""
+	A single video frame, as produced by libsnes.
+
+	"pixels" is a uint16 numpy array of shape (height, width) containing
+	XBGR1555 pixels.
+
+	"hires", "interlace" and "overscan" have the same meaning as the
+	parameters of the same name passed to the callback given to
+	core.EmulatedSNES.set_video_refresh_cb().
+
+	"unchanged" is True if this frame is known to be identical to the one
+	produced before it.
+
+	The frame can also be had in other formats: see the "rgb888", "rgba",
+	"image" and "surface" properties. Each is only converted the first time
+	it's asked for, and shared by everybody who asks after that.
+	"""
+
+	def __init__(self, pixels, hires=None, interlace=None, overscan=None,
+			unchanged=False):
+		self.pixels = pixels
+		self.unchanged = unchanged
+		height, width = pixels.shape
+
+		if hires is None:
+			hires = (width == 512)
+		if interlace is None:
+			interlace = (height == 448 or height == 478)
+		if overscan is None:
+			overscan = (height == 239 or height == 478)
+
+		self.hires = hires
+		self.interlace = interlace
+		self.overscan = overscan
+
+		self._digest = None
+		self._rgb888 = {}
+		self._rgba = None
+		self._image = None
+		self._surface = None
+
+	@classmethod
+	def fromstring(cls, data, width, height):
+		"""
+		Construct a Frame from the string returned by Frame.tostring().
+		"""
+		pixels = numpy.fromstring(data, dtype='<u2').astype(numpy.uint16)
+		return cls(pixels.reshape(height, width))
+
+	@property
+	def width(self):
+		return self.pixels.shape[1]
+
+	@property
+	def height(self):
+		return self.pixels.shape[0]
+
+	@property
+	def digest(self):
+		"""
+		A hex string that identifies the content of this frame.
+
+		Two frames have the same digest if and only if they have the same
+		dimensions and the same pixels.
+		"""
+		if self._digest is None:
+			hasher = hashlib.sha1(_digest_struct.pack(self.width, self.height))
+			hasher.update(self.tostring())
+			self._digest = hasher.hexdigest()
+
+		return self._digest
+
+	@property
+	def rgb888(self):
+		"""
+		This frame as a uint8 array of shape (height, width, 3), holding the
+		red, green and blue values of each pixel.
+		"""
+		return self.to_rgb888()
+
+	def to_rgb888(self, profile=None):
+		"""
+		Return this frame as an RGB888 array, like the "rgb888" property,
+		colour-corrected with the given snes.video.color.ColorProfile.
+
+		Each profile's conversion is cached, just like "rgb888".
+		"""
+		key = None if profile is None else profile.key
+
+		res = self._rgb888.get(key)
+		if res is None:
+			if profile is None:
+				res = snes_array_to_RGB888(self.pixels)
+			else:
+				# Only import the colour code if somebody actually wants it.
+				from snes.video import color
+				res = color.to_RGB888(self.pixels, profile)
+
+			self._rgb888[key] = res
+
+		return res
+
+	@property
+	def rgba(self):
+		"""
+		This frame as a uint8 array of shape (height, width, 4), holding the
+		red, green, blue and (opaque) alpha values of each pixel.
+		"""
+		if self._rgba is None:
+			res = numpy.empty( (self.height, self.width, 4),
+					dtype=numpy.uint8 )
+			res[..., :3] = self.rgb888
+			res[..., 3] = 255
+			self._rgba = res
+
+		return self._rgba
+
+	@property
+	def image(self):
+		"""
+		This frame as an RGB PIL.Image.
+		"""
+		if self._image is None:
+			# Only import PIL if somebody actually wants an image.
+			from PIL import Image
+			self._image = Image.fromstring("RGB", (self.width, self.height),
+					self.rgb888.tostring())
+
+		return self._image
+
+	@property
+	def surface(self):
+		"""
+		This frame as a 15-bit pygame.Surface.
+
+		The SNES's pixels are copied in as they are, without converting
+		them; pygame converts them when the surface is drawn.
+		"""
+		if self._surface is None:
+			# Only import pygame if somebody actually wants a surface.
+			import pygame
+			from snes.video import pygame_output
+
+			surface = pygame.Surface( (self.width, self.height), depth=15,
+					masks=pygame_output.SNES_MASKS)
+			target = pygame_output._surface_pixels(surface)
+			target[...] = self.pixels
+			# Release the surface's lock.
+			del target
+
+			self._surface = surface
+
+		return self._surface
+
+	def repeat(self):
+		"""
+		Return a Frame identical to this one, marked as unchanged.
+
+		The new Frame shares this one's pixels (and any cached digest or
+		conversions), so nothing is copied or converted again.
+		"""
+		res = Frame(self.pixels, self.hires, self.interlace, self.overscan,
+				unchanged=True)
+		res._digest = self._digest
+		res._rgb888 = self._rgb888
+		res._rgba = self._rgba
+		res._image = self._image
+		res._surface = self._surface
+
+		return res
+
+	def tostring(self):
+		"""
+		Return the pixels of this frame as a string of little-endian uint16s.
+		"""
+		return self.pixels.astype('<u2').tostring()
+
+
+class ChangeDetector(object):
+	"""
+	Notices when a video refresh callback is given the same frame twice.
+
+	Keeps a copy of the visible pixels of the most recent frame, and compares
+	each new frame against it. This is exact, and much cheaper than
+	converting the frame to any other format.
+	"""
+
+	def __init__(self):
+		self._previous = None
+
+	def unchanged(self, data, width, height, pitch):
+		"""
+		Return True if the given video data is the same as last time.
+
+		The parameters are the same as the ones passed to the callback given
+		to core.EmulatedSNES.set_video_refresh_cb(). "data" may be None, as
+		libretro cores pass for a repeated frame, in which case the frame is
+		always unchanged (even if there was no previous frame, so callers
+		should be ready to find they have nothing to repeat).
+		"""
+		if data is None:
+			return True
+
+		pixels = snes_framebuffer_to_array(data, width, height, pitch)
+		previous = self._previous
+
+		if previous is None or previous.shape != pixels.shape:
+			self._previous = numpy.array(pixels)
+			return False
+
+		if numpy.array_equal(previous, pixels):
+			return True
+
+		previous[...] = pixels
+		return False
+
+
+def capture(data, width, height, hires, interlace, overscan, pitch):
+	"""
+	Copy the given libsnes video data into a new Frame.
+
+	The parameters are the same as the ones passed to the callback given to
+	core.EmulatedSNES.set_video_refresh_cb().
+	"""
+	pixels = numpy.array(
+			snes_framebuffer_to_array(data, width, height, pitch))
+
+	return Frame(pixels, hires, interlace, overscan)
+
+
+def set_video_refresh_cb(core, callback):
+	"""
+	Sets the callback that will handle updated video frames.
+
+	Unlike core.EmulatedSNES.set_video_refresh_cb, the callback passed to this
+	function should accept only one parameter:
+
+		"frame" is an instance of Frame containing the frame data.
+
+	If a frame is the same as the previous one, the callback is given a Frame
+	whose "unchanged" attribute is True, sharing the previous Frame's pixels.
+	"""
+	detector = ChangeDetector()
+	previous = [None]
+
+	def wrapper(data, width, height, hires, interlace, overscan, pitch):
+		if detector.unchanged(data, width, height, pitch):
+			if previous[0] is None:
+				return
+			frame = previous[0].repeat()
+		else:
+			frame = capture(data, width, height, hires, interlace, overscan,
+					pitch)
+
+		previous[0] = frame
+		callback(frame)
+
+	core.set_video_refresh_cb(wrapper)
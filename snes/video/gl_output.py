@@ -2,16 +2,223 @@
 PyOpenGL output for SNES video.
 """
 from OpenGL.GL import *
-from OpenGL.raw.GL import glTexImage2D
+from OpenGL.GL import shaders
+from OpenGL.raw.GL import glTexImage2D, glTexSubImage2D
 import ctypes
+import os.path
+import time
+import numpy
 from xml.etree import ElementTree as ET
+from snes.video.dirty import DirtyTracker, dirty_rects
 
 SHADER_TYPES = {
-		"vertex": OpenGL.GL.GL_VERTEX_SHADER,
-		"fragment": OpenGL.GL.GL_FRAGMENT_SHADER,
+		"vertex": GL_VERTEX_SHADER,
+		"fragment": GL_FRAGMENT_SHADER,
 	}
 
-def set_video_refresh_cb(core, callback):
+def pbo_supported():
+	"""
+	Return True if the current OpenGL context supports pixel buffer objects.
+	"""
+	return bool(glGenBuffers) and bool(glMapBuffer)
+
+
+def _framebuffer_address(data, size):
+	"""
+	Return the address of "size" pixels of libsnes video data.
+
+	"data" may be anything snes.util.snes_framebuffer_to_array() accepts.
+	Returns an (address, source) tuple; "source" must be kept alive for as
+	long as the address is used.
+	"""
+	if isinstance(data, ctypes._Pointer):
+		return ctypes.addressof(data.contents), data
+
+	if isinstance(data, (int, long)):
+		return data, None
+
+	source = numpy.ascontiguousarray(
+			numpy.asarray(data, dtype=numpy.uint16).ravel()[:size])
+	return source.ctypes.data, source
+
+
+class TextureUploader(object):
+	"""
+	Streams libsnes video data into OpenGL textures.
+
+	Each frame size gets its own texture, whose storage is allocated the
+	first time a frame of that size is uploaded, and reused afterwards.
+	Frames are read straight out of libsnes' framebuffer, with
+	GL_UNPACK_ROW_LENGTH set to its pitch, so they never need repacking.
+
+	Where pixel buffer objects are available, frames are copied into one of
+	a ring of them and uploaded from there, so the GL can transfer one frame
+	to the texture while the next is being copied into the next buffer.
+
+	The following attributes are available:
+
+		"textures" maps (width, height) tuples to texture IDs.
+
+		"use_pbo" is True if frames are uploaded through pixel buffer
+		objects.
+
+		"frames_uploaded" is the number of frames uploaded so far.
+
+		"bytes_uploaded" is the number of bytes of pixel data uploaded.
+
+		"texture_allocations" is the number of times texture storage has
+		been allocated.
+
+		"upload_time" is the total number of seconds spent uploading. Since
+		the GL may carry on with an upload after the call that started it
+		returns, this only includes the time the CPU spent.
+
+		"last_upload_time" is the number of seconds spent uploading the most
+		recent frame.
+	"""
+
+	def __init__(self, use_pbo=None, pbo_count=2):
+		"""
+		Prepare to upload frames.
+
+		An OpenGL context must be current.
+
+		If "use_pbo" is None, pixel buffer objects are used if the context
+		supports them. "pbo_count" is how many of them to cycle through.
+		"""
+		if use_pbo is None:
+			use_pbo = pbo_supported()
+
+		self.textures = {}
+		self.use_pbo = use_pbo
+
+		self.frames_uploaded = 0
+		self.bytes_uploaded = 0
+		self.texture_allocations = 0
+		self.upload_time = 0.0
+		self.last_upload_time = 0.0
+
+		self._pbos = []
+		self._next_pbo = 0
+		if use_pbo:
+			self._pbos = [glGenBuffers(1) for _ in xrange(pbo_count)]
+
+	@property
+	def mean_upload_time(self):
+		"""
+		The mean number of seconds spent uploading each frame.
+		"""
+		if not self.frames_uploaded:
+			return 0.0
+		return self.upload_time / self.frames_uploaded
+
+	def texture(self, width, height):
+		"""
+		Return the ID of the texture for frames of the given size, bound to
+		GL_TEXTURE_2D.
+		"""
+		texture = self.textures.get( (width, height) )
+
+		if texture is None:
+			texture = glGenTextures(1)
+			glBindTexture(GL_TEXTURE_2D, texture)
+			glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0,
+					GL_BGRA, GL_UNSIGNED_SHORT_1_5_5_5_REV, None)
+
+			self.textures[ (width, height) ] = texture
+			self.texture_allocations += 1
+		else:
+			glBindTexture(GL_TEXTURE_2D, texture)
+
+		return texture
+
+	def upload(self, data, width, height, pitch, rects=None):
+		"""
+		Upload a frame of libsnes video data.
+
+		"data", "width", "height" and "pitch" are the same as the parameters
+		passed to the callback given to core.EmulatedSNES.set_video_refresh_cb.
+
+		"rects" is a list of (x, y, width, height) rectangles to upload,
+		such as the ones returned by snes.video.dirty.dirty_rects(). If it's
+		None, the whole frame is uploaded.
+
+		Returns the ID of the texture the frame was uploaded into.
+		"""
+		start = time.time()
+
+		texture = self.texture(width, height)
+
+		if rects is None:
+			rects = [(0, 0, width, height)]
+		if not rects:
+			return texture
+
+		# Only the lines covered by a rectangle need to be read.
+		top = min(y for x, y, w, h in rects)
+		bottom = max(y + h for x, y, w, h in rects)
+		size = pitch * (bottom - top - 1) + width
+
+		address, source = _framebuffer_address(data, pitch * (bottom - 1) +
+				width)
+		address += top * pitch * 2
+
+		if self.use_pbo:
+			pbo = self._pbos[self._next_pbo]
+			self._next_pbo = (self._next_pbo + 1) % len(self._pbos)
+
+			glBindBuffer(GL_PIXEL_UNPACK_BUFFER, pbo)
+			# Replace the buffer's storage rather than overwriting it, so we
+			# don't have to wait for the GL to finish reading the last frame
+			# we put in it.
+			glBufferData(GL_PIXEL_UNPACK_BUFFER, size * 2, None,
+					GL_STREAM_DRAW)
+			target = glMapBuffer(GL_PIXEL_UNPACK_BUFFER, GL_WRITE_ONLY)
+			ctypes.memmove(target, address, size * 2)
+			glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+
+			# Pixels are now read from an offset into the buffer.
+			address = 0
+
+		glPixelStorei(GL_UNPACK_ALIGNMENT, 2)
+		glPixelStorei(GL_UNPACK_ROW_LENGTH, pitch)
+
+		for x, y, w, h in rects:
+			glPixelStorei(GL_UNPACK_SKIP_PIXELS, x)
+			glPixelStorei(GL_UNPACK_SKIP_ROWS, y - top)
+
+			glTexSubImage2D(GL_TEXTURE_2D, 0, x, y, w, h, GL_BGRA,
+					GL_UNSIGNED_SHORT_1_5_5_5_REV, ctypes.c_void_p(address))
+
+			self.bytes_uploaded += w * h * 2
+
+		glPixelStorei(GL_UNPACK_SKIP_PIXELS, 0)
+		glPixelStorei(GL_UNPACK_SKIP_ROWS, 0)
+		glPixelStorei(GL_UNPACK_ROW_LENGTH, 0)
+		glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+
+		if self.use_pbo:
+			glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+		self.last_upload_time = time.time() - start
+		self.upload_time += self.last_upload_time
+		self.frames_uploaded += 1
+
+		return texture
+
+	def close(self):
+		"""
+		Delete our textures and pixel buffer objects.
+		"""
+		if self.textures:
+			glDeleteTextures(self.textures.values())
+			self.textures = {}
+		if self._pbos:
+			glDeleteBuffers(len(self._pbos), self._pbos)
+			self._pbos = []
+
+
+def set_video_refresh_cb(core, callback, use_pbo=None):
 	"""
 	Sets the callback that will handle updated video frames.
 
@@ -30,31 +237,40 @@ def set_video_refresh_cb(core, callback):
 
 		"textureH" is an integer, the height of the allocated texture in
 		pixels.
+
+	Only the 8x8 tiles that have changed since the previous frame are
+	uploaded to the texture; if a frame is the same as the previous one, the
+	texture isn't touched at all.
+
+	"use_pbo" is passed to TextureUploader. Returns the TextureUploader, whose
+	attributes report how long uploads are taking.
 	"""
-	# Allocate and configure our texture.
-	texture = glGenTextures(1)
-	glBindTexture(GL_TEXTURE_2D, texture)
+	uploader = TextureUploader(use_pbo)
+	tracker = DirtyTracker()
+	previous = [None]
 
 	def wrapper(data, width, height, hires, interlace, overscan, pitch):
-		# Extract the pixel data we want into a framebuffer.
-		frame_buf = ctypes.create_string_buffer(width * height * 2)
-		for y in xrange(height):
-			ctypes.memmove(
-					ctypes.addressof(frame_buf)     + (y * width * 2),
-					ctypes.addressof(data.contents) + (y * pitch * 2),
-					width * 2,
-				)
+		dirty = tracker.update(data, width, height, pitch)
 
-		# Load our texture
-		glBindTexture(GL_TEXTURE_2D, texture)
+		if not dirty.any():
+			if previous[0] is not None:
+				callback(*previous[0])
+			return
 
-		glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_BGRA,
-				GL_UNSIGNED_SHORT_1_5_5_5_REV, frame_buf)
+		if (width, height) in uploader.textures:
+			rects = dirty_rects(dirty, width, height)
+		else:
+			rects = None
 
-		callback(texture, width, height, width, height)
+		texture = uploader.upload(data, width, height, pitch, rects)
+
+		previous[0] = (texture, width, height, width, height)
+		callback(*previous[0])
 
 	core.set_video_refresh_cb(wrapper)
 
+	return uploader
+
 
 def load_shader_elem(filename):
 	"""
@@ -80,3 +296,101 @@ def compile_shader_elem(elem):
 		]
 
 	return shaders.compileProgram(*shaderList)
+
+
+class ShaderManager(object):
+	"""
+	Loads, compiles and caches the programs in XML shader files.
+
+	Each file is only parsed and compiled once, until it's modified on disk;
+	then the next request for its program recompiles it, so shaders can be
+	edited while they're in use. The locations of uniforms in each program
+	are cached too.
+	"""
+
+	def __init__(self):
+		# Maps absolute paths to (mtime, elem) tuples.
+		self._elems = {}
+		# Maps absolute paths to (mtime, program) tuples.
+		self._programs = {}
+		# Maps programs to dicts mapping uniform names to locations.
+		self._uniforms = {}
+
+	def load(self, filename):
+		"""
+		Return the ElementTree element for the given XML shader file, as
+		returned by load_shader_elem().
+		"""
+		path = os.path.abspath(filename)
+		mtime = os.stat(path).st_mtime
+
+		cached = self._elems.get(path)
+		if cached is not None and cached[0] == mtime:
+			return cached[1]
+
+		elem = load_shader_elem(path)
+		self._elems[path] = (mtime, elem)
+
+		return elem
+
+	def program(self, filename):
+		"""
+		Return the compiled program for the given XML shader file.
+
+		If the file has been modified since it was last compiled, it's
+		recompiled and the old program is deleted. If compiling fails, the
+		RuntimeError from the compiler is raised, and later calls return the
+		old program (or None, if there isn't one) until the file is modified
+		again.
+		"""
+		path = os.path.abspath(filename)
+		mtime = os.stat(path).st_mtime
+
+		cached = self._programs.get(path)
+		if cached is not None and cached[0] == mtime:
+			return cached[1]
+
+		try:
+			program = compile_shader_elem(self.load(path))
+		except RuntimeError:
+			old = None
+			if cached is not None:
+				old = cached[1]
+			self._programs[path] = (mtime, old)
+			raise
+
+		if cached is not None and cached[1] is not None:
+			self._delete_program(cached[1])
+
+		self._programs[path] = (mtime, program)
+
+		return program
+
+	def uniform_location(self, program, name):
+		"""
+		Return the location of the named uniform in the given program, or -1
+		if it doesn't have one.
+		"""
+		locations = self._uniforms.setdefault(program, {})
+
+		res = locations.get(name)
+		if res is None:
+			res = glGetUniformLocation(program, name)
+			locations[name] = res
+
+		return res
+
+	def _delete_program(self, program):
+		self._uniforms.pop(program, None)
+		glDeleteProgram(program)
+
+	def close(self):
+		"""
+		Delete every compiled program.
+		"""
+		for mtime, program in self._programs.values():
+			if program is not None:
+				self._delete_program(program)
+
+		self._programs = {}
+		self._elems = {}
@@ -0,0 +1,207 @@
+"""
+Converts SNES frames of any video mode to a common size.
+
+The SNES switches between 256 and 512 pixel wide modes, and between
+progressive (224 or 239 lines) and interlaced (448 or 478 lines) modes, as
+it likes. Hi-res and interlaced modes don't change the size of the picture
+on screen, just how finely it's divided, so frames of different modes can be
+converted to a common size without distorting them:
+
+	- Frames that are half the size (in either direction) have each pixel
+	  (or line) repeated.
+
+	- Frames that are twice the size have each pair of pixels (or lines)
+	  combined, according to the policy: POLICY_AVERAGE averages each colour
+	  channel of the pair, and POLICY_DROP keeps the first of each pair.
+
+	- Frames with more lines than wanted (such as overscan frames converted
+	  to 224 lines) have the extra lines cut off, and frames with fewer lines
+	  have the missing lines filled with zeros.
+
+POLICY_DOUBLE keeps every pixel of every mode, by converting all frames to
+the hi-res, interlaced size.
+
+All of this works on arrays of pixels before they're converted to any other
+colour format, since that's the cheapest place to do it. Besides 2D arrays of
+XBGR1555 pixels (such as the ones returned by
+snes.util.snes_framebuffer_to_array()), 3D arrays of uint8 colour channels
+(such as the ones returned by snes.util.snes_array_to_RGB888()) work too.
+"""
+import numpy
+
+POLICY_AVERAGE = "average"
+POLICY_DROP = "drop"
+POLICY_DOUBLE = "double"
+
+POLICIES = (POLICY_AVERAGE, POLICY_DROP, POLICY_DOUBLE)
+
+# The most lines in a non-interlaced frame, and the most pixels in a low-res
+# line. Anything bigger is twice the size.
+MAX_PROGRESSIVE_LINES = 239
+MAX_LOWRES_WIDTH = 256
+
+# For each kind of pixel, the bits of each channel except the lowest.
+_AVERAGE_MASKS = {
+		numpy.dtype(numpy.uint8): 0xFE,
+		numpy.dtype(numpy.uint16): 0x7BDE, # XBGR1555
+	}
+
+_SAME = 0
+_REDUCE = 1
+_DOUBLE = 2
+
+
+def _scale(source_size, dest_size, max_single):
+	"""
+	Work out how to convert "source_size" lines or pixels to "dest_size".
+
+	Sizes exactly half or twice the other are scaled whatever they are, so
+	reference images of any size can be compared; otherwise, sizes above
+	"max_single" are twice the size of the ones below it.
+	"""
+	if source_size == dest_size * 2:
+		return _REDUCE
+	if dest_size == source_size * 2:
+		return _DOUBLE
+
+	source_double = source_size > max_single
+	dest_double = dest_size > max_single
+
+	if source_double and not dest_double:
+		return _REDUCE
+	if dest_double and not source_double:
+		return _DOUBLE
+	return _SAME
+
+
+def canonical_size(width, height, policy=POLICY_AVERAGE):
+	"""
+	Return the (width, height) that frames of the given size are normalized
+	to with the given policy.
+
+	The overscan setting is kept, so 239- and 478-line frames become 239
+	lines (or 478, for POLICY_DOUBLE).
+	"""
+	if height > MAX_PROGRESSIVE_LINES:
+		height //= 2
+
+	if policy == POLICY_DOUBLE:
+		return MAX_LOWRES_WIDTH * 2, height * 2
+
+	return MAX_LOWRES_WIDTH, height
+
+
+class Normalizer(object):
+	"""
+	Converts frames of pixels to a common size.
+
+	Scratch space for averaging is allocated the first time it's needed for
+	each size of frame, and reused after that.
+	"""
+
+	def __init__(self, policy=POLICY_AVERAGE):
+		"""
+		"policy" is one of POLICY_AVERAGE, POLICY_DROP or POLICY_DOUBLE.
+		Frames that are twice the size they're being converted to are
+		averaged, unless the policy is POLICY_DROP.
+		"""
+		if policy not in POLICIES:
+			raise ValueError("Unknown policy %r" % (policy,))
+
+		self.policy = policy
+
+		# Preallocated arrays for averaging, keyed by shape and type.
+		self._scratch = {}
+
+	def _get_scratch(self, shape, dtype, which):
+		key = (shape, dtype, which)
+		res = self._scratch.get(key)
+		if res is None:
+			res = numpy.empty(shape, dtype=dtype)
+			self._scratch[key] = res
+		return res
+
+	def reduce(self, first, second):
+		"""
+		Combine two equally-sized arrays of pixels according to our policy.
+
+		The result may be "first" itself, or an array that's reused by the
+		next call with arrays of the same size.
+		"""
+		if self.policy == POLICY_DROP:
+			return first
+
+		mask = _AVERAGE_MASKS.get(first.dtype)
+		if mask is None:
+			raise ValueError("Can't average pixels of type %s"
+					% (first.dtype,))
+
+		# Average each channel without letting it carry into the next one:
+		# (a & b) + ((a ^ b) >> 1), with the bits that would be shifted into
+		# the channel below masked off.
+		res = self._get_scratch(first.shape, first.dtype, 0)
+		carry = self._get_scratch(first.shape, first.dtype, 1)
+
+		numpy.bitwise_xor(first, second, carry)
+		numpy.bitwise_and(carry, mask, carry)
+		numpy.right_shift(carry, 1, carry)
+		numpy.bitwise_and(first, second, res)
+		numpy.add(res, carry, res)
+
+		return res
+
+	def resize(self, pixels, width, height, out=None):
+		"""
+		Convert an array of pixels to the given width and height.
+
+		"out", if given, is an array of shape (height, width) (plus the
+		colour dimension, for 3D arrays) to store the result in.
+
+		Returns the converted array. If no conversion is needed and "out"
+		is None, that's "pixels" itself.
+		"""
+		source_height, source_width = pixels.shape[:2]
+
+		rows = _scale(source_height, height, MAX_PROGRESSIVE_LINES)
+		columns = _scale(source_width, width, MAX_LOWRES_WIDTH)
+
+		if rows == _REDUCE:
+			pixels = self.reduce(pixels[0:source_height - 1:2], pixels[1::2])
+		if columns == _REDUCE:
+			pixels = self.reduce(pixels[:, 0::2], pixels[:, 1::2])
+
+		row_step = 2 if rows == _DOUBLE else 1
+		column_step = 2 if columns == _DOUBLE else 1
+
+		if out is None:
+			if rows == columns == _SAME and pixels.shape[:2] == (height,
+					width):
+				return pixels
+			out = numpy.empty( (height, width) + pixels.shape[2:],
+					dtype=pixels.dtype )
+
+		used_rows = min(pixels.shape[0] * row_step, height)
+		used_columns = min(pixels.shape[1] * column_step, width)
+
+		for row in xrange(row_step):
+			for column in xrange(column_step):
+				dest = out[row:used_rows:row_step,
+						column:used_columns:column_step]
+				dest[...] = pixels[:dest.shape[0], :dest.shape[1]]
+
+		out[used_rows:] = 0
+		out[:, used_columns:] = 0
+
+		return out
+
+	def normalize(self, pixels, out=None):
+		"""
+		Convert an array of pixels to its canonical_size() for our policy.
+
+		"out" is as for resize(). Returns the converted array, which may be
+		"pixels" itself if it's already the right size.
+		"""
+		height, width = pixels.shape[:2]
+
+		return self.resize(pixels,
+				*canonical_size(width, height, self.policy), out=out)
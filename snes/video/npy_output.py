@@ -0,0 +1,136 @@
+"""
+NumPy .npy output for SNES video.
+
+Writes a sequence of frames into a single .npy file holding a uint16 array of
+shape (count, height, width), which numpy.load(..., mmap_mode='r') can open
+without reading the whole thing into memory.
+
+Every frame in the file has to be the same size, but the SNES switches
+between 256 and 512 pixel wide modes (and between progressive and interlaced
+modes) as it likes. Frames are converted to the file's size by
+snes.video.normalize, with the chosen policy deciding how frames twice the
+size of the file are reduced.
+
+A frame that's the same as the one before it is copied from the previous
+slot in the file, rather than being converted again.
+"""
+import numpy
+from snes.util import snes_framebuffer_to_array
+from snes.video import normalize
+from snes.video.frame import ChangeDetector
+
+POLICY_AVERAGE = normalize.POLICY_AVERAGE
+POLICY_DROP = normalize.POLICY_DROP
+
+DEFAULT_WIDTH = 256
+DEFAULT_HEIGHT = 224
+
+
+class FrameStack(object):
+	"""
+	Captures SNES video frames into a .npy file.
+
+	The following attributes are available:
+
+		"frames" is the numpy.memmap of frames, of shape (count, height,
+		width).
+
+		"captured" is the number of frames captured so far. Once the file
+		is full, further frames are ignored.
+	"""
+
+	def __init__(self, path, count, width=DEFAULT_WIDTH,
+			height=DEFAULT_HEIGHT, policy=POLICY_AVERAGE):
+		"""
+		Create a .npy file with room for "count" frames.
+
+		"width" and "height" give the size of each frame in the file.
+
+		"policy" is POLICY_AVERAGE or POLICY_DROP, and decides how frames
+		that are twice the size of the file are reduced.
+		"""
+		if policy not in (POLICY_AVERAGE, POLICY_DROP):
+			raise ValueError("Unknown policy %r" % (policy,))
+
+		self.policy = policy
+		self.captured = 0
+		self.frames = numpy.lib.format.open_memmap(path, mode="w+",
+				dtype=numpy.uint16, shape=(count, height, width))
+
+		self._normalizer = normalize.Normalizer(policy)
+		self._detector = ChangeDetector()
+
+	@property
+	def full(self):
+		return self.captured >= len(self.frames)
+
+	def video_refresh(self, data, width, height, hires, interlace, overscan,
+			pitch):
+		"""
+		Capture a frame of libsnes video data.
+
+		This is suitable for passing to core.EmulatedSNES.set_video_refresh_cb.
+		"""
+		if self.full:
+			return
+
+		slot = self.frames[self.captured]
+
+		if self._detector.unchanged(data, width, height, pitch):
+			if self.captured == 0:
+				return
+			slot[...] = self.frames[self.captured - 1]
+			self.captured += 1
+			return
+
+		pixels = snes_framebuffer_to_array(data, width, height, pitch)
+
+		self._normalizer.resize(pixels, slot.shape[1], slot.shape[0], out=slot)
+
+		self.captured += 1
+
+	def close(self):
+		"""
+		Make sure every captured frame has been written to disk.
+		"""
+		self.frames.flush()
+
+
+def set_video_refresh_cb(core, path, count, width=DEFAULT_WIDTH,
+		height=DEFAULT_HEIGHT, policy=POLICY_AVERAGE):
+	"""
+	Captures SNES video frames into the given .npy file.
+
+	"count", "width", "height" and "policy" are passed to FrameStack.
+
+	Returns the FrameStack instance used to capture the frames.
+	"""
+	res = FrameStack(path, count, width, height, policy)
+
+	core.set_video_refresh_cb(res.video_refresh)
+
+	return res
+
+
+def capture_frames(core, count, path, width=DEFAULT_WIDTH,
+		height=DEFAULT_HEIGHT, policy=POLICY_AVERAGE):
+	"""
+	Run the emulated SNES for "count" frames, capturing them into a .npy file.
+
+	"core" should be an instance of snes.core.EmulatedSNES, with a cartridge
+	loaded.
+
+	"path", "width", "height" and "policy" are as for FrameStack.
+
+	Returns the numpy.memmap of captured frames.
+	"""
+	stack = set_video_refresh_cb(core, path, count, width, height, policy)
+
+	try:
+		while not stack.full:
+			core.run()
+	finally:
+		core.set_video_refresh_cb(lambda *args: None)
+		stack.close()
+
+	return stack.frames
@@ -4,28 +4,167 @@ Python Imaging Library (PIL) output for SNES Video.
 
 from tempfile import mkdtemp
 import os.path
+import math
+import numpy
 from PIL import Image
-from snes.util import snes_framebuffer_to_RGB888
+from snes.util import snes_framebuffer_to_RGB888, snes_framebuffer_to_array, \
+		snes_array_to_RGB888
+from snes.video import normalize
+from snes.video.frame import ChangeDetector
 
-def _snes_to_image(data, width, height, hires, interlace, overscan, pitch):
+def _snes_to_image(data, width, height, hires, interlace, overscan, pitch,
+		normalizer=None):
+	if normalizer is None:
+		return Image.fromstring("RGB", (width, height),
+				snes_framebuffer_to_RGB888(data, width, height, pitch))
+
+	pixels = normalizer.normalize(
+			snes_framebuffer_to_array(data, width, height, pitch))
+	height, width = pixels.shape
 	return Image.fromstring("RGB", (width, height),
-			snes_framebuffer_to_RGB888(data, width, height, pitch))
+			snes_array_to_RGB888(pixels).tostring())
 
-def set_video_refresh_cb(core, callback):
+def set_video_refresh_cb(core, callback, policy=None):
 	"""
 	Sets the callback that will handle updated video frames.
 
 	Unlike core.EmulatedSNES.set_video_refresh_cb, the callback passed to this
 	function should accept only one parameter:
-		
+
 		"image" is an instance of PIL.Image containing the frame data.
+
+	"policy", if given, is one of the policies in snes.video.normalize, and
+	every frame is converted to the canonical size for that policy before
+	it's made into an image. By default, images are the size libsnes
+	produced them.
+
+	If a frame is the same as the previous one, it isn't converted again; the
+	callback is given the previous image.
 	"""
-	def wrapper(*args):
-		callback(_snes_to_image(*args))
+	if policy is None:
+		normalizer = None
+	else:
+		normalizer = normalize.Normalizer(policy)
+
+	detector = ChangeDetector()
+	previous = [None]
+
+	def wrapper(data, width, height, hires, interlace, overscan, pitch):
+		if detector.unchanged(data, width, height, pitch):
+			if previous[0] is None:
+				return
+		else:
+			previous[0] = _snes_to_image(data, width, height, hires,
+					interlace, overscan, pitch, normalizer)
+
+		callback(previous[0])
 
 	core.set_video_refresh_cb(wrapper)
 
-def image_difference(imageA, imageB):
+
+class ImageDifference(object):
+	"""
+	Describes the pixel differences between two images of the same size.
+
+	The following attributes are available:
+
+		"count" is the number of pixels that differ in any channel.
+
+		"bbox" is a (left, upper, right, lower) tuple bounding all the
+		differing pixels, in the same style as PIL.Image.getbbox().
+
+		"max_delta" is the largest difference between the values of any
+		channel of any pair of corresponding pixels.
+
+		"psnr" is the peak signal-to-noise ratio between the two images, in
+		decibels.
+
+		"mask" is a 1-bit Image marking the differing pixels. It's only
+		generated when first requested, since it's relatively expensive.
+	"""
+
+	def __init__(self, arrayA, arrayB):
+		delta = numpy.absolute(
+				arrayA.astype(numpy.int16) - arrayB.astype(numpy.int16))
+
+		if delta.ndim == 3:
+			# Each pixel differs by as much as its most-different channel.
+			self._pixel_delta = delta.max(axis=2)
+		else:
+			self._pixel_delta = delta
+
+		self._mask = None
+
+		changed = self._pixel_delta > 0
+		self.count = int(numpy.count_nonzero(changed))
+		self.max_delta = int(self._pixel_delta.max())
+
+		if self.count:
+			rows = numpy.flatnonzero(changed.any(axis=1))
+			cols = numpy.flatnonzero(changed.any(axis=0))
+			self.bbox = (
+					int(cols[0]), int(rows[0]),
+					int(cols[-1]) + 1, int(rows[-1]) + 1,
+				)
+		else:
+			self.bbox = None
+
+		mse = numpy.mean(delta.astype(numpy.float64) ** 2)
+		if mse == 0:
+			self.psnr = float("inf")
+		else:
+			self.psnr = 10 * math.log10(255.0 ** 2 / mse)
+
+	@property
+	def mask(self):
+		if self._mask is None:
+			height, width = self._pixel_delta.shape
+			self._mask = Image.new("1", (width, height))
+			self._mask.putdata(
+					(self._pixel_delta > 0).astype(numpy.uint8).ravel().tolist()
+				)
+
+		return self._mask
+
+	def is_within(self, max_delta=0, max_pixels=0, min_psnr=None):
+		"""
+		Returns True if these differences are small enough to ignore.
+
+		"max_delta" is the largest channel difference that should be
+		considered equal; pixels that differ by no more than this in every
+		channel are ignored.
+
+		"max_pixels" is the number of pixels allowed to differ by more than
+		"max_delta".
+
+		"min_psnr" is the lowest acceptable peak signal-to-noise ratio, in
+		decibels. If None, the PSNR is not checked.
+		"""
+		if min_psnr is not None and self.psnr < min_psnr:
+			return False
+
+		if max_delta <= 0:
+			count = self.count
+		else:
+			count = int(numpy.count_nonzero(self._pixel_delta > max_delta))
+
+		return count <= max_pixels
+
+	def __repr__(self):
+		return "<ImageDifference: %d pixels in %r, max delta %d, %0.1fdB>" % (
+				self.count, self.bbox, self.max_delta, self.psnr,
+			)
+
+
+def _matching_size(size, other):
+	"""
+	Return "other" if it's exactly twice "size", or "size" if it isn't.
+	"""
+	if other == 2 * size:
+		return other
+	return size
+
+def compare_images(imageA, imageB):
 	"""
 	Determine the differences (if any) between two images.
 
@@ -34,15 +173,14 @@ def image_difference(imageA, imageB):
 	If the images are identical, returns None.
 
 	If the images differ in mode or size, returns a string describing the
-	differences. Note: if one image is exactly twice the width of the other,
-	the smaller image is resized to the width of the larger before comparing
-	dimensions. This is because some libsnes implementations render non-hires
-	frames at 256px wide, and some render them at 512px wide.
+	differences. Note: if one image is exactly twice the width or height of
+	the other, the smaller image is resized to match the larger before
+	comparing dimensions. This is because some libsnes implementations render
+	non-hires frames at 256px wide, and some render them at 512px wide, and
+	because interlaced frames have twice as many lines as progressive ones.
 
-	If the images differ in pixel data, returns a 1-bit Image with the same
-	dimensions as the input images. Where the two source images have different
-	pixel values, those pixels are set to "1" in the resulting image while all
-	the equal pixels are set to "0".
+	If the images differ in pixel data, returns an ImageDifference instance
+	describing the differences.
 	"""
 	# If the images are in different modes (colour-spaces) then they're
 	# different.
@@ -53,56 +191,71 @@ def image_difference(imageA, imageB):
 
 	# bsnes' accuracy core outputs 512px-per-line at all times (as does the
 	# real SNES, technically) while most cores output 256px-per-line normally
-	# and 512px-per-line in hi-res mode. This difference is not necessarily
-	# a useful difference, so if one image is exactly twice as wide as the
-	# other, we'll resize the smaller to the width of the larger.
-	widthA, heightA = imageA.size
-	widthB, heightB = imageB.size
+	# and 512px-per-line in hi-res mode. Likewise, an interlaced frame has
+	# twice the lines of a progressive one. These are not necessarily useful
+	# differences, so if one image is exactly twice as wide (or tall) as the
+	# other, we'll double the pixels (or lines) of the smaller one.
+	arrayA = numpy.asarray(imageA)
+	arrayB = numpy.asarray(imageB)
 
-	if widthA == 2 * widthB:
-		imageB = imageB.resize( (widthA, heightB ) )
-	elif widthB == 2 * widthA:
-		imageA = imageA.resize( (widthB, heightA ) )
+	heightA, widthA = arrayA.shape[:2]
+	heightB, widthB = arrayB.shape[:2]
+
+	normalizer = normalize.Normalizer(normalize.POLICY_DOUBLE)
+	arrayA = normalizer.resize(arrayA, _matching_size(widthA, widthB),
+			_matching_size(heightA, heightB))
+	arrayB = normalizer.resize(arrayB, _matching_size(widthB, widthA),
+			_matching_size(heightB, heightA))
 
 	# If images have different dimensions (modulo the resizing above), then
 	# they're different.
-	if imageA.size != imageB.size:
+	if arrayA.shape != arrayB.shape:
 		return "Images have different sizes (%dx%d vs. %dx%d)" % (
-				imageA.size[0], imageA.size[1],
-				imageB.size[0], imageB.size[1],
+				arrayA.shape[1], arrayA.shape[0],
+				arrayB.shape[1], arrayB.shape[0],
 			)
 
-	# Before we start pixel-poking, let's let Python figure out whether there's
-	# any image differences.
-	imageAstr = imageA.tostring()
-	imageBstr = imageB.tostring()
-
-	if imageAstr == imageBstr:
+	if numpy.array_equal(arrayA, arrayB):
 		return None
 
 	# We know these images are different, we just have to figure out where.
-	diffMap = Image.new("1", imageA.size)
+	return ImageDifference(arrayA, arrayB)
+
+def image_difference(imageA, imageB):
+	"""
+	Determine the differences (if any) between two images.
+
+	"imageA" and "imageB" should be PIL Image objects.
+
+	If the images are identical, returns None.
+
+	If the images differ in mode or size, returns a string describing the
+	differences, just like compare_images().
 
-	pixelsA = imageA.load()
-	pixelsB = imageB.load()
-	pixelsDiff = diffMap.load()
-	width, height = imageA.size
+	If the images differ in pixel data, returns a 1-bit Image with the same
+	dimensions as the input images. Where the two source images have different
+	pixel values, those pixels are set to "1" in the resulting image while all
+	the equal pixels are set to "0".
+	"""
+	difference = compare_images(imageA, imageB)
 
-	for y in xrange(height):
-		for x in xrange(width):
-			if pixelsA[x,y] != pixelsB[x,y]:
-				pixelsDiff[x,y] = 1
-			else:
-				pixelsDiff[x,y] = 0
+	if isinstance(difference, ImageDifference):
+		return difference.mask
 
-	return diffMap
+	return difference
 
-def describe_difference(imageA, imageB):
+def describe_difference(imageA, imageB, max_delta=0, max_pixels=0,
+		min_psnr=None):
 	"""
 	Describe the differences (if any) between two images.
 
 	"imageA" and "imageB" should be PIL Image objects.
 
+	"max_delta", "max_pixels" and "min_psnr" describe how different the pixel
+	data of the two images may be while still being considered identical. See
+	ImageDifference.is_within() for details. By default, any difference at all
+	is reported.
+
 	If the images are identical, returns None.
 
 	If the images differ in any way, returns a string describing the
@@ -112,13 +265,18 @@ def describe_difference(imageA, imageB):
 	saves imageA, imageB and the difference map to a newly created directory,
 	and returns a string that describes their filenames.
 	"""
-	difference = image_difference(imageA, imageB)
+	difference = compare_images(imageA, imageB)
 
 	if difference is None:
 		# No differences.
 		return
 
-	if isinstance(difference, Image.Image):
+	if isinstance(difference, ImageDifference):
+		if difference.is_within(max_delta, max_pixels, min_psnr):
+			# The differences are too small to care about, so don't bother
+			# generating the difference map.
+			return
+
 		# Save the comparators and result so that we can examine them at
 		# our leisure.
 		outputdir = mkdtemp()
@@ -128,14 +286,17 @@ def describe_difference(imageA, imageB):
 
 		imageA.save(actual_name)
 		imageB.save(expected_name)
-		difference.save(difference_name)
+		difference.mask.save(difference_name)
 
 		# Replace the difference image with a message that test runners can
 		# display.
 		difference = (
 				"Image differences found. Actual: %s Expected: %s "
-				"Difference: %s" % (
+				"Difference: %s (%d pixels differ within %r, max channel "
+				"delta %d, PSNR %0.1fdB)" % (
 					actual_name, expected_name, difference_name,
+					difference.count, difference.bbox, difference.max_delta,
+					difference.psnr,
 				)
 			)
 
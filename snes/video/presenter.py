@@ -0,0 +1,207 @@
+"""
+Presents SNES video frames on a background thread.
+
+Normally a video output converts, draws and displays each frame inside the
+video refresh callback, so the emulator can't start on the next frame until
+all that is done. ThreadedPresenter splits the work in two:
+
+	- The video refresh callback just copies the visible pixels out of
+	  libsnes' framebuffer into a spare buffer, and returns straight away.
+
+	- A background thread hands each copied frame to the real video output,
+	  which converts and displays it while the emulator runs the next frame.
+	  This works because ctypes releases the GIL while libsnes is running.
+
+There are two buffers: one being presented, and one holding the next frame.
+If the emulator produces a frame while both are in use (because presenting
+is slower than emulating), the waiting frame is replaced by the newer one,
+so the display never falls behind.
+
+ThreadedPresenter stands in for the core, so any of the video outputs'
+set_video_refresh_cb() functions can be pointed at it:
+
+	presenter = ThreadedPresenter(core)
+	pygame_output.set_video_refresh_cb(presenter, paint_frame)
+
+Bear in mind that the output's callback (paint_frame, here) then runs on the
+background thread. pygame (like SDL, underneath it) expects the display to be
+set up, drawn on and have its events pumped all on one thread, so the
+callback should just keep the converted surface, and leave the main thread
+to draw it. Calling wait() first makes sure the main thread draws the frame
+it has just run; that frame is converted while the main thread sleeps until
+the next frame is due (see snes.pacing).
+"""
+import ctypes
+import sys
+import threading
+import numpy
+from snes.util import snes_framebuffer_to_array
+
+# The number of frame buffers: one being presented, and one waiting.
+_BUFFER_COUNT = 2
+
+
+class ThreadedPresenter(object):
+	"""
+	Hands video frames from a core to a video output on another thread.
+
+	The following attributes are available:
+
+		"frames_presented" is the number of frames handed to the output.
+
+		"frames_dropped" is the number of frames replaced by a newer frame
+		before the output got to them.
+
+	If the output raises an exception, it's re-raised from the next video
+	refresh callback, or from wait() or close().
+	"""
+
+	def __init__(self, core):
+		"""
+		Take over the video refresh callback of the given core.
+
+		"core" should be an instance of snes.core.EmulatedSNES, or anything
+		else with a compatible set_video_refresh_cb() method, such as a tap
+		from snes.video.bus.FrameBus.
+		"""
+		self.core = core
+		self.frames_presented = 0
+		self.frames_dropped = 0
+
+		self._callback = None
+		self._condition = threading.Condition()
+		self._spare = []
+		self._pending = None
+		self._busy = False
+		self._closed = False
+		self._error = None
+
+		self._thread = threading.Thread(target=self._run,
+				name="ThreadedPresenter")
+		self._thread.daemon = True
+		self._thread.start()
+
+		core.set_video_refresh_cb(self.video_refresh)
+
+	def set_video_refresh_cb(self, callback):
+		"""
+		Set the callback that presents frames, on the background thread.
+
+		"callback" takes the same parameters as the one passed to
+		core.EmulatedSNES.set_video_refresh_cb(). It's given a copy of each
+		frame's visible pixels, so the pitch is always the frame's width.
+		"""
+		with self._condition:
+			self._callback = callback
+
+	def __getattr__(self, name):
+		return getattr(self.core, name)
+
+	def _check_error(self):
+		if self._error is not None:
+			error, self._error = self._error, None
+			raise error[0], error[1], error[2]
+
+	def _get_buffer(self, width, height):
+		"""
+		Return a buffer to copy a frame of the given size into.
+
+		Must be called with the condition held.
+		"""
+		if self._pending is not None:
+			# Presenting is running behind; replace the waiting frame.
+			self.frames_dropped += 1
+			buffer = self._pending[0]
+			self._pending = None
+		elif self._spare:
+			buffer = self._spare.pop()
+		else:
+			buffer = None
+
+		if buffer is None or buffer.shape != (height, width):
+			buffer = numpy.empty( (height, width), dtype=numpy.uint16 )
+
+		return buffer
+
+	def video_refresh(self, data, width, height, hires, interlace, overscan,
+			pitch):
+		"""
+		Copy a frame of libsnes video data, for presenting on the background
+		thread.
+
+		This is suitable for passing to core.EmulatedSNES.set_video_refresh_cb.
+		"""
+		self._check_error()
+
+		with self._condition:
+			if self._closed:
+				return
+
+			if data is None and self._pending is not None:
+				# A repeat of the frame that's already waiting, which will
+				# be presented anyway.
+				return
+
+			buffer = self._get_buffer(width, height)
+			if data is not None:
+				buffer[...] = snes_framebuffer_to_array(data, width, height,
+						pitch)
+
+			self._pending = (buffer, data is None,
+					(width, height, hires, interlace, overscan, width))
+			self._condition.notify_all()
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while self._pending is None and not self._closed:
+					self._condition.wait()
+
+				if self._pending is None:
+					break
+
+				buffer, repeated, args = self._pending
+				self._pending = None
+				self._busy = True
+				callback = self._callback
+
+			try:
+				if callback is not None and self._error is None:
+					if repeated:
+						data = None
+					else:
+						data = buffer.ctypes.data_as(
+								ctypes.POINTER(ctypes.c_uint16))
+					callback(data, *args)
+			except Exception:
+				self._error = sys.exc_info()
+
+			with self._condition:
+				self._busy = False
+				self.frames_presented += 1
+				if len(self._spare) < _BUFFER_COUNT - 1:
+					self._spare.append(buffer)
+				self._condition.notify_all()
+
+	def wait(self):
+		"""
+		Wait until every frame so far has been presented.
+		"""
+		with self._condition:
+			while self._pending is not None or self._busy:
+				self._condition.wait()
+
+		self._check_error()
+
+	def close(self):
+		"""
+		Present any waiting frame, then stop the background thread.
+		"""
+		with self._condition:
+			if self._closed:
+				return
+			self._closed = True
+			self._condition.notify_all()
+
+		self._thread.join()
+		self._check_error()
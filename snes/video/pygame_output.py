@@ -2,11 +2,108 @@
 Pygame output for SNES Video.
 """
 import pygame, ctypes
+import numpy
+from snes.util import snes_framebuffer_to_array
+from snes.video import color
+from snes.video import normalize
+from snes.video.frame import ChangeDetector
+from snes.video import dirty as dirty_module
+from snes.video.dirty import DirtyTracker
 
 OUTPUT_WIDTH=256
 OUTPUT_HEIGHT=239
 
-def set_video_refresh_cb(core, callback):
+SNES_MASKS = (0x7c00, 0x03e0, 0x001f, 0)
+
+# The masks of the 32-bit surfaces used for colour-corrected frames.
+RGB_MASKS = (0xff0000, 0x00ff00, 0x0000ff, 0)
+
+
+class _ModeSurfaces(object):
+	"""
+	The surfaces needed to display frames in one particular video mode.
+
+	These are allocated once, the first time we see a frame in this mode, and
+	reused for every following frame in the same mode.
+	"""
+
+	def __init__(self, width, height, pitch, normalizer, table=None):
+		self.width = width
+		self.pitch = pitch
+		self.normalizer = normalizer
+		self.table = table
+		self.size = normalize.canonical_size(width, height, normalizer.policy)
+
+		# Where normalized frames are put before colour correction.
+		self.scratch = None
+
+		if table is not None:
+			# Frames are normalized, then converted straight from XBGR1555
+			# into this surface with the colour lookup table.
+			self.raw = None
+			self.visible = pygame.Surface(self.size, depth=32,
+					masks=RGB_MASKS)
+			if self.size != (width, height):
+				self.scratch = numpy.empty( (self.size[1], self.size[0]),
+						dtype=numpy.uint16 )
+		elif self.size == (width, height):
+			# A surface laid out exactly like libsnes' framebuffer, so the
+			# whole frame can be copied in with a single memmove().
+			self.raw = pygame.Surface((pitch, height), depth=15,
+					masks=SNES_MASKS)
+			self.visible = self.raw.subsurface((0,0,width,height))
+			self.pitch_bytes = pitch * 2
+		else:
+			# Frames are normalized straight from libsnes' framebuffer into
+			# this surface.
+			self.raw = None
+			self.visible = pygame.Surface(self.size, depth=15,
+					masks=SNES_MASKS)
+
+	def fill(self, data, height):
+		"""
+		Copy the given libsnes framebuffer into our surfaces.
+		"""
+		if self.raw is None:
+			pixels = snes_framebuffer_to_array(data, self.width, height,
+					self.pitch)
+			target = _surface_pixels(self.visible)
+
+			if self.table is None:
+				self.normalizer.normalize(pixels, out=target)
+			else:
+				if self.scratch is not None:
+					pixels = self.normalizer.normalize(pixels,
+							out=self.scratch)
+				color.convert(pixels, self.table, out=target)
+
+			# Release the surface's lock.
+			del target
+
+			return self.visible
+
+		self.raw.lock()
+		try:
+			address = self.raw._pixels_address
+			surface_pitch = self.raw.get_pitch()
+
+			# "data" may be a ctypes pointer or a plain address.
+			source = ctypes.cast(data, ctypes.c_void_p).value
+
+			if surface_pitch == self.pitch_bytes:
+				ctypes.memmove(address, source, self.pitch_bytes * height)
+			else:
+				for y in xrange(height):
+					ctypes.memmove(address + y * surface_pitch,
+							source + y * self.pitch_bytes, self.pitch_bytes)
+		finally:
+			self.raw.unlock()
+
+		return self.visible
+
+
+def set_video_refresh_cb(core, callback, dirty_rects=False, scaler=None,
+		scale=1, policy=normalize.POLICY_AVERAGE, profile=None):
 	"""
 	Sets the callback that will handle updated video frames.
 
@@ -14,40 +111,130 @@ def set_video_refresh_cb(core, callback):
 	function should accept only one parameter:
 
 		"surf" is an instance of pygame.Surface containing the frame data.
+
+	If "dirty_rects" is True, the callback should accept a second parameter:
+
+		"rects" is a list of pygame.Rect objects covering the parts of "surf"
+		that have changed since the previous frame (empty if nothing has).
+		Pass them to pygame.display.update() to redraw only those parts of
+		the screen.
+
+	Frames of every video mode are converted to a common size by
+	snes.video.normalize, according to "policy". By default, hi-res and
+	interlaced frames are averaged down to 256x224 (or 256x239).
+
+	If "scaler" is a snes.video.scalers.Scaler, each frame is then scaled up
+	by "scale" (a whole number) with it.
+
+	If "profile" is a snes.video.color.ColorProfile, frames are converted to
+	32-bit surfaces with its colour correction, in the same pass that
+	normalizes them. Otherwise, frames are given to the callback as 15-bit
+	surfaces, and pygame converts the colours when they're drawn.
+
+	The same surface is reused for every frame in the same video mode, so if
+	you want to keep the frame data after the callback returns, you should
+	copy it. If a frame is the same as the previous one, the surface isn't
+	updated at all; the callback is just given it again.
 	"""
+	surfaces = {}
+	scaled_surfaces = {}
+	previous = [None]
+	normalizer = normalize.Normalizer(policy)
+
+	if profile is None:
+		table = None
+	else:
+		table = color.packed_table(profile, RGB_MASKS[:3])
+
+	if scaler is None:
+		scale = 1
+
+	if dirty_rects:
+		tracker = DirtyTracker()
+		report = callback
+	else:
+		detector = ChangeDetector()
+		report = lambda surf, rects: callback(surf)
 
 	def wrapper(data, width, height, hires, interlace, overscan, pitch):
-		convsurf = pygame.Surface(
-			(pitch, height), depth=15, masks=(0x7c00, 0x03e0, 0x001f, 0)
-		)
-		surf = convsurf.subsurface((0,0,width,height))
-
-		# this try-except block works around a bug in pygame 1.9.1 on 64-bit hosts.
-		# http://archives.seul.org/pygame/users/Apr-2011/msg00069.html
-		# https://bitbucket.org/pygame/pygame/issue/109/bufferproxy-indexerror-exception-thrown
-		try:
-			convsurf.get_buffer().write(ctypes.string_at(data,pitch*height*2), 0)
-		except IndexError:
+		if dirty_rects:
+			dirty = tracker.update(data, width, height, pitch)
+			unchanged = not dirty.any()
+		else:
+			unchanged = detector.unchanged(data, width, height, pitch)
+
+		if unchanged:
+			if previous[0] is not None:
+				report(previous[0], [])
 			return
 
-		tryScale = False
+		mode = (width, height, pitch)
+
+		mode_surfaces = surfaces.get(mode)
+		if mode_surfaces is None:
+			mode_surfaces = _ModeSurfaces(width, height, pitch, normalizer,
+					table)
+			surfaces[mode] = mode_surfaces
+
+		surf = mode_surfaces.fill(data, height)
+
+		if scaler is not None:
+			size = (surf.get_width() * scale, surf.get_height() * scale)
+			key = (size, surf.get_bitsize())
+			scaled = scaled_surfaces.get(key)
+			if scaled is None:
+				scaled = pygame.Surface(size, 0, surf)
+				scaled_surfaces[key] = scaled
+
+			scale_surface(surf, scaler, scaled)
+			surf = scaled
 
-		if hires:
-			width /= 2
-			tryScale = True
+		previous[0] = surf
 
-		if interlace:
-			height /= 2
-			tryScale = True
+		if dirty_rects:
+			rects = [
+					pygame.Rect(rect)
+					for rect in dirty_module.dirty_rects(dirty, width, height,
+						float(mode_surfaces.size[0]) / width * scale,
+						float(mode_surfaces.size[1]) / height * scale)
+				]
 
-		if tryScale:
-			try:
-				surf = pygame.transform.smoothscale(surf.convert(),
-						(width,height))
-			except:
-				surf = pygame.transform.scale(surf,
-						(width,height))
+			if scaler is not None:
+				# Filters look at neighbouring pixels, so a changed pixel can
+				# change the scaled pixels around it too.
+				bounds = surf.get_rect()
+				rects = [
+						rect.inflate(2 * scale, 2 * scale).clip(bounds)
+						for rect in rects
+					]
+		else:
+			rects = None
 
-		callback(surf)
+		report(previous[0], rects)
 
 	core.set_video_refresh_cb(wrapper)
+
+
+def _surface_pixels(surf):
+	"""
+	Return a numpy array of shape (height, width) referencing the pixels of
+	a 15-, 16- or 32-bit surface.
+	"""
+	return numpy.array(surf.get_view('2'), copy=False).T
+
+
+def scale_surface(surf, scaler, dest):
+	"""
+	Scale a surface into another with a snes.video.scalers.Scaler.
+
+	"surf" is a surface such as the ones given to the callback passed to
+	set_video_refresh_cb(), and "dest" is a surface of the same pixel format
+	(but any size) to hold the result.
+	"""
+	source = _surface_pixels(surf)
+	target = _surface_pixels(dest)
+
+	scaler.scale(source, dest.get_width(), dest.get_height(), out=target)
+
+	# Release the surfaces' locks.
+	del source, target
@@ -0,0 +1,515 @@
+"""
+Records SNES video to disk without slowing down emulation.
+
+Each frame is copied out of libsnes' framebuffer as-is, and put on a bounded
+queue. A separate worker process takes frames from the queue, converts them
+and writes them out, so the (comparatively slow) encoding happens on another
+CPU core.
+
+If frames arrive faster than they can be encoded, the queue fills up. What
+happens then depends on the recorder's policy: POLICY_BLOCK makes emulation
+wait for the encoder to catch up, so no frames are lost, while POLICY_DROP
+throws away new frames until there's room for them again.
+
+Frames can be written as:
+
+	FORMAT_PNG: a directory full of numbered .png files.
+
+	FORMAT_Y4M: a single YUV4MPEG2 stream, which most video tools can read.
+	Every frame in the stream must be the same size, so frames with different
+	dimensions from the first one are converted to match by
+	snes.video.normalize.
+
+	FORMAT_FRAMES: a single file of compressed raw frames, exactly as libsnes
+	produced them; use read_frames() to read them back.
+
+	FORMAT_ARCHIVE: a snes.video.archive file, which is much smaller than
+	FORMAT_FRAMES for long recordings; use archive.ArchiveReader to read it
+	back.
+
+Frames that are the same as the one before aren't copied or sent to the
+worker at all; the worker is just told to write the previous frame again,
+and the encoders reuse whatever they produced for it last time.
+"""
+import multiprocessing
+import Queue
+import os
+import os.path
+import shutil
+import struct
+import time
+import traceback
+import numpy
+from snes import exceptions as EX
+from snes import golden
+from snes.util import snes_framebuffer_to_array, snes_array_to_RGB888
+from snes.video import normalize
+from snes.video.frame import Frame, ChangeDetector
+from snes.video.archive import ArchiveWriter
+
+FORMAT_PNG = "png"
+FORMAT_Y4M = "y4m"
+FORMAT_FRAMES = "frames"
+FORMAT_ARCHIVE = "archive"
+
+POLICY_BLOCK = "block"
+POLICY_DROP = "drop"
+
+# The number of frames that may be waiting to be encoded; a little over a
+# second's worth.
+DEFAULT_QUEUE_FRAMES = 64
+
+# The SNES' NTSC frame rate, as a fraction.
+DEFAULT_FRAME_RATE = (60099, 1000)
+
+FRAMES_MAGIC = "SNVR"
+FRAMES_VERSION = 1
+frames_header = struct.Struct('<4sB')
+frames_record = struct.Struct('<I')
+
+# How long to wait for room in the queue before checking whether the worker
+# is still alive.
+_POLL_INTERVAL = 1.0
+
+# Put on the frame queue in place of a frame that's the same as the one
+# before it.
+_REPEAT = "repeat"
+
+
+class RecorderError(EX.SNESException):
+	"""
+	The video recorder's worker process failed.
+	"""
+
+
+class CorruptRecording(EX.SNESException):
+	"""
+	A recording is not in the expected format.
+	"""
+
+
+class PNGSequenceEncoder(object):
+	"""
+	Writes each frame to a numbered .png file in a directory.
+	"""
+
+	def __init__(self, path, frame_rate=DEFAULT_FRAME_RATE):
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+		self.path = path
+		self._count = 0
+		self._last_filename = None
+
+	def write(self, frame):
+		filename = os.path.join(self.path, "%06d.png" % (self._count,))
+
+		if frame.unchanged and self._last_filename is not None:
+			shutil.copyfile(self._last_filename, filename)
+		else:
+			frame.image.save(filename)
+
+		self._last_filename = filename
+		self._count += 1
+
+	def close(self):
+		pass
+
+
+def _rgb_to_yuv(rgb):
+	"""
+	Convert an RGB888 array to limited-range BT.601 Y, Cb and Cr planes.
+	"""
+	r, g, b = (rgb[..., channel] / 255.0 for channel in xrange(3))
+
+	y = 16 + 65.481 * r + 128.553 * g + 24.966 * b
+	cb = 128 - 37.797 * r - 74.203 * g + 112.0 * b
+	cr = 128 + 112.0 * r - 93.786 * g - 18.214 * b
+
+	return [numpy.rint(plane).astype(numpy.uint8) for plane in (y, cb, cr)]
+
+
+class Y4MEncoder(object):
+	"""
+	Writes frames to a YUV4MPEG2 stream, without chroma subsampling.
+	"""
+
+	def __init__(self, path, frame_rate=DEFAULT_FRAME_RATE):
+		self._handle = open(path, "wb")
+		self._frame_rate = frame_rate
+		self._size = None
+		self._last_planes = None
+		self._normalizer = normalize.Normalizer()
+
+	def write(self, frame):
+		if frame.unchanged and self._last_planes is not None:
+			self._handle.write(self._last_planes)
+			return
+
+		if self._size is None:
+			self._size = (frame.width, frame.height)
+			self._handle.write("YUV4MPEG2 W%d H%d F%d:%d Ip A1:1 C444\n"
+					% (self._size + self._frame_rate))
+
+		rgb = snes_array_to_RGB888(
+				self._normalizer.resize(frame.pixels, *self._size))
+
+		self._last_planes = "FRAME\n" + "".join(
+				plane.tostring() for plane in _rgb_to_yuv(rgb))
+		self._handle.write(self._last_planes)
+
+	def close(self):
+		self._handle.close()
+
+
+class FramesEncoder(object):
+	"""
+	Writes frames to a file of compressed raw frames.
+
+	The file begins with a header containing a magic number and a version,
+	followed by one record per frame: the length of the frame's data,
+	followed by the frame as encoded by snes.golden.encode_frame().
+	"""
+
+	def __init__(self, path, frame_rate=DEFAULT_FRAME_RATE):
+		self._handle = open(path, "wb")
+		self._handle.write(frames_header.pack(FRAMES_MAGIC, FRAMES_VERSION))
+		self._last_data = None
+
+	def write(self, frame):
+		if frame.unchanged and self._last_data is not None:
+			data = self._last_data
+		else:
+			data = golden.encode_frame(frame)
+			self._last_data = data
+
+		self._handle.write(frames_record.pack(len(data)))
+		self._handle.write(data)
+
+	def close(self):
+		self._handle.close()
+
+
+class ArchiveEncoder(object):
+	"""
+	Writes frames to a snes.video.archive file.
+	"""
+
+	def __init__(self, path, frame_rate=DEFAULT_FRAME_RATE):
+		self._writer = ArchiveWriter(path)
+
+	def write(self, frame):
+		self._writer.add_frame(frame)
+
+	def close(self):
+		self._writer.close()
+
+
+ENCODERS = {
+		FORMAT_PNG: PNGSequenceEncoder,
+		FORMAT_Y4M: Y4MEncoder,
+		FORMAT_FRAMES: FramesEncoder,
+		FORMAT_ARCHIVE: ArchiveEncoder,
+	}
+
+
+def read_frames(path):
+	"""
+	Yield each Frame in a file written with FORMAT_FRAMES.
+
+	An incomplete frame at the end of the file (perhaps because recording
+	was interrupted) is ignored.
+	"""
+	with open(path, "rb") as handle:
+		header = handle.read(frames_header.size)
+		if len(header) != frames_header.size:
+			raise CorruptRecording("File too short")
+
+		magic, version = frames_header.unpack(header)
+		if magic != FRAMES_MAGIC:
+			raise CorruptRecording("Not a video recording")
+		if version != FRAMES_VERSION:
+			raise CorruptRecording("Unsupported version %d" % (version,))
+
+		while True:
+			record = handle.read(frames_record.size)
+			if len(record) != frames_record.size:
+				break
+
+			length, = frames_record.unpack(record)
+			data = handle.read(length)
+			if len(data) != length:
+				break
+
+			yield golden.decode_frame(data)
+
+
+def _run_worker(path, format, frame_rate, frames, errors, encoded, skipped,
+		encode_time):
+	"""
+	Encode frames in the worker process until told to stop.
+
+	"frames" is a queue of (width, height, hires, interlace, overscan, data)
+	tuples, where "data" is the frame's pixels as returned by
+	Frame.tostring(). A frame of _REPEAT means the previous frame should be
+	written again, and a frame of None means recording has finished.
+
+	If anything goes wrong, the traceback is put on the "errors" queue.
+	"encoded" and "encode_time" are shared values recording how many frames
+	have been encoded and how long it took. "skipped" is a shared value
+	counting the repeats that arrived before any frame, which can't be
+	encoded.
+	"""
+	try:
+		encoder = ENCODERS[format](path, frame_rate)
+		frame = None
+		try:
+			while True:
+				item = frames.get()
+				if item is None:
+					break
+
+				start = time.time()
+
+				if item == _REPEAT:
+					if frame is None:
+						skipped.value += 1
+						continue
+					frame = frame.repeat()
+				else:
+					width, height, hires, interlace, overscan, data = item
+					frame = Frame.fromstring(data, width, height)
+					frame.hires = hires
+					frame.interlace = interlace
+					frame.overscan = overscan
+
+				encoder.write(frame)
+
+				encode_time.value += time.time() - start
+				encoded.value += 1
+		finally:
+			encoder.close()
+	except Exception:
+		errors.put(traceback.format_exc())
+
+
+class VideoRecorder(object):
+	"""
+	Records video frames using a worker process.
+
+	The following attributes are available:
+
+		"frames_submitted" is the number of frames given to the recorder.
+
+		"frames_dropped" is the number of frames thrown away because the
+		queue was full (only with POLICY_DROP).
+
+		"max_queue_depth" is the largest number of frames that have been
+		waiting to be encoded at once.
+	"""
+
+	def __init__(self, path, format=FORMAT_FRAMES,
+			queue_frames=DEFAULT_QUEUE_FRAMES, policy=POLICY_BLOCK,
+			frame_rate=DEFAULT_FRAME_RATE):
+		"""
+		Start recording to the given path.
+
+		"format" should be FORMAT_PNG, FORMAT_Y4M, FORMAT_FRAMES or
+		FORMAT_ARCHIVE. For FORMAT_PNG, "path" is a directory, which is
+		created if necessary.
+
+		"queue_frames" is the number of frames that may be waiting to be
+		encoded.
+
+		"policy" is POLICY_BLOCK or POLICY_DROP, and decides what happens to
+		new frames when the queue is full.
+
+		"frame_rate" is a (numerator, denominator) tuple giving the frame rate
+		to record in the file, for formats that have one.
+		"""
+		if format not in ENCODERS:
+			raise ValueError("Unknown video format %r" % (format,))
+		if policy not in (POLICY_BLOCK, POLICY_DROP):
+			raise ValueError("Unknown queue policy %r" % (policy,))
+
+		self.path = path
+		self.format = format
+		self.policy = policy
+
+		self.frames_submitted = 0
+		self.frames_dropped = 0
+		self.max_queue_depth = 0
+
+		self._frames = multiprocessing.Queue(queue_frames)
+		self._errors = multiprocessing.Queue()
+		self._encoded = multiprocessing.Value('L', 0)
+		self._skipped = multiprocessing.Value('L', 0)
+		self._encode_time = multiprocessing.Value('d', 0.0)
+		self._detector = ChangeDetector()
+		self._resend = False
+		self._closed = False
+
+		self._worker = multiprocessing.Process(target=_run_worker,
+				args=(path, format, frame_rate, self._frames, self._errors,
+					self._encoded, self._skipped, self._encode_time))
+		self._worker.daemon = True
+		self._worker.start()
+
+	@property
+	def frames_encoded(self):
+		"""
+		The number of frames the worker has finished encoding.
+		"""
+		return self._encoded.value
+
+	@property
+	def frames_skipped(self):
+		"""
+		The number of repeated frames the worker had no earlier frame for.
+		"""
+		return self._skipped.value
+
+	@property
+	def encode_time(self):
+		"""
+		The total number of seconds the worker has spent encoding frames.
+		"""
+		return self._encode_time.value
+
+	@property
+	def mean_encode_time(self):
+		"""
+		The average number of seconds spent encoding each frame.
+		"""
+		encoded = self._encoded.value
+		if not encoded:
+			return 0.0
+		return self._encode_time.value / encoded
+
+	@property
+	def queue_depth(self):
+		"""
+		The number of frames waiting to be encoded.
+
+		This includes the frame currently being encoded, if any.
+		"""
+		return self.frames_submitted - self.frames_dropped \
+				- self._encoded.value - self._skipped.value
+
+	def _raise_worker_error(self):
+		try:
+			error = self._errors.get(timeout=_POLL_INTERVAL)
+		except Queue.Empty:
+			error = "Worker process died"
+
+		raise RecorderError(error)
+
+	def _put(self, item):
+		"""
+		Put an item on the frame queue, waiting as long as it takes.
+		"""
+		while True:
+			try:
+				self._frames.put(item, timeout=_POLL_INTERVAL)
+				return
+			except Queue.Full:
+				if not self._worker.is_alive():
+					self._raise_worker_error()
+
+	def add_frame(self, frame):
+		"""
+		Record the given Frame.
+		"""
+		if frame.unchanged and not self._resend:
+			self._submit(_REPEAT)
+			return
+
+		self._submit( (frame.width, frame.height, frame.hires,
+			frame.interlace, frame.overscan, frame.tostring()) )
+
+	def video_refresh(self, data, width, height, hires, interlace, overscan,
+			pitch):
+		"""
+		Record a frame of libsnes video data.
+
+		This is suitable for passing to core.EmulatedSNES.set_video_refresh_cb.
+		"""
+		unchanged = self._detector.unchanged(data, width, height, pitch)
+
+		# If the previous frame was dropped, the worker doesn't have it to
+		# repeat, so send this one in full (if we can).
+		if unchanged and (data is None or not self._resend):
+			self._submit(_REPEAT)
+			return
+
+		pixels = snes_framebuffer_to_array(data, width, height, pitch)
+
+		self._submit( (width, height, hires, interlace, overscan,
+			pixels.astype('<u2').tostring()) )
+
+	def _submit(self, item):
+		if self._closed:
+			raise RecorderError("Recorder is closed")
+
+		self.frames_submitted += 1
+
+		if self.policy == POLICY_DROP:
+			try:
+				self._frames.put_nowait(item)
+			except Queue.Full:
+				self.frames_dropped += 1
+				self._resend = True
+				if not self._worker.is_alive():
+					self._raise_worker_error()
+				return
+		else:
+			self._put(item)
+
+		if item != _REPEAT:
+			self._resend = False
+
+		self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+	def close(self):
+		"""
+		Wait for every queued frame to be encoded, and finish the recording.
+
+		Raises RecorderError if the worker process failed.
+		"""
+		if self._closed:
+			return
+		self._closed = True
+
+		if self._worker.is_alive():
+			self._put(None)
+			self._worker.join()
+
+		try:
+			error = self._errors.get_nowait()
+		except Queue.Empty:
+			error = None
+
+		if error is None and self._worker.exitcode != 0:
+			error = "Worker process died"
+
+		if error is not None:
+			raise RecorderError(error)
+
+
+def set_video_sink(core, path, format=FORMAT_FRAMES, **kwargs):
+	"""
+	Records SNES video to the given path.
+
+	"core" should be an instance of snes.core.EmulatedSNES.
+
+	"path" and "format", and any other keyword arguments, are passed to
+	VideoRecorder.
+
+	Returns the VideoRecorder instance used to record the SNES video. Call
+	its close() method when you're done, to finish writing the recording.
+	"""
+	res = VideoRecorder(path, format, **kwargs)
+
+	core.set_video_refresh_cb(res.video_refresh)
+
+	return res
@@ -0,0 +1,386 @@
+"""
+Software scaling for SNES video frames.
+
+snes.video.scaling works out how big a frame should be on screen; this
+module actually scales the pixels, with numpy, so it works just as well for
+headless screenshots as for pygame windows.
+
+Scaling a frame is a gather: each output pixel is copied from some source
+pixel. Scaler works out which source pixel each output pixel comes from
+once for each combination of frame size, output size and mode, and caches
+the result as an index map, so scaling each frame is a single numpy.take().
+
+The following modes are available:
+
+	MODE_NEAREST scales by repeating (or skipping) pixels and lines. Scaling
+	by a whole number gives crisp square pixels; any other scale, such as
+	one that corrects the aspect ratio, gives pixels of slightly uneven
+	sizes.
+
+	MODE_SCALE2X and MODE_SCALE3X are the Scale2x and Scale3x pixel-art
+	filters, which smooth diagonal edges without blurring. They double or
+	triple the frame; any further scaling is done as for MODE_NEAREST.
+
+	MODE_SCANLINES scales as for MODE_NEAREST, then darkens the last output
+	line of each source line, like the gaps between the lines on a CRT.
+
+Scalers work on 2D arrays of pixels (such as the uint16 XBGR1555 arrays
+returned by snes.util.snes_framebuffer_to_array(), or the uint32 arrays
+behind 32-bit pygame surfaces), or 3D arrays with one colour channel per
+element of the last dimension (such as snes.util.snes_array_to_RGB888()'s).
+"""
+import collections
+import numpy
+from snes.video import color
+from snes.video import scaling
+
+MODE_NEAREST = "nearest"
+MODE_SCALE2X = "scale2x"
+MODE_SCALE3X = "scale3x"
+MODE_SCANLINES = "scanlines"
+
+MODES = (MODE_NEAREST, MODE_SCALE2X, MODE_SCALE3X, MODE_SCANLINES)
+
+# How many index maps each Scaler keeps.
+DEFAULT_CACHE_SIZE = 16
+
+# The bits that are left in each channel after shifting a pixel right by one
+# bit, for each kind of pixel we know how to darken.
+_DARKEN_MASKS = {
+		numpy.dtype(numpy.uint8): 0x7F,
+		numpy.dtype(numpy.uint16): 0x3DEF, # XBGR1555
+		numpy.dtype(numpy.uint32): 0x7F7F7F7F,
+	}
+
+
+def output_size(width, height, scale=1, aspect=1.0):
+	"""
+	Return the (width, height) of a frame of the given size, as it would
+	appear on screen.
+
+	Hi-res frames are the same width on screen as low-res ones, and
+	interlaced frames the same height as non-interlaced ones. "scale"
+	multiplies the height of the frame, and "aspect" and "scale" both
+	multiply the width; see scaling.scale_with_aspect().
+	"""
+	if height > scaling.SNES_HEIGHT:
+		height //= 2
+
+	return (int(round(scaling.SNES_WIDTH * aspect * scale)),
+			int(height * scale))
+
+
+def _flatten(pixels):
+	"""
+	Return a view of "pixels" with one row per pixel, and its row stride in
+	pixels.
+
+	Padding at the end of each line (as in libsnes' framebuffer) is included
+	in the view, so that no copy is needed.
+	"""
+	height, width = pixels.shape[:2]
+	pixel_stride = pixels.strides[1]
+
+	if pixel_stride <= 0 or pixels.strides[0] % pixel_stride:
+		pixels = numpy.ascontiguousarray(pixels)
+		pixel_stride = pixels.strides[1]
+
+	row_stride = pixels.strides[0] // pixel_stride
+	size = row_stride * (height - 1) + width
+
+	flat = numpy.lib.stride_tricks.as_strided(pixels,
+			shape=(size,) + pixels.shape[2:],
+			strides=(pixel_stride,) + pixels.strides[2:],
+		)
+
+	return flat, row_stride
+
+
+def _nearest_lines(source, dest):
+	"""
+	Return the source line (or column) for each of "dest" output lines.
+	"""
+	return (numpy.arange(dest) * source) // dest
+
+
+def _nearest_map(width, height, row_stride, target_width, target_height):
+	rows = _nearest_lines(height, target_height)
+	columns = _nearest_lines(width, target_width)
+
+	return rows[:, None] * row_stride + columns[None, :]
+
+
+def _neighbour_maps(width, height, row_stride):
+	"""
+	Return a dict mapping the names of the Scale2x/Scale3x neighbours of
+	each pixel (A B C / D E F / G H I) to index maps of those neighbours.
+
+	Neighbours off the edge of the frame are the pixel itself.
+	"""
+	rows = numpy.arange(height)
+	columns = numpy.arange(width)
+
+	up = numpy.maximum(rows - 1, 0)[:, None] * row_stride
+	middle = rows[:, None] * row_stride
+	down = numpy.minimum(rows + 1, height - 1)[:, None] * row_stride
+
+	left = numpy.maximum(columns - 1, 0)[None, :]
+	centre = columns[None, :]
+	right = numpy.minimum(columns + 1, width - 1)[None, :]
+
+	return {
+			"A": up + left, "B": up + centre, "C": up + right,
+			"D": middle + left, "E": middle + centre, "F": middle + right,
+			"G": down + left, "H": down + centre, "I": down + right,
+		}
+
+
+def _scale2x(pixel, index):
+	"""
+	Return the index map for the Scale2x filter.
+
+	"pixel" maps neighbour names to arrays of neighbour pixels, and "index"
+	maps them to index maps.
+	"""
+	def equal(a, b):
+		return pixel[a + b]
+
+	E = index["E"]
+	active = ~equal("B", "H") & ~equal("D", "F")
+
+	corners = [
+			numpy.where(active & equal("D", "B"), index["D"], E),
+			numpy.where(active & equal("B", "F"), index["F"], E),
+			numpy.where(active & equal("D", "H"), index["D"], E),
+			numpy.where(active & equal("H", "F"), index["F"], E),
+		]
+
+	return _interleave(corners, 2)
+
+
+def _scale3x(pixel, index):
+	"""
+	Return the index map for the Scale3x filter.
+	"""
+	def equal(a, b):
+		return pixel[a + b]
+
+	def differ(a, b):
+		return ~pixel[a + b]
+
+	E = index["E"]
+	active = differ("B", "H") & differ("D", "F")
+
+	db = equal("D", "B")
+	bf = equal("B", "F")
+	dh = equal("D", "H")
+	hf = equal("H", "F")
+
+	parts = [
+			(db, "D"),
+			((db & differ("E", "C")) | (bf & differ("E", "A")), "B"),
+			(bf, "F"),
+			((db & differ("E", "G")) | (dh & differ("E", "A")), "D"),
+			(None, "E"),
+			((bf & differ("E", "I")) | (hf & differ("E", "C")), "F"),
+			(dh, "D"),
+			((dh & differ("E", "I")) | (hf & differ("E", "G")), "H"),
+			(hf, "F"),
+		]
+
+	return _interleave([
+			E if condition is None
+				else numpy.where(active & condition, index[name], E)
+			for condition, name in parts
+		], 3)
+
+
+def _interleave(parts, factor):
+	"""
+	Assemble "factor" * "factor" index maps, one for each output pixel
+	position within a source pixel, into a single index map.
+	"""
+	height, width = parts[0].shape
+	res = numpy.empty( (height, factor, width, factor), dtype=numpy.intp )
+
+	for position, part in enumerate(parts):
+		row, column = divmod(position, factor)
+		res[:, row, :, column] = part
+
+	return res.reshape(height * factor, width * factor)
+
+
+# The pairs of neighbours Scale2x and Scale3x compare.
+_FILTER_PAIRS = {
+		MODE_SCALE2X: ("BH", "DF", "DB", "BF", "DH", "HF"),
+		MODE_SCALE3X: ("BH", "DF", "DB", "BF", "DH", "HF",
+			"EA", "EC", "EG", "EI"),
+	}
+
+_FILTERS = {
+		MODE_SCALE2X: (_scale2x, 2),
+		MODE_SCALE3X: (_scale3x, 3),
+	}
+
+
+class Scaler(object):
+	"""
+	Scales frames of pixels using one of the modes described above.
+	"""
+
+	def __init__(self, mode=MODE_NEAREST, cache_size=DEFAULT_CACHE_SIZE):
+		if mode not in MODES:
+			raise ValueError("Unknown scaling mode %r" % (mode,))
+
+		self.mode = mode
+		self.cache_size = cache_size
+		self._maps = collections.OrderedDict()
+
+	def _cached(self, key, build):
+		res = self._maps.pop(key, None)
+		if res is None:
+			res = build()
+			while len(self._maps) >= self.cache_size:
+				self._maps.popitem(last=False)
+
+		# Most recently used entries go at the end.
+		self._maps[key] = res
+
+		return res
+
+	def _index_map(self, width, height, row_stride, target_width,
+			target_height):
+		return self._cached(
+				("nearest", width, height, row_stride, target_width,
+					target_height),
+				lambda: _nearest_map(width, height, row_stride, target_width,
+					target_height),
+			)
+
+	def _dark_lines(self, height, target_height):
+		"""
+		Return the output lines that scanlines darkens.
+		"""
+		def build():
+			rows = _nearest_lines(height, target_height)
+			# The last output line of each source line, if the source line
+			# covers more than one.
+			last = numpy.append(rows[1:] != rows[:-1], True)
+			first = numpy.insert(rows[1:] != rows[:-1], 0, True)
+			return numpy.flatnonzero(last & ~first)
+
+		return self._cached(("scanlines", height, target_height), build)
+
+	def _filter_map(self, flat, width, height, row_stride, target_width,
+			target_height):
+		"""
+		Return the index map for the Scale2x/Scale3x filters.
+
+		Unlike the other maps, this depends on the pixels in the frame.
+		"""
+		function, factor = _FILTERS[self.mode]
+
+		index = self._cached(("neighbours", width, height, row_stride),
+				lambda: _neighbour_maps(width, height, row_stride))
+
+		pixel = {}
+		for pair in _FILTER_PAIRS[self.mode]:
+			equal = (flat[index[pair[0]]] == flat[index[pair[1]]])
+			if equal.ndim == 3:
+				# A pixel is only equal if every channel is.
+				equal = equal.all(axis=2)
+			pixel[pair] = equal
+
+		res = function(pixel, index)
+
+		if res.shape != (target_height, target_width):
+			resize = self._index_map(res.shape[1], res.shape[0],
+					res.shape[1], target_width, target_height)
+			res = res.ravel()[resize]
+
+		return res
+
+	def scale(self, pixels, target_width, target_height, out=None):
+		"""
+		Scale an array of pixels to the given size.
+
+		"pixels" is a 2D or 3D array of pixels, as described above. It
+		doesn't have to be contiguous, but its lines must be evenly spaced
+		in memory, as in libsnes' framebuffer.
+
+		"out", if given, is an array of shape (target_height, target_width)
+		(plus the colour dimension, for 3D arrays) and the same dtype as
+		"pixels", to store the result in.
+
+		Returns the scaled array of pixels.
+		"""
+		height, width = pixels.shape[:2]
+		flat, row_stride = _flatten(pixels)
+
+		if self.mode in _FILTERS:
+			index = self._filter_map(flat, width, height, row_stride,
+					target_width, target_height)
+		else:
+			index = self._index_map(width, height, row_stride, target_width,
+					target_height)
+
+		if out is None:
+			out = numpy.empty(index.shape + pixels.shape[2:],
+					dtype=pixels.dtype)
+
+		# With mode="clip", numpy.take() writes straight into "out" instead
+		# of into a temporary buffer; our indexes are always in range.
+		numpy.take(flat, index, axis=0, out=out, mode="clip")
+
+		if self.mode == MODE_SCANLINES:
+			mask = _DARKEN_MASKS.get(out.dtype)
+			if mask is None:
+				raise ValueError("Can't darken pixels of type %s"
+						% (out.dtype,))
+
+			lines = self._dark_lines(height, target_height)
+			dark = out[lines]
+			numpy.right_shift(dark, 1, dark)
+			numpy.bitwise_and(dark, mask, dark)
+			out[lines] = dark
+
+		return out
+
+
+# The Scalers used by screenshot(), one per mode, so their index maps are
+# reused from one screenshot to the next.
+_screenshot_scalers = {}
+
+
+def _screenshot_scaler(mode):
+	res = _screenshot_scalers.get(mode)
+	if res is None:
+		res = Scaler(mode)
+		_screenshot_scalers[mode] = res
+
+	return res
+
+
+def screenshot(frame, scale=1, mode=MODE_NEAREST, aspect=1.0, profile=None):
+	"""
+	Return a PIL.Image of the given frame as it would appear on screen.
+
+	"frame" is an instance of snes.video.frame.Frame.
+
+	"scale" and "aspect" are as for output_size(); for example,
+	aspect=scaling.NTSC_ASPECT corrects for the shape of the pixels on an
+	NTSC television. "mode" is one of the modes described above, and
+	"profile" an optional snes.video.color.ColorProfile to correct the
+	colours with.
+
+	The frame is scaled before it's converted to RGB, since that's
+	cheaper for anything but shrinking.
+	"""
+	# Only import PIL if somebody actually wants an image.
+	from PIL import Image
+
+	width, height = output_size(frame.width, frame.height, scale, aspect)
+	pixels = _screenshot_scaler(mode).scale(frame.pixels, width, height)
+
+	return Image.fromstring("RGB", (width, height),
+			color.to_RGB888(pixels, profile).tostring())
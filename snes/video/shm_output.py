@@ -0,0 +1,312 @@
+"""
+Shared-memory output for SNES video.
+
+Publishes each frame into a shared-memory segment (a file in /dev/shm, where
+available), so that other processes can map it and display or inspect the
+frames without any copying through pipes or sockets, and without the emulator
+ever waiting for them.
+
+The segment starts with a header, followed by room for the largest possible
+SNES frame:
+
+	offset	size	field
+	0	4	magic, "SNSM"
+	4	2	format version (1)
+	6	2	pixel format (FORMAT_XBGR1555)
+	8	8	sequence number
+	16	8	frame number (0 before the first frame)
+	24	4	frame width, in pixels
+	28	4	frame height, in pixels
+	32	4	pitch, in bytes
+	36	4	flags (FLAG_HIRES | FLAG_INTERLACE | FLAG_OVERSCAN)
+	64	...	pixel data
+
+All fields are little-endian.
+
+The header is protected by a sequence lock: the writer makes the sequence
+number odd before it changes anything, and even again once it's done.
+A reader that sees the same even sequence number before and after copying
+a frame knows the copy wasn't torn by the writer; otherwise it just tries
+again.
+"""
+import mmap
+import os
+import os.path
+import struct
+import tempfile
+import numpy
+from snes import exceptions as EX
+from snes.util import snes_framebuffer_to_array
+from snes.video.frame import Frame, ChangeDetector
+
+MAGIC = "SNSM"
+VERSION = 1
+
+FORMAT_XBGR1555 = 1
+
+FLAG_HIRES = 1 << 0
+FLAG_INTERLACE = 1 << 1
+FLAG_OVERSCAN = 1 << 2
+
+MAX_WIDTH = 512
+MAX_HEIGHT = 478
+
+# How many times a reader retries a copy torn by the writer before giving up
+# on this frame.
+DEFAULT_RETRIES = 16
+
+_header_struct = struct.Struct('<4sHHQQIIII')
+_sequence_struct = struct.Struct('<Q')
+_frame_struct = struct.Struct('<QIIII')
+
+_SEQUENCE_OFFSET = 8
+_FRAME_OFFSET = 16
+_DATA_OFFSET = 64
+
+_SEGMENT_SIZE = _DATA_OFFSET + MAX_WIDTH * MAX_HEIGHT * 2
+
+if os.path.isdir("/dev/shm"):
+	SHM_DIR = "/dev/shm"
+else:
+	SHM_DIR = tempfile.gettempdir()
+
+
+class SharedMemoryError(EX.SNESException):
+	"""
+	The shared-memory segment is missing or isn't one we understand.
+	"""
+
+
+def segment_path(name):
+	"""
+	Return the path of the shared-memory segment with the given name.
+	"""
+	if not name or os.path.sep in name:
+		raise ValueError("Bad segment name %r" % (name,))
+
+	return os.path.join(SHM_DIR, name)
+
+
+class SharedFrameWriter(object):
+	"""
+	Publishes SNES video frames into a shared-memory segment.
+
+	The following attributes are available:
+
+		"path" is the path of the segment's file.
+
+		"frame_number" is the number of the most recently published frame,
+		counting from 1.
+	"""
+
+	def __init__(self, name):
+		"""
+		Create the shared-memory segment with the given name.
+
+		If a segment with that name already exists, it's replaced.
+		"""
+		self.path = segment_path(name)
+		self.frame_number = 0
+
+		handle = open(self.path, "w+b")
+		try:
+			handle.truncate(_SEGMENT_SIZE)
+			self._map = mmap.mmap(handle.fileno(), _SEGMENT_SIZE)
+		finally:
+			handle.close()
+
+		self._sequence = 0
+		self._pixels = numpy.ndarray(MAX_WIDTH * MAX_HEIGHT,
+				dtype=numpy.uint16, buffer=self._map, offset=_DATA_OFFSET)
+		self._detector = ChangeDetector()
+
+		_header_struct.pack_into(self._map, 0, MAGIC, VERSION,
+				FORMAT_XBGR1555, 0, 0, 0, 0, 0, 0)
+
+	def _set_sequence(self, sequence):
+		self._sequence = sequence
+		_sequence_struct.pack_into(self._map, _SEQUENCE_OFFSET, sequence)
+
+	def video_refresh(self, data, width, height, hires, interlace, overscan,
+			pitch):
+		"""
+		Publish a frame of libsnes video data.
+
+		This is suitable for passing to core.EmulatedSNES.set_video_refresh_cb.
+		"""
+		unchanged = self._detector.unchanged(data, width, height, pitch)
+		if unchanged and self.frame_number == 0:
+			return
+
+		self.frame_number += 1
+
+		flags = 0
+		if hires: flags |= FLAG_HIRES
+		if interlace: flags |= FLAG_INTERLACE
+		if overscan: flags |= FLAG_OVERSCAN
+
+		self._set_sequence(self._sequence + 1)
+
+		if unchanged:
+			# Only the frame number changes.
+			_sequence_struct.pack_into(self._map, _FRAME_OFFSET,
+					self.frame_number)
+		else:
+			pixels = snes_framebuffer_to_array(data, width, height, pitch)
+			self._pixels[:width * height].reshape(height, width)[...] = pixels
+
+			_frame_struct.pack_into(self._map, _FRAME_OFFSET,
+					self.frame_number, width, height, width * 2, flags)
+
+		self._set_sequence(self._sequence + 1)
+
+	def close(self):
+		"""
+		Unmap and remove the shared-memory segment.
+
+		Readers that have already mapped it can carry on reading the last
+		frame, but no new ones will arrive.
+		"""
+		if self._map is None:
+			return
+
+		self._pixels = None
+		self._map.close()
+		self._map = None
+
+		try:
+			os.unlink(self.path)
+		except OSError:
+			pass
+
+
+class SharedFrameReader(object):
+	"""
+	Reads SNES video frames published by a SharedFrameWriter, possibly in
+	another process.
+	"""
+
+	def __init__(self, name, retries=DEFAULT_RETRIES):
+		"""
+		Map the shared-memory segment with the given name.
+
+		"retries" is how many times read() will retry a copy that was torn
+		by the writer publishing a new frame in the middle of it.
+
+		Raises SharedMemoryError if the segment doesn't exist, or wasn't
+		created by SharedFrameWriter.
+		"""
+		self.retries = retries
+
+		try:
+			handle = open(segment_path(name), "rb")
+		except IOError, e:
+			raise SharedMemoryError("Can't open segment %r: %s" % (name, e))
+
+		try:
+			size = os.fstat(handle.fileno()).st_size
+			if size < _SEGMENT_SIZE:
+				raise SharedMemoryError("Segment %r is too small" % (name,))
+
+			self._map = mmap.mmap(handle.fileno(), _SEGMENT_SIZE,
+					access=mmap.ACCESS_READ)
+		finally:
+			handle.close()
+
+		magic, version, format = _header_struct.unpack_from(self._map, 0)[:3]
+		if magic != MAGIC or version != VERSION:
+			self.close()
+			raise SharedMemoryError("Segment %r has an unknown header"
+					% (name,))
+		if format != FORMAT_XBGR1555:
+			self.close()
+			raise SharedMemoryError("Segment %r has unknown pixel format %d"
+					% (name, format))
+
+		self._pixels = numpy.ndarray(MAX_WIDTH * MAX_HEIGHT,
+				dtype=numpy.uint16, buffer=self._map, offset=_DATA_OFFSET)
+
+	@property
+	def frame_number(self):
+		"""
+		The number of the most recently published frame, or 0 if no frame
+		has been published yet.
+
+		This may be read without the sequence lock, so it's only a hint.
+		"""
+		return _sequence_struct.unpack_from(self._map, _FRAME_OFFSET)[0]
+
+	def read(self, after=None):
+		"""
+		Copy the most recently published frame out of the segment.
+
+		If "after" is given, and no frame newer than frame number "after"
+		has been published, returns None without copying anything.
+
+		Returns a (frame_number, frame) tuple, where "frame" is an instance
+		of snes.video.frame.Frame. Returns None if no frame has been
+		published yet, or the writer kept publishing new frames during every
+		attempt to copy one.
+		"""
+		for _ in xrange(self.retries + 1):
+			before = _sequence_struct.unpack_from(self._map,
+					_SEQUENCE_OFFSET)[0]
+			if before & 1:
+				# The writer's in the middle of publishing a frame.
+				continue
+
+			frame_number, width, height, pitch, flags = \
+					_frame_struct.unpack_from(self._map, _FRAME_OFFSET)
+
+			if frame_number == 0:
+				return None
+			if after is not None and frame_number <= after:
+				return None
+
+			count = (pitch // 2) * height
+			if count > len(self._pixels) or width > pitch // 2:
+				# A torn header; the sequence check will catch it.
+				pixels = None
+			else:
+				pixels = self._pixels[:count].reshape(height, pitch // 2)
+				pixels = pixels[:, :width].copy()
+
+			after_copy = _sequence_struct.unpack_from(self._map,
+					_SEQUENCE_OFFSET)[0]
+			if after_copy != before or pixels is None:
+				continue
+
+			frame = Frame(pixels,
+					hires=bool(flags & FLAG_HIRES),
+					interlace=bool(flags & FLAG_INTERLACE),
+					overscan=bool(flags & FLAG_OVERSCAN),
+				)
+
+			return frame_number, frame
+
+		return None
+
+	def close(self):
+		"""
+		Unmap the shared-memory segment.
+		"""
+		if self._map is None:
+			return
+
+		self._pixels = None
+		self._map.close()
+		self._map = None
+
+
+def set_video_refresh_cb(core, name):
+	"""
+	Publishes SNES video frames into the named shared-memory segment.
+
+	Returns the SharedFrameWriter instance used to publish the frames; call
+	its close() method to remove the segment when you're done.
+	"""
+	res = SharedFrameWriter(name)
+
+	core.set_video_refresh_cb(res.video_refresh)
+
+	return res
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+import unittest
+import os
+import os.path
+import shutil
+from tempfile import mkdtemp
+import numpy
+from snes.video import archive as A
+from snes.video.frame import Frame
+
+
+class TestTileCoding(unittest.TestCase):
+
+	def test_split_tiles(self):
+		"""
+		join_tiles() reverses split_tiles(), even for partial tiles.
+		"""
+		pixels = numpy.arange(239 * 20, dtype=numpy.uint16).reshape(239, 20)
+
+		tiles = A.split_tiles(pixels)
+		self.assertEqual(tiles.shape, (30 * 3, 64))
+		self.assertEqual(tiles[1, :8].tolist(), range(8, 16))
+
+		self.assertEqual(A.join_tiles(tiles, 20, 239).tolist(),
+				pixels.tolist())
+
+	def test_encode_tiles(self):
+		"""
+		decode_tiles() reverses encode_tiles(), for any number of colours.
+		"""
+		random = numpy.random.RandomState(0)
+
+		tiles = []
+		for colours in (1, 2, 3, 4, 5, 16, 17, 64):
+			palette = random.randint(0, 0x8000, size=colours)
+			tiles.append(palette[numpy.arange(64) % colours])
+		tiles = numpy.array(tiles, dtype=numpy.uint16)
+
+		data = A.encode_tiles(tiles)
+		self.assertEqual(A.decode_tiles(data, len(tiles)).tolist(),
+				tiles.tolist())
+
+		# A single-colour tile is just its colour.
+		self.assertEqual(len(A.encode_tiles(tiles[:1])), 3)
+
+
+class TestArchive(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = mkdtemp()
+		self.path = os.path.join(self.tempdir, "test.snfa")
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def _make_frames(self, count):
+		background = (numpy.arange(224 * 256) % 7 * 0x421).astype(
+				numpy.uint16).reshape(224, 256)
+
+		res = []
+		for index in xrange(count):
+			pixels = background.copy()
+			pixels[100:116, index:index + 16] = 0x7C00
+			res.append(Frame(pixels))
+
+		return res
+
+	def test_round_trip(self):
+		"""
+		Frames can be read back in any order.
+		"""
+		frames = self._make_frames(20)
+		frames.append(Frame(numpy.ones( (478, 512), dtype=numpy.uint16 )))
+
+		writer = A.ArchiveWriter(self.path)
+		for index, frame in enumerate(frames):
+			self.assertEqual(writer.add_frame(frame, str(index)), index)
+		writer.close()
+
+		reader = A.ArchiveReader(self.path)
+		self.assertEqual(len(reader), 21)
+
+		for index in (20, 3, 0, 19, -1):
+			self.assertEqual(reader[index].pixels.tolist(),
+					frames[index].pixels.tolist())
+
+		self.assertEqual(reader.tag(5), "5")
+		self.assertTrue(reader[20].hires)
+		self.assertTrue(reader[20].interlace)
+		self.assertTrue(reader[20].overscan)
+		self.assertRaises(IndexError, lambda: reader[21])
+
+		reader.close()
+
+	def test_deduplication(self):
+		"""
+		Tiles shared between frames are only stored once.
+		"""
+		frames = self._make_frames(50)
+
+		writer = A.ArchiveWriter(self.path)
+		for frame in frames:
+			writer.add_frame(frame)
+		writer.close()
+
+		self.assertTrue(writer.tiles_stored < 2 * 896)
+		self.assertEqual(writer.tiles_stored + writer.tiles_reused, 50 * 896)
+
+		raw_size = sum(len(frame.tostring()) for frame in frames)
+		self.assertTrue(os.path.getsize(self.path) < raw_size // 20)
+
+	def test_unclosed(self):
+		"""
+		Archives that weren't closed can still be read.
+		"""
+		frames = self._make_frames(3)
+
+		writer = A.ArchiveWriter(self.path)
+		for frame in frames:
+			writer.add_frame(frame)
+		writer._handle.flush()
+
+		with open(self.path, "rb") as handle:
+			data = handle.read()
+		with open(self.path, "wb") as handle:
+			# Chop off the end of the last frame.
+			handle.write(data[:-1])
+
+		reader = A.ArchiveReader(self.path)
+		self.assertEqual(len(reader), 2)
+		self.assertEqual(reader[1].pixels.tolist(),
+				frames[1].pixels.tolist())
+
+	def test_not_archive(self):
+		"""
+		Other files are rejected.
+		"""
+		with open(self.path, "wb") as handle:
+			handle.write("SNVR\x01")
+
+		self.assertRaises(A.CorruptArchive, A.ArchiveReader, self.path)
+
+
+if __name__ == "__main__":
+	unittest.main()
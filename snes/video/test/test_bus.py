@@ -0,0 +1,124 @@
+#!/usr/bin/python
+import unittest
+from snes.video import bus as B
+from snes.video import npy_output
+
+
+class FakeCore(object):
+
+	def __init__(self):
+		self.video_refresh = None
+		self.runs = 0
+
+	def set_video_refresh_cb(self, callback):
+		self.video_refresh = callback
+
+	def show(self, value):
+		self.video_refresh([value, 0, 0, 0], 2, 1, False, False, False, 4)
+
+	def run(self):
+		self.runs += 1
+		self.show(self.runs)
+
+
+class TestFrameBus(unittest.TestCase):
+
+	def setUp(self):
+		self.core = FakeCore()
+		self.bus = B.FrameBus(self.core)
+
+	def test_subscribers(self):
+		"""
+		Every subscriber gets the same Frame.
+		"""
+		first = []
+		second = []
+		self.bus.subscribe(first.append)
+		callback = self.bus.subscribe(second.append)
+
+		self.core.show(1)
+		self.bus.unsubscribe(callback)
+		self.core.show(2)
+
+		self.assertEqual([f.pixels[0, 0] for f in first], [1, 2])
+		self.assertEqual(len(second), 1)
+		self.assertTrue(first[0] is second[0])
+
+	def test_repeats(self):
+		"""
+		Repeated frames are marked as unchanged.
+		"""
+		frames = []
+		self.bus.subscribe(frames.append)
+
+		self.core.show(1)
+		self.core.show(1)
+		self.core.video_refresh(None, 2, 1, False, False, False, 4)
+
+		self.assertEqual([f.unchanged for f in frames], [False, True, True])
+		self.assertTrue(frames[1].pixels is frames[0].pixels)
+
+	def test_capture_next(self):
+		"""
+		capture_next() captures only the next frame.
+		"""
+		called = []
+		request = self.bus.capture_next(called.append)
+		self.assertFalse(request.done)
+
+		self.core.show(1)
+		self.core.show(2)
+
+		self.assertTrue(request.done)
+		self.assertEqual(request.frame.pixels[0, 0], 1)
+		self.assertEqual(called, [request.frame])
+
+	def test_unwatched_frames(self):
+		"""
+		Frames nobody wants aren't copied, or treated as repeats.
+		"""
+		frames = []
+		self.bus.subscribe(frames.append)
+		self.core.show(1)
+		self.bus.unsubscribe(frames.append)
+
+		self.core.show(2)
+		self.core.show(1)
+
+		request = self.bus.capture_next()
+		self.core.show(1)
+
+		self.assertEqual(len(frames), 1)
+		self.assertFalse(request.frame.unchanged)
+
+	def test_tap(self):
+		"""
+		Outputs can be attached to the bus alongside each other.
+		"""
+		tap = self.bus.tap()
+		frames = npy_output.capture_frames(tap, 2, self._npy_path())
+
+		self.assertEqual(frames[:, 0, 0].tolist(), [1, 2])
+		self.assertEqual(self.core.video_refresh, self.bus.video_refresh)
+
+		raw = []
+		other = self.bus.tap()
+		other.set_video_refresh_cb(lambda *args: raw.append(args[0]))
+		self.core.show(5)
+		other.close()
+		self.core.show(6)
+
+		self.assertEqual(raw, [[5, 0, 0, 0]])
+
+	def _npy_path(self):
+		import os.path
+		import shutil
+		from tempfile import mkdtemp
+
+		tempdir = mkdtemp()
+		self.addCleanup(shutil.rmtree, tempdir)
+		return os.path.join(tempdir, "frames.npy")
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+import os
+import os.path
+import shutil
+import unittest
+from tempfile import mkdtemp
+import numpy
+from snes import util
+from snes.video import color as C
+from snes.video.frame import Frame
+
+# Red, green, blue, white, grey and black, plus white with the unused top
+# bit set.
+PIXELS = numpy.array([[0x7C00, 0x03E0, 0x001F], [0x7FFF, 0x4210, 0x0000],
+		[0xFFFF, 0x8000, 0x0001]], dtype=numpy.uint16)
+
+
+class TestColorProfile(unittest.TestCase):
+
+	def test_default(self):
+		"""
+		The default profile converts pixels just like snes.util.
+		"""
+		table = C.ColorProfile().build_table()
+
+		self.assertEqual(table.shape, (32768, 3))
+		self.assertEqual(C.convert(PIXELS, table).tolist(),
+				util.snes_array_to_RGB888(PIXELS).tolist())
+
+	def test_curve(self):
+		"""
+		CURVE_SNES darkens the lower half of each channel.
+		"""
+		table = C.ColorProfile(C.CURVE_SNES).build_table()
+
+		self.assertEqual(table[0x7FFF].tolist(), [255, 255, 255])
+		self.assertEqual(table[0x4210].tolist(), [0x88, 0x88, 0x88])
+		self.assertEqual(table[0x0001].tolist(), [0, 0, 1])
+
+	def test_gamma(self):
+		"""
+		Converting from a higher gamma to sRGB darkens the middle tones.
+		"""
+		table = C.ColorProfile(gamma=2.2).build_table()
+		self.assertTrue(abs(int(table[0x4210, 0]) - 132) <= 2)
+
+		table = C.ColorProfile(gamma=2.5).build_table()
+		self.assertEqual(table[0x7FFF].tolist(), [255, 255, 255])
+		self.assertTrue(table[0x4210, 0] < 132)
+
+	def test_adjustments(self):
+		"""
+		Brightness scales every channel, and saturation moves colours
+		towards grey.
+		"""
+		table = C.ColorProfile(brightness=0.5).build_table()
+		self.assertEqual(table[0x7FFF].tolist(), [128, 128, 128])
+
+		table = C.ColorProfile(saturation=0.0).build_table()
+		red, green, blue = table[0x7C00]
+		self.assertEqual(red, green)
+		self.assertEqual(green, blue)
+		self.assertEqual(table[0x7FFF].tolist(), [255, 255, 255])
+
+	def test_equality(self):
+		"""
+		Profiles with the same settings are equal.
+		"""
+		self.assertEqual(C.ColorProfile(gamma=2.5), C.PROFILES["crt"])
+		self.assertNotEqual(C.ColorProfile(), C.PROFILES["crt"])
+
+	def test_bad_curve(self):
+		"""
+		Unknown curves are rejected.
+		"""
+		self.assertRaises(ValueError, C.ColorProfile, "sepia")
+
+
+class TestLookupTable(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tempdir)
+
+		# Don't let tables from other tests get in the way.
+		saved = dict(C._tables)
+		C._tables.clear()
+		self.addCleanup(C._tables.update, saved)
+		self.addCleanup(C._tables.clear)
+
+	def test_cache(self):
+		"""
+		Tables are built once, saved to disk and shared.
+		"""
+		profile = C.ColorProfile(C.CURVE_SNES, saturation=1.2)
+
+		table = C.lookup_table(profile, self.tempdir)
+		self.assertTrue(C.lookup_table(profile, self.tempdir) is table)
+		self.assertFalse(table.flags.writeable)
+		self.assertEqual(len(os.listdir(self.tempdir)), 1)
+
+		# Next time, the table is loaded from disk.
+		C._tables.clear()
+		profile.build_table = None
+		loaded = C.lookup_table(profile, self.tempdir)
+		self.assertEqual(loaded.tolist(), table.tolist())
+
+	def test_bad_cache(self):
+		"""
+		Damaged tables on disk are rebuilt.
+		"""
+		profile = C.PROFILES["snes"]
+		path = C._table_path(self.tempdir, profile)
+		with open(path, "wb") as handle:
+			handle.write("junk")
+
+		table = C.lookup_table(profile, self.tempdir)
+		self.assertEqual(table.tolist(), profile.build_table().tolist())
+		self.assertEqual(C._load_table(path).tolist(), table.tolist())
+
+	def test_no_disk(self):
+		"""
+		With cache_dir=False, nothing is written to disk.
+		"""
+		self.addCleanup(setattr, C, "DEFAULT_CACHE_DIR", C.DEFAULT_CACHE_DIR)
+		C.DEFAULT_CACHE_DIR = self.tempdir
+
+		C.lookup_table(C.PROFILES["crt"], False)
+		self.assertEqual(os.listdir(self.tempdir), [])
+
+	def test_packed(self):
+		"""
+		Packed tables hold each colour in a uint32.
+		"""
+		table = C.packed_table(cache_dir=False)
+
+		self.assertEqual(table.dtype, numpy.uint32)
+		self.assertEqual(C.convert(PIXELS[0], table).tolist(),
+				[0xFF0000, 0x00FF00, 0x0000FF])
+
+		table = C.packed_table(masks=(0xFF, 0xFF00, 0xFF0000),
+				cache_dir=False)
+		self.assertEqual(table[0x7C00], 0xFF)
+
+
+class TestFrameConversion(unittest.TestCase):
+
+	def setUp(self):
+		tempdir = mkdtemp()
+		self.addCleanup(shutil.rmtree, tempdir)
+
+		# Keep tables out of the real cache.
+		self.addCleanup(setattr, C, "DEFAULT_CACHE_DIR", C.DEFAULT_CACHE_DIR)
+		C.DEFAULT_CACHE_DIR = tempdir
+
+	def test_to_rgb888(self):
+		"""
+		Frames cache their conversion with each profile.
+		"""
+		frame = Frame(PIXELS[:2])
+		profile = C.ColorProfile(brightness=0.5)
+
+		corrected = frame.to_rgb888(profile)
+		self.assertEqual(corrected[1, 0].tolist(), [128, 128, 128])
+		self.assertTrue(frame.to_rgb888(C.ColorProfile(brightness=0.5))
+				is corrected)
+		self.assertEqual(frame.rgb888[1, 0].tolist(), [255, 255, 255])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+import unittest
+import numpy
+from snes.video import dirty as D
+
+
+def _frame(pixels, pitch=1024):
+	"""
+	Lay out the given pixels with the given pitch, like libsnes does.
+	"""
+	height, width = pixels.shape
+	data = numpy.zeros( (height, pitch), dtype=numpy.uint16 )
+	data[:, :width] = pixels
+	return data.ravel()
+
+
+class TestDirtyTracker(unittest.TestCase):
+
+	def test_first_frame(self):
+		"""
+		Every tile of the first frame is dirty.
+		"""
+		tracker = D.DirtyTracker()
+		pixels = numpy.zeros( (224, 256), dtype=numpy.uint16 )
+
+		dirty = tracker.update(_frame(pixels), 256, 224, 1024)
+		self.assertEqual(dirty.shape, (28, 32))
+		self.assertTrue(dirty.all())
+
+	def test_changed_tiles(self):
+		"""
+		Only tiles with changed pixels are dirty.
+		"""
+		tracker = D.DirtyTracker()
+		pixels = numpy.zeros( (224, 256), dtype=numpy.uint16 )
+		tracker.update(_frame(pixels), 256, 224, 1024)
+
+		self.assertFalse(tracker.update(_frame(pixels), 256, 224, 1024).any())
+
+		pixels[9, 17] = 0x7FFF
+		dirty = tracker.update(_frame(pixels), 256, 224, 1024)
+		self.assertEqual(zip(*numpy.nonzero(dirty)), [(1, 2)])
+		self.assertEqual(tracker.pixels[9, 17], 0x7FFF)
+
+	def test_partial_tiles(self):
+		"""
+		Frames that aren't a whole number of tiles are padded.
+		"""
+		tracker = D.DirtyTracker()
+		pixels = numpy.zeros( (239, 256), dtype=numpy.uint16 )
+		tracker.update(_frame(pixels), 256, 239, 1024)
+		self.assertEqual(tracker.pixels.shape, (240, 256))
+
+		pixels[238, 0] = 1
+		dirty = tracker.update(_frame(pixels), 256, 239, 1024)
+		self.assertEqual(zip(*numpy.nonzero(dirty)), [(29, 0)])
+
+	def test_size_change(self):
+		"""
+		Every tile is dirty when the frame size changes.
+		"""
+		tracker = D.DirtyTracker()
+		tracker.update(_frame(numpy.zeros( (224, 256), dtype=numpy.uint16 )),
+				256, 224, 1024)
+
+		dirty = tracker.update(
+				_frame(numpy.zeros( (224, 512), dtype=numpy.uint16 )),
+				512, 224, 1024)
+		self.assertEqual(dirty.shape, (28, 64))
+		self.assertTrue(dirty.all())
+
+	def test_repeated_frame(self):
+		"""
+		No tile is dirty when no frame data is given.
+		"""
+		tracker = D.DirtyTracker()
+		self.assertFalse(tracker.update(None, 256, 224, 1024).any())
+
+
+class TestDirtyRects(unittest.TestCase):
+
+	def test_merging(self):
+		"""
+		Neighbouring dirty tiles are merged into rectangles.
+		"""
+		dirty = numpy.zeros( (4, 4), dtype=bool )
+		dirty[0, 0:2] = True
+		dirty[1, 0:2] = True
+		dirty[1, 3] = True
+		dirty[3, 1:4] = True
+
+		self.assertEqual(D.dirty_rects(dirty, 32, 32), [
+				(0, 0, 16, 16),
+				(24, 8, 8, 8),
+				(8, 24, 24, 8),
+			])
+
+	def test_clean(self):
+		"""
+		A bitmap with no dirty tiles has no rectangles.
+		"""
+		self.assertEqual(D.dirty_rects(numpy.zeros( (4, 4), dtype=bool ),
+			32, 32), [])
+
+	def test_clipping_and_scaling(self):
+		"""
+		Rectangles are clipped to the frame, then scaled.
+		"""
+		dirty = numpy.zeros( (30, 64), dtype=bool )
+		dirty[29, 1] = True
+
+		self.assertEqual(D.dirty_rects(dirty, 512, 239),
+				[(8, 232, 8, 7)])
+		self.assertEqual(D.dirty_rects(dirty, 512, 239, 0.5, 1),
+				[(4, 232, 4, 7)])
+
+	def test_too_many_rects(self):
+		"""
+		Too many rectangles are replaced by one covering them all.
+		"""
+		dirty = numpy.zeros( (28, 32), dtype=bool )
+		dirty[2:20:2, 3:30:2] = True
+
+		self.assertEqual(D.dirty_rects(dirty, 256, 224, max_rects=4),
+				[(24, 16, 216, 136)])
+
+
+if __name__ == "__main__":
+	unittest.main()
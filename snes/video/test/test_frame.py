@@ -0,0 +1,162 @@
+#!/usr/bin/python
+import unittest
+import numpy
+from snes.video import frame
+
+class TestFrame(unittest.TestCase):
+
+	def _make_test_frame(self):
+		snes_frame = [
+				0x7C00, 0x03E0, 0x0000, 0x0000, # Red  Green Pad Pad
+				0x001F, 0x0000, 0x0000, 0x0000, # Blue Black Pad Pad
+			]
+
+		return frame.capture(snes_frame, 2, 2, False, False, False, 4)
+
+	def test_capture(self):
+		"""
+		capture() copies the visible pixels of a SNES frame.
+		"""
+		actual = self._make_test_frame()
+
+		self.assertEqual(actual.width, 2)
+		self.assertEqual(actual.height, 2)
+		self.assertEqual(actual.pixels.tolist(), [
+				[0x7C00, 0x03E0],
+				[0x001F, 0x0000],
+			])
+
+	def test_image(self):
+		"""
+		Frame.image converts the frame to a PIL.Image.
+		"""
+		image = self._make_test_frame().image
+
+		self.assertEqual(image.mode, "RGB")
+		self.assertEqual(image.size, (2,2))
+		self.assertEqual(list(image.getdata()), [
+				(255, 0, 0), (0, 255, 0),
+				(0, 0, 255), (0, 0, 0),
+			])
+
+	def test_conversions(self):
+		"""
+		Other formats are converted once, and shared with repeats.
+		"""
+		original = self._make_test_frame()
+
+		self.assertEqual(original.rgb888.tolist(), [
+				[[255, 0, 0], [0, 255, 0]],
+				[[0, 0, 255], [0, 0, 0]],
+			])
+		self.assertEqual(original.rgba[1, 0].tolist(), [0, 0, 255, 255])
+		self.assertTrue(original.rgb888 is original.rgb888)
+		self.assertTrue(original.image is original.image)
+
+		repeat = original.repeat()
+		self.assertTrue(repeat.rgb888 is original.rgb888)
+		self.assertTrue(repeat.image is original.image)
+
+	def test_surface(self):
+		"""
+		Frame.surface converts the frame to a pygame.Surface.
+		"""
+		try:
+			import pygame
+		except ImportError:
+			self.skipTest("pygame is not available")
+
+		surface = self._make_test_frame().surface
+
+		self.assertEqual(surface.get_size(), (2, 2))
+		self.assertEqual(tuple(surface.get_at( (0, 0) ))[:3], (255, 0, 0))
+		self.assertEqual(tuple(surface.get_at( (0, 1) ))[:3], (0, 0, 255))
+
+	def test_string_round_trip(self):
+		"""
+		Frame.fromstring() reverses Frame.tostring().
+		"""
+		original = self._make_test_frame()
+
+		actual = frame.Frame.fromstring(original.tostring(), 2, 2)
+
+		self.assertEqual(actual.pixels.tolist(), original.pixels.tolist())
+		self.assertEqual(actual.digest, original.digest)
+
+	def test_digest(self):
+		"""
+		Frames have the same digest only if they have the same content.
+		"""
+		frameA = self._make_test_frame()
+		frameB = self._make_test_frame()
+		self.assertEqual(frameA.digest, frameB.digest)
+
+		# Frames with different pixels have different digests.
+		frameC = self._make_test_frame()
+		frameC.pixels[0,0] = 0x7FFF
+		self.assertNotEqual(frameA.digest, frameC.digest)
+
+		# Frames with the same pixels in a different shape have different
+		# digests.
+		frameD = frame.Frame(frameA.pixels.reshape(1, 4))
+		self.assertNotEqual(frameA.digest, frameD.digest)
+
+
+class FakeCore(object):
+
+	def set_video_refresh_cb(self, callback):
+		self.video_refresh = callback
+
+
+class TestChangeDetector(unittest.TestCase):
+
+	def test_unchanged(self):
+		"""
+		ChangeDetector notices when the visible pixels repeat.
+		"""
+		detector = frame.ChangeDetector()
+		data = [1, 2, 0, 0, 3, 4, 0, 0]
+
+		self.assertFalse(detector.unchanged(data, 2, 2, 4))
+		self.assertTrue(detector.unchanged(data, 2, 2, 4))
+
+		# Pixels outside the visible area don't matter.
+		data[2] = 99
+		self.assertTrue(detector.unchanged(data, 2, 2, 4))
+
+		data[5] = 99
+		self.assertFalse(detector.unchanged(data, 2, 2, 4))
+		self.assertTrue(detector.unchanged(data, 2, 2, 4))
+
+		# Nor do frames of a different size.
+		self.assertFalse(detector.unchanged(data, 1, 2, 4))
+
+		# libretro cores pass None for repeated frames.
+		self.assertTrue(detector.unchanged(None, 1, 2, 4))
+
+	def test_set_video_refresh_cb(self):
+		"""
+		Repeated frames are marked as unchanged, and not copied again.
+		"""
+		core = FakeCore()
+		frames = []
+		frame.set_video_refresh_cb(core, frames.append)
+
+		# Nothing to repeat yet.
+		core.video_refresh(None, 2, 2, False, False, False, 4)
+
+		data = [1, 2, 0, 0, 3, 4, 0, 0]
+		core.video_refresh(data, 2, 2, False, False, False, 4)
+		core.video_refresh(data, 2, 2, False, False, False, 4)
+		core.video_refresh(None, 2, 2, False, False, False, 4)
+		data[0] = 5
+		core.video_refresh(data, 2, 2, False, False, False, 4)
+
+		self.assertEqual([f.unchanged for f in frames],
+				[False, True, True, False])
+		self.assertTrue(frames[2].pixels is frames[0].pixels)
+		self.assertEqual(frames[3].pixels.tolist(), [[5, 2], [3, 4]])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""
+Tests for the OpenGL video output.
+
+These run against Mesa's off-screen renderer, so they don't need a display,
+and are skipped if PyOpenGL or OSMesa isn't available.
+"""
+import unittest
+import os
+import os.path
+import shutil
+from tempfile import mkdtemp
+import numpy
+
+# PyOpenGL picks its platform when it's first imported.
+os.environ.setdefault("PYOPENGL_PLATFORM", "osmesa")
+
+try:
+	from OpenGL import GL
+	from OpenGL import osmesa
+	from snes.video import gl_output as G
+except Exception:
+	G = None
+
+
+def _frame(pixels, pitch=1024):
+	height, width = pixels.shape
+	data = numpy.zeros( (height, pitch), dtype=numpy.uint16 )
+	data[:, :width] = pixels
+	return data.ravel()
+
+
+_SHADER = """<?xml version="1.0" encoding="UTF-8"?>
+<shader language="GLSL">
+	<vertex><![CDATA[
+		uniform vec2 rubyInputSize;
+		void main() {
+			gl_Position = ftransform() * vec4(rubyInputSize, 1.0, 1.0);
+		}
+	]]></vertex>
+	<fragment><![CDATA[
+		void main() {
+			gl_FragColor = vec4(%s);
+		}
+	]]></fragment>
+</shader>
+"""
+
+
+class FakeCore(object):
+
+	def set_video_refresh_cb(self, callback):
+		self.video_refresh = callback
+
+
+@unittest.skipIf(G is None, "PyOpenGL with OSMesa is not available")
+class TestTextureUploader(unittest.TestCase):
+
+	def setUp(self):
+		self.context = osmesa.OSMesaCreateContext(osmesa.OSMESA_RGBA, None)
+		if not self.context:
+			self.skipTest("Can't create an OSMesa context")
+
+		self.buffer = GL.arrays.GLubyteArray.zeros( (16, 16, 4) )
+		osmesa.OSMesaMakeCurrent(self.context, self.buffer,
+				GL.GL_UNSIGNED_BYTE, 16, 16)
+
+	def tearDown(self):
+		osmesa.OSMesaDestroyContext(self.context)
+
+	def _texture_pixels(self, texture, width, height):
+		res = numpy.zeros( (height, width), dtype=numpy.uint16 )
+		GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+		GL.glGetTexImage(GL.GL_TEXTURE_2D, 0, GL.GL_BGRA,
+				GL.GL_UNSIGNED_SHORT_1_5_5_5_REV, res)
+		return res
+
+	def _check_upload(self, use_pbo):
+		uploader = G.TextureUploader(use_pbo)
+		pixels = numpy.arange(224 * 256, dtype=numpy.uint16).reshape(224, 256)
+		pixels &= 0x7FFF
+
+		texture = uploader.upload(_frame(pixels), 256, 224, 1024)
+		self.assertEqual(self._texture_pixels(texture, 256, 224).tolist(),
+				pixels.tolist())
+
+		# Only the given rectangles are uploaded.
+		changed = pixels.copy()
+		changed[8:16, 16:32] = 0x7C00
+		changed[100:108, 0:8] = 0x001F
+		texture = uploader.upload(_frame(changed), 256, 224, 1024,
+				[(16, 8, 16, 8)])
+
+		expected = pixels.copy()
+		expected[8:16, 16:32] = 0x7C00
+		self.assertEqual(self._texture_pixels(texture, 256, 224).tolist(),
+				expected.tolist())
+
+		self.assertEqual(uploader.frames_uploaded, 2)
+		self.assertEqual(uploader.bytes_uploaded, (256 * 224 + 16 * 8) * 2)
+		self.assertEqual(uploader.texture_allocations, 1)
+		self.assertTrue(uploader.upload_time > 0)
+
+		uploader.close()
+
+	def test_upload(self):
+		"""
+		Frames are uploaded straight from a pitched framebuffer.
+		"""
+		self._check_upload(False)
+
+	def test_upload_pbo(self):
+		"""
+		Frames are uploaded through pixel buffer objects.
+		"""
+		if not G.pbo_supported():
+			self.skipTest("Pixel buffer objects are not supported")
+
+		self._check_upload(True)
+
+	def test_video_refresh(self):
+		"""
+		Texture storage is allocated once per frame size.
+		"""
+		core = FakeCore()
+		frames = []
+		uploader = G.set_video_refresh_cb(core,
+				lambda *args: frames.append(args))
+
+		lowres = numpy.ones( (224, 256), dtype=numpy.uint16 )
+		hires = numpy.ones( (224, 512), dtype=numpy.uint16 )
+
+		for pixels in (lowres, lowres, hires, lowres):
+			height, width = pixels.shape
+			core.video_refresh(_frame(pixels), width, height, width == 512,
+					False, False, 1024)
+
+		self.assertEqual(len(frames), 4)
+		self.assertEqual(frames[0][1:], (256, 224, 256, 224))
+		self.assertEqual(frames[2][1:], (512, 224, 512, 224))
+		self.assertEqual(frames[0][0], frames[3][0])
+
+		# The repeated frame wasn't uploaded at all.
+		self.assertEqual(uploader.frames_uploaded, 3)
+		self.assertEqual(uploader.texture_allocations, 2)
+
+		uploader.close()
+
+
+@unittest.skipIf(G is None, "PyOpenGL with OSMesa is not available")
+class TestShaderManager(unittest.TestCase):
+
+	def setUp(self):
+		self.context = osmesa.OSMesaCreateContext(osmesa.OSMESA_RGBA, None)
+		if not self.context:
+			self.skipTest("Can't create an OSMesa context")
+
+		self.buffer = GL.arrays.GLubyteArray.zeros( (16, 16, 4) )
+		osmesa.OSMesaMakeCurrent(self.context, self.buffer,
+				GL.GL_UNSIGNED_BYTE, 16, 16)
+
+		self.tempdir = mkdtemp()
+		self.path = os.path.join(self.tempdir, "test.shader")
+		self._write_shader("1.0", 1000)
+
+		self.manager = G.ShaderManager()
+
+	def tearDown(self):
+		self.manager.close()
+		shutil.rmtree(self.tempdir)
+		osmesa.OSMesaDestroyContext(self.context)
+
+	def _write_shader(self, colour, mtime):
+		with open(self.path, "w") as handle:
+			handle.write(_SHADER % (colour,))
+		os.utime(self.path, (mtime, mtime))
+
+	def test_cache(self):
+		"""
+		Programs are only compiled once.
+		"""
+		program = self.manager.program(self.path)
+		self.assertTrue(program)
+		self.assertEqual(self.manager.program(self.path), program)
+		self.assertTrue(self.manager.load(self.path) is
+				self.manager.load(self.path))
+
+		location = self.manager.uniform_location(program, "rubyInputSize")
+		self.assertTrue(location >= 0)
+		self.assertEqual(
+				self.manager.uniform_location(program, "rubyInputSize"),
+				location)
+		self.assertEqual(self.manager.uniform_location(program, "missing"),
+				-1)
+
+	def test_reload(self):
+		"""
+		Programs are recompiled when their files change.
+		"""
+		program = self.manager.program(self.path)
+
+		self._write_shader("0.5", 2000)
+		self.assertNotEqual(self.manager.program(self.path), program)
+
+	def test_broken_reload(self):
+		"""
+		A broken edit keeps the old program in use.
+		"""
+		program = self.manager.program(self.path)
+
+		self._write_shader("syntax error", 2000)
+		self.assertRaises(RuntimeError, self.manager.program, self.path)
+		self.assertEqual(self.manager.program(self.path), program)
+
+
+if __name__ == "__main__":
+	unittest.main()
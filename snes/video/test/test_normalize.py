@@ -0,0 +1,110 @@
+#!/usr/bin/python
+import unittest
+import numpy
+from snes.video import normalize as N
+
+
+class TestCanonicalSize(unittest.TestCase):
+
+	def test_canonical_size(self):
+		"""
+		Every mode has the same canonical size, apart from overscan.
+		"""
+		for width, height in ((256, 224), (512, 224), (256, 448), (512, 448)):
+			self.assertEqual(N.canonical_size(width, height), (256, 224))
+			self.assertEqual(N.canonical_size(width, height, N.POLICY_DOUBLE),
+					(512, 448))
+
+		self.assertEqual(N.canonical_size(512, 478), (256, 239))
+		self.assertEqual(N.canonical_size(256, 239, N.POLICY_DOUBLE),
+				(512, 478))
+
+
+class TestNormalizer(unittest.TestCase):
+
+	def test_average(self):
+		"""
+		Each colour channel of a pair of pixels is averaged separately.
+		"""
+		pixels = numpy.zeros( (448, 512), dtype=numpy.uint16 )
+		pixels[0:2, 0] = 0x7C00 # Red
+		pixels[0:2, 1] = 0x001F # Blue
+		pixels[2, 2] = 0x7FFF # White
+		pixels[3, 2] = 0x0000 # Black
+
+		res = N.Normalizer().normalize(pixels)
+		self.assertEqual(res.shape, (224, 256))
+		self.assertEqual(res[0, 0], 0x3C0F)
+		self.assertEqual(res[1, 1], 0x1CE7)
+
+	def test_average_rgb(self):
+		"""
+		Arrays of colour channels can be averaged too.
+		"""
+		pixels = numpy.zeros( (224, 512, 3), dtype=numpy.uint8 )
+		pixels[:, 0::2] = (255, 0, 1)
+
+		res = N.Normalizer().normalize(pixels)
+		self.assertEqual(res.shape, (224, 256, 3))
+		self.assertEqual(res[0, 0].tolist(), [127, 0, 0])
+
+	def test_drop(self):
+		"""
+		POLICY_DROP keeps the first of each pair of pixels and lines.
+		"""
+		pixels = numpy.arange(448 * 512, dtype=numpy.uint16).reshape(448, 512)
+
+		res = N.Normalizer(N.POLICY_DROP).normalize(pixels)
+		self.assertEqual(res.tolist(), pixels[::2, ::2].tolist())
+
+	def test_double(self):
+		"""
+		POLICY_DOUBLE repeats the pixels and lines of smaller frames.
+		"""
+		pixels = numpy.arange(224 * 256, dtype=numpy.uint16).reshape(224, 256)
+
+		res = N.Normalizer(N.POLICY_DOUBLE).normalize(pixels)
+		self.assertEqual(res.shape, (448, 512))
+		self.assertEqual(res[:2, :4].tolist(), [[0, 0, 1, 1], [0, 0, 1, 1]])
+
+		hires = numpy.zeros( (448, 512), dtype=numpy.uint16 )
+		self.assertTrue(
+				N.Normalizer(N.POLICY_DOUBLE).normalize(hires) is hires)
+
+	def test_resize(self):
+		"""
+		Extra lines are cropped, and missing ones filled with zeros.
+		"""
+		normalizer = N.Normalizer()
+		out = numpy.full( (224, 256), 9, dtype=numpy.uint16 )
+
+		tall = numpy.ones( (239, 256), dtype=numpy.uint16 )
+		self.assertTrue(normalizer.resize(tall, 256, 224, out=out) is out)
+		self.assertEqual(numpy.unique(out).tolist(), [1])
+
+		short = numpy.ones( (224, 256), dtype=numpy.uint16 )
+		res = normalizer.resize(short, 256, 239)
+		self.assertEqual(res[:224].sum(), 224 * 256)
+		self.assertEqual(res[224:].sum(), 0)
+
+	def test_resize_ratio(self):
+		"""
+		Sizes exactly twice or half the target are scaled, however small.
+		"""
+		pixels = numpy.array([[1, 2]], dtype=numpy.uint16)
+		self.assertEqual(N.Normalizer().resize(pixels, 4, 2).tolist(),
+				[[1, 1, 2, 2], [1, 1, 2, 2]])
+
+		pixels = numpy.array([[2, 4, 6, 8]], dtype=numpy.uint16)
+		self.assertEqual(N.Normalizer().resize(pixels, 2, 1).tolist(),
+				[[3, 7]])
+
+	def test_bad_policy(self):
+		"""
+		Unknown policies are rejected.
+		"""
+		self.assertRaises(ValueError, N.Normalizer, "blur")
+
+
+if __name__ == "__main__":
+	unittest.main()
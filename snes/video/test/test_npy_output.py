@@ -0,0 +1,130 @@
+#!/usr/bin/python
+import unittest
+import os.path
+import shutil
+from tempfile import mkdtemp
+import numpy
+from snes.video import npy_output as N
+
+
+class FakeCore(object):
+	"""
+	Produces a frame of the given dimensions every time it's run.
+	"""
+
+	def __init__(self, frames):
+		self.frames = list(frames)
+		self.video_refresh = None
+
+	def set_video_refresh_cb(self, callback):
+		self.video_refresh = callback
+
+	def run(self):
+		pixels = self.frames.pop(0)
+		height, width = pixels.shape
+
+		# Lay the frame out with libsnes' pitch.
+		data = numpy.zeros( (height, 1024), dtype=numpy.uint16 )
+		data[:, :width] = pixels
+
+		self.video_refresh(data.ravel(), width, height, width == 512,
+				height > 239, height in (239, 478), 1024)
+
+
+class TestFrameStack(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = mkdtemp()
+		self.path = os.path.join(self.tempdir, "frames.npy")
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def test_capture_frames(self):
+		"""
+		capture_frames() fills a .npy file that can be memory-mapped.
+		"""
+		frames = [
+				numpy.full( (224, 256), value, dtype=numpy.uint16 )
+				for value in xrange(5)
+			]
+		core = FakeCore(frames)
+
+		res = N.capture_frames(core, 3, self.path)
+		self.assertEqual(res.shape, (3, 224, 256))
+		self.assertEqual(len(core.frames), 2)
+
+		loaded = numpy.load(self.path, mmap_mode='r')
+		self.assertEqual(loaded.dtype, numpy.uint16)
+		self.assertEqual(loaded[:, 0, 0].tolist(), [0, 1, 2])
+		self.assertEqual(loaded[2, 223, 255], 2)
+
+	def test_hires_average(self):
+		"""
+		Hi-res and interlaced frames are averaged down.
+		"""
+		pixels = numpy.zeros( (448, 512), dtype=numpy.uint16 )
+		pixels[0, 0] = 0x7C00 # Red
+		pixels[0, 1] = 0x001F # Blue
+		pixels[1, 0] = 0x7C00
+		pixels[1, 1] = 0x001F
+		pixels[2, 2] = 0x7FFF # White
+		pixels[3, 2] = 0x0000 # Black
+
+		res = N.capture_frames(FakeCore([pixels]), 1, self.path)
+
+		self.assertEqual(res.shape, (1, 224, 256))
+		# Each channel is averaged separately.
+		self.assertEqual(res[0, 0, 0], 0x3C0F)
+		self.assertEqual(res[0, 1, 1], 0x1CE7)
+
+	def test_hires_drop(self):
+		"""
+		Hi-res frames can be reduced by dropping pixels.
+		"""
+		pixels = numpy.zeros( (224, 512), dtype=numpy.uint16 )
+		pixels[:, 0::2] = 1
+		pixels[:, 1::2] = 2
+
+		res = N.capture_frames(FakeCore([pixels]), 1, self.path,
+				policy=N.POLICY_DROP)
+		self.assertEqual(numpy.unique(res).tolist(), [1])
+
+	def test_lowres_doubling(self):
+		"""
+		Low-res frames are doubled up to fit hi-res files.
+		"""
+		pixels = numpy.arange(224 * 256, dtype=numpy.uint16).reshape(224, 256)
+
+		res = N.capture_frames(FakeCore([pixels]), 1, self.path, 512, 448)
+
+		self.assertEqual(res[0, :2, :4].tolist(), [[0, 0, 1, 1], [0, 0, 1, 1]])
+		self.assertEqual(res[0, 447, 511], pixels[223, 255])
+
+	def test_repeated_frames(self):
+		"""
+		Repeated frames are copied from the previous slot.
+		"""
+		pixels = numpy.zeros( (448, 512), dtype=numpy.uint16 )
+		pixels[0, 0] = 0x7FFF
+
+		res = N.capture_frames(FakeCore([pixels, pixels]), 2, self.path)
+		self.assertEqual(res[0].tolist(), res[1].tolist())
+		self.assertEqual(res[1, 0, 0], 0x1CE7)
+
+	def test_overscan(self):
+		"""
+		Frames taller than the file are cropped; shorter ones are padded.
+		"""
+		tall = numpy.ones( (239, 256), dtype=numpy.uint16 )
+		short = numpy.ones( (224, 256), dtype=numpy.uint16 )
+
+		res = N.capture_frames(FakeCore([tall, short]), 2, self.path,
+				height=239)
+		self.assertEqual(res[0].sum(), 239 * 256)
+		self.assertEqual(res[1].sum(), 224 * 256)
+		self.assertEqual(res[1, 224:].sum(), 0)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -3,7 +3,7 @@ import unittest
 import os.path
 from PIL import Image
 from snes.test import util
-from snes.video import pil_output
+from snes.video import normalize, pil_output
 
 class TestPILOutput(util.SNESTestCase):
 
@@ -26,6 +26,21 @@ class TestPILOutput(util.SNESTestCase):
 				(0, 0, 255), (0, 0, 0),
 			])
 
+	def test_snes_to_image_normalized(self):
+		"""
+		_snes_to_image can normalize frames before converting them.
+		"""
+		# A hi-res line: two red pixels, two green pixels, then black.
+		snes_frame = [0x7C00, 0x7C00, 0x03E0, 0x03E0] + [0x0000] * 508
+
+		image = pil_output._snes_to_image(snes_frame, 512, 1, True, False,
+				False, 512, normalize.Normalizer())
+
+		self.assertEqual(image.size, (256, 1))
+		self.assertEqual(list(image.getdata())[:3], [
+				(255, 0, 0), (0, 255, 0), (0, 0, 0),
+			])
+
 	def test_video_refresh_callback(self):
 		"""
 		set_video_refresh_cb delivers SNES frames via PIL
@@ -142,6 +157,26 @@ class TestImageComparison(unittest.TestCase):
 				"Images have different sizes (4x2 vs. 4x3)",
 			)
 
+	def test_interlaced_upscaling(self):
+		"""
+		If one image is exactly twice the height of the other, it is upscaled.
+		"""
+		progressive = self._make_test_image(width=2, height=2)
+
+		# An interlaced frame of the same picture has every line twice.
+		interlaced = progressive.resize( (4, 4) )
+		self.assertEqual(pil_output.compare_images(progressive, interlaced),
+				None)
+		self.assertEqual(pil_output.compare_images(interlaced, progressive),
+				None)
+
+		# A difference in one field is still a difference.
+		interlaced.putpixel((0,1), (255, 255, 0))
+		result = pil_output.compare_images(progressive, interlaced)
+		self.assertTrue(isinstance(result, pil_output.ImageDifference))
+		self.assertEqual(result.count, 1)
+		self.assertEqual(result.bbox, (0, 1, 1, 2))
+
 	def test_different_image_content(self):
 		"""
 		Images with different content are detected as different.
@@ -169,6 +204,56 @@ class TestImageComparison(unittest.TestCase):
 		self.assertTrue(description.startswith("Image differences found."),
 				"Unexpected description: %r" % (description,))
 
+	def test_difference_metrics(self):
+		"""
+		compare_images measures how much two images differ.
+		"""
+		imageA = self._make_test_image(width=4, height=3)
+		imageB = self._make_test_image(width=4, height=3)
+
+		# Change the green pixel to a yellow one, and make the blue pixel
+		# slightly less blue.
+		imageB.putpixel((1,0), (255, 255, 0))
+		imageB.putpixel((0,1), (0, 0, 250))
+
+		result = pil_output.compare_images(imageA, imageB)
+
+		self.assertTrue(isinstance(result, pil_output.ImageDifference))
+		self.assertEqual(result.count, 2)
+		self.assertEqual(result.bbox, (0, 0, 2, 2))
+		self.assertEqual(result.max_delta, 255)
+		self.assertAlmostEqual(result.psnr, 15.56, places=2)
+
+		self.assertEqual(list(result.mask.getdata()), [
+				0, 1, 0, 0,
+				1, 0, 0, 0,
+				0, 0, 0, 0,
+			])
+
+	def test_difference_tolerance(self):
+		"""
+		Differences within the given tolerances are ignored.
+		"""
+		imageA = self._make_test_image()
+		imageB = self._make_test_image()
+
+		# Make the blue pixel slightly less blue.
+		imageB.putpixel((0,1), (0, 0, 250))
+
+		result = pil_output.compare_images(imageA, imageB)
+
+		self.assertFalse(result.is_within())
+		self.assertTrue(result.is_within(max_delta=5))
+		self.assertFalse(result.is_within(max_delta=4))
+		self.assertTrue(result.is_within(max_pixels=1))
+		self.assertTrue(result.is_within(max_pixels=1, min_psnr=40))
+		self.assertFalse(result.is_within(max_pixels=1, min_psnr=50))
+
+		self.assertEqual(
+				pil_output.describe_difference(imageA, imageB, max_delta=5),
+				None,
+			)
+
 
 if __name__ == "__main__":
 	unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+import threading
+import unittest
+import numpy
+from snes.util import snes_framebuffer_to_array
+from snes.video.presenter import ThreadedPresenter
+
+
+class FakeCore(object):
+
+	def __init__(self):
+		self.video_refresh = None
+		self.name = "fake"
+
+	def set_video_refresh_cb(self, callback):
+		self.video_refresh = callback
+
+	def show(self, value, width=2, height=2, pitch=4):
+		data = numpy.zeros(pitch * height, dtype=numpy.uint16)
+		data[0] = value
+		self.video_refresh(data, width, height, False, False, False, pitch)
+		# The core is free to reuse its framebuffer straight away.
+		data[0] = 0xFFFF
+
+
+class TestThreadedPresenter(unittest.TestCase):
+
+	def setUp(self):
+		self.core = FakeCore()
+		self.presenter = ThreadedPresenter(self.core)
+		self.addCleanup(self.presenter.close)
+
+		self.frames = []
+		self.threads = []
+		self.presenter.set_video_refresh_cb(self.present)
+
+	def present(self, data, width, height, hires, interlace, overscan,
+			pitch):
+		self.threads.append(threading.current_thread())
+		if data is None:
+			self.frames.append(None)
+		else:
+			self.frames.append(
+					snes_framebuffer_to_array(data, width, height, pitch).copy())
+
+	def test_present(self):
+		"""
+		Frames are copied, and presented on another thread.
+		"""
+		self.core.show(1)
+		self.presenter.wait()
+		self.core.show(2, width=3, height=1)
+		self.presenter.wait()
+
+		self.assertEqual([frame.tolist() for frame in self.frames],
+				[[[1, 0], [0, 0]], [[2, 0, 0]]])
+		self.assertFalse(threading.current_thread() in self.threads)
+		self.assertEqual(self.presenter.frames_presented, 2)
+
+		self.core.video_refresh(None, 3, 1, False, False, False, 4)
+		self.presenter.wait()
+		self.assertEqual(self.frames[-1], None)
+
+	def test_drop(self):
+		"""
+		If presenting falls behind, only the newest frame is kept.
+		"""
+		started = threading.Event()
+		release = threading.Event()
+
+		def slow_present(*args):
+			started.set()
+			release.wait()
+			self.present(*args)
+
+		self.presenter.set_video_refresh_cb(slow_present)
+
+		self.core.show(1)
+		started.wait()
+		for value in (2, 3, 4):
+			self.core.show(value)
+		release.set()
+		self.presenter.close()
+
+		self.assertEqual([frame[0, 0] for frame in self.frames], [1, 4])
+		self.assertEqual(self.presenter.frames_dropped, 2)
+
+	def test_repeat_while_behind(self):
+		"""
+		A repeated frame doesn't replace a frame still waiting to be
+		presented.
+		"""
+		started = threading.Event()
+		release = threading.Event()
+
+		def slow_present(*args):
+			started.set()
+			release.wait()
+			self.present(*args)
+
+		self.presenter.set_video_refresh_cb(slow_present)
+
+		self.core.show(1)
+		started.wait()
+		self.core.show(2)
+		self.core.video_refresh(None, 2, 2, False, False, False, 4)
+		release.set()
+		self.presenter.close()
+
+		self.assertEqual([frame[0, 0] for frame in self.frames], [1, 2])
+		self.assertEqual(self.presenter.frames_dropped, 0)
+
+	def test_error(self):
+		"""
+		Exceptions raised while presenting are passed back.
+		"""
+		def broken(*args):
+			raise ValueError("broken")
+
+		self.presenter.set_video_refresh_cb(broken)
+		self.core.show(1)
+
+		self.assertRaises(ValueError, self.presenter.wait)
+
+	def test_forwarding(self):
+		"""
+		Other attributes come from the core.
+		"""
+		self.assertEqual(self.presenter.name, "fake")
+		self.assertEqual(self.core.video_refresh,
+				self.presenter.video_refresh)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,234 @@
+#!/usr/bin/python
+import unittest
+import os
+import os.path
+import shutil
+import time
+from tempfile import mkdtemp
+from snes.video import recorder as R
+from snes.video import archive
+
+
+class FakeCore(object):
+
+	def set_video_refresh_cb(self, callback):
+		self.video_refresh = callback
+
+
+class SlowEncoder(object):
+
+	def __init__(self, path, frame_rate):
+		pass
+
+	def write(self, frame):
+		time.sleep(0.2)
+
+	def close(self):
+		pass
+
+
+class BrokenEncoder(SlowEncoder):
+
+	def write(self, frame):
+		raise IOError("disk full")
+
+
+def _snes_frame(value):
+	return [
+			value, 0x03E0, 0x0000, 0x0000, # Pixel Green Pad Pad
+			0x001F, 0x0000, 0x0000, 0x0000, # Blue Black Pad Pad
+		]
+
+
+class TestVideoRecorder(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = mkdtemp()
+		R.ENCODERS["slow"] = SlowEncoder
+		R.ENCODERS["broken"] = BrokenEncoder
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+		del R.ENCODERS["slow"]
+		del R.ENCODERS["broken"]
+
+	def test_frames(self):
+		"""
+		Frames recorded in the internal format can be read back.
+		"""
+		core = FakeCore()
+		path = os.path.join(self.tempdir, "video.frames")
+		recorder = R.set_video_sink(core, path)
+
+		for value in xrange(5):
+			core.video_refresh(_snes_frame(value), 2, 2, False, False, False,
+					4)
+
+		recorder.close()
+
+		self.assertEqual(recorder.frames_submitted, 5)
+		self.assertEqual(recorder.frames_encoded, 5)
+		self.assertEqual(recorder.queue_depth, 0)
+
+		frames = list(R.read_frames(path))
+		self.assertEqual([f.pixels.tolist() for f in frames], [
+				[[value, 0x03E0], [0x001F, 0x0000]]
+				for value in xrange(5)
+			])
+
+	def test_archive(self):
+		"""
+		Frames can be recorded to a frame archive.
+		"""
+		path = os.path.join(self.tempdir, "video.snfa")
+		recorder = R.VideoRecorder(path, R.FORMAT_ARCHIVE)
+
+		for value in xrange(3):
+			recorder.video_refresh(_snes_frame(value), 2, 2, False, False,
+					False, 4)
+		recorder.close()
+
+		reader = archive.ArchiveReader(path)
+		self.assertEqual([f.pixels.tolist() for f in reader], [
+				[[value, 0x03E0], [0x001F, 0x0000]]
+				for value in xrange(3)
+			])
+		reader.close()
+
+	def test_repeated_frames(self):
+		"""
+		Repeated frames are recorded without being sent again.
+		"""
+		path = os.path.join(self.tempdir, "video.frames")
+		recorder = R.VideoRecorder(path)
+
+		for value in (1, 1, 2):
+			recorder.video_refresh(_snes_frame(value), 2, 2, False, False,
+					False, 4)
+		recorder.video_refresh(None, 2, 2, False, False, False, 4)
+		recorder.close()
+
+		self.assertEqual([f.pixels[0, 0] for f in R.read_frames(path)],
+				[1, 1, 2, 2])
+
+	def test_repeat_before_first_frame(self):
+		"""
+		Repeats with nothing to repeat are skipped, and don't stay queued.
+		"""
+		path = os.path.join(self.tempdir, "video.frames")
+		recorder = R.VideoRecorder(path)
+
+		recorder.video_refresh(None, 2, 2, False, False, False, 4)
+		recorder.video_refresh(_snes_frame(1), 2, 2, False, False, False, 4)
+		recorder.close()
+
+		self.assertEqual(recorder.frames_submitted, 2)
+		self.assertEqual(recorder.frames_encoded, 1)
+		self.assertEqual(recorder.frames_skipped, 1)
+		self.assertEqual(recorder.queue_depth, 0)
+		self.assertEqual([f.pixels[0, 0] for f in R.read_frames(path)], [1])
+
+	def test_png(self):
+		"""
+		Frames can be recorded as a sequence of PNG files.
+		"""
+		path = os.path.join(self.tempdir, "png")
+		recorder = R.VideoRecorder(path, R.FORMAT_PNG)
+
+		for value in xrange(3):
+			recorder.video_refresh(_snes_frame(value), 2, 2, False, False,
+					False, 4)
+		recorder.close()
+
+		self.assertEqual(sorted(os.listdir(path)),
+				["000000.png", "000001.png", "000002.png"])
+
+	def test_y4m(self):
+		"""
+		Frames can be recorded as a YUV4MPEG2 stream.
+		"""
+		path = os.path.join(self.tempdir, "video.y4m")
+		recorder = R.VideoRecorder(path, R.FORMAT_Y4M, frame_rate=(60, 1))
+
+		for value in xrange(3):
+			recorder.video_refresh(_snes_frame(value), 2, 2, False, False,
+					False, 4)
+		recorder.close()
+
+		with open(path, "rb") as handle:
+			data = handle.read()
+
+		header = "YUV4MPEG2 W2 H2 F60:1 Ip A1:1 C444\n"
+		self.assertTrue(data.startswith(header))
+		# Each frame has a header and three 2x2 planes.
+		self.assertEqual(len(data), len(header) + 3 * (len("FRAME\n") + 12))
+
+		# Black is Y=16, Cb=Cr=128.
+		first = data[len(header) + len("FRAME\n"):]
+		self.assertEqual([ord(first[i]) for i in (3, 7, 11)], [16, 128, 128])
+
+	def test_y4m_mode_change(self):
+		"""
+		Frames of a different size from the first are normalized to match.
+		"""
+		path = os.path.join(self.tempdir, "video.y4m")
+		recorder = R.VideoRecorder(path, R.FORMAT_Y4M, frame_rate=(60, 1))
+
+		recorder.video_refresh(_snes_frame(0x7FFF), 2, 2, False, False,
+				False, 4)
+		# A hi-res frame, whose first pair of pixels averages to the first
+		# pixel of the previous frame.
+		recorder.video_refresh([
+				0x7FFF, 0x7FFF, 0x03E0, 0x03E0,
+				0x001F, 0x001F, 0x0000, 0x0000,
+			], 4, 2, True, False, False, 4)
+		recorder.close()
+
+		with open(path, "rb") as handle:
+			data = handle.read()
+
+		header = "YUV4MPEG2 W2 H2 F60:1 Ip A1:1 C444\n"
+		self.assertTrue(data.startswith(header))
+
+		frames = data[len(header):].split("FRAME\n")
+		self.assertEqual(frames, ["", frames[1], frames[1]])
+
+	def test_drop(self):
+		"""
+		With POLICY_DROP, frames are dropped when the queue is full.
+		"""
+		recorder = R.VideoRecorder(os.path.join(self.tempdir, "x"), "slow",
+				queue_frames=1, policy=R.POLICY_DROP)
+
+		for value in xrange(10):
+			recorder.video_refresh(_snes_frame(value), 2, 2, False, False,
+					False, 4)
+		recorder.close()
+
+		self.assertEqual(recorder.frames_submitted, 10)
+		self.assertTrue(recorder.frames_dropped > 0)
+		self.assertEqual(recorder.frames_encoded + recorder.frames_dropped,
+				10)
+		self.assertTrue(recorder.max_queue_depth <= 2)
+		self.assertTrue(recorder.mean_encode_time >= 0.2)
+
+	def test_worker_error(self):
+		"""
+		If the worker process fails, close() raises RecorderError.
+		"""
+		recorder = R.VideoRecorder(os.path.join(self.tempdir, "x"), "broken")
+		recorder.video_refresh(_snes_frame(0), 2, 2, False, False, False, 4)
+
+		self.assertRaises(R.RecorderError, recorder.close)
+
+	def test_bad_arguments(self):
+		"""
+		Unknown formats and policies are rejected.
+		"""
+		self.assertRaises(ValueError, R.VideoRecorder, self.tempdir, "mpeg")
+		self.assertRaises(ValueError, R.VideoRecorder, self.tempdir,
+				policy="panic")
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+import unittest
+import numpy
+from snes.util import snes_framebuffer_to_array
+from snes.video import scalers as S
+from snes.video import scaling
+from snes.video.frame import Frame
+
+# A diagonal edge, to give Scale2x and Scale3x something to smooth.
+EDGE = numpy.array([
+		[0, 1, 1],
+		[0, 0, 1],
+		[0, 0, 0],
+	], dtype=numpy.uint16)
+
+
+class TestOutputSize(unittest.TestCase):
+
+	def test_output_size(self):
+		"""
+		Hi-res and interlaced frames have the same on-screen size.
+		"""
+		self.assertEqual(S.output_size(256, 224), (256, 224))
+		self.assertEqual(S.output_size(512, 448), (256, 224))
+		self.assertEqual(S.output_size(512, 478, 2), (512, 478))
+		self.assertEqual(S.output_size(256, 224, 1, scaling.NTSC_ASPECT),
+				(294, 224))
+
+
+class TestScaler(unittest.TestCase):
+
+	def test_nearest(self):
+		"""
+		Nearest-neighbour scaling repeats or skips pixels.
+		"""
+		pixels = numpy.array([[1, 2], [3, 4]], dtype=numpy.uint16)
+		scaler = S.Scaler()
+
+		self.assertEqual(scaler.scale(pixels, 4, 4).tolist(), [
+				[1, 1, 2, 2],
+				[1, 1, 2, 2],
+				[3, 3, 4, 4],
+				[3, 3, 4, 4],
+			])
+		self.assertEqual(scaler.scale(pixels, 3, 1).tolist(), [[1, 1, 2]])
+		self.assertEqual(scaler.scale(pixels, 1, 2).tolist(), [[1], [3]])
+
+	def test_framebuffer(self):
+		"""
+		Frames can be scaled straight out of a padded framebuffer.
+		"""
+		data = numpy.arange(4 * 1024, dtype=numpy.uint16)
+		pixels = snes_framebuffer_to_array(data, 256, 4, 1024)
+
+		out = numpy.zeros( (8, 512), dtype=numpy.uint16 )
+		res = S.Scaler().scale(pixels, 512, 8, out=out)
+
+		self.assertTrue(res is out)
+		self.assertEqual(out[::2, ::2].tolist(), pixels.tolist())
+		self.assertEqual(out[1::2, 1::2].tolist(), pixels.tolist())
+
+	def test_rgb(self):
+		"""
+		Arrays with a colour dimension are scaled as whole pixels.
+		"""
+		pixels = numpy.zeros( (3, 3, 3), dtype=numpy.uint8 )
+		pixels[EDGE == 1] = (255, 0, 0)
+
+		res = S.Scaler(S.MODE_SCALE2X).scale(pixels, 6, 6)
+		self.assertEqual(res.shape, (6, 6, 3))
+		self.assertEqual(res[2:4, 2:4, 0].tolist(), [[0, 255], [0, 0]])
+
+	def test_scale2x(self):
+		"""
+		Scale2x smooths diagonal edges.
+		"""
+		res = S.Scaler(S.MODE_SCALE2X).scale(EDGE, 6, 6)
+		self.assertEqual(res[2:4, 2:4].tolist(), [[0, 1], [0, 0]])
+
+		solid = numpy.full( (4, 4), 7, dtype=numpy.uint16 )
+		self.assertEqual(numpy.unique(
+			S.Scaler(S.MODE_SCALE2X).scale(solid, 8, 8)).tolist(), [7])
+
+	def test_scale3x(self):
+		"""
+		Scale3x smooths diagonal edges.
+		"""
+		res = S.Scaler(S.MODE_SCALE3X).scale(EDGE, 9, 9)
+		self.assertEqual(res[3:6, 3:6].tolist(),
+				[[0, 0, 1], [0, 0, 0], [0, 0, 0]])
+
+		# Further scaling repeats the filtered pixels.
+		res = S.Scaler(S.MODE_SCALE3X).scale(EDGE, 18, 18)
+		self.assertEqual(res[6:12:2, 6:12:2].tolist(),
+				[[0, 0, 1], [0, 0, 0], [0, 0, 0]])
+
+	def test_scanlines(self):
+		"""
+		Scanlines darkens the last line of each source line.
+		"""
+		pixels = numpy.full( (2, 2), 0x7FFF, dtype=numpy.uint16 )
+
+		res = S.Scaler(S.MODE_SCANLINES).scale(pixels, 4, 6)
+		self.assertEqual(res[:, 0].tolist(),
+				[0x7FFF, 0x7FFF, 0x3DEF, 0x7FFF, 0x7FFF, 0x3DEF])
+
+		# Nothing is darkened if there's only one line per source line.
+		res = S.Scaler(S.MODE_SCANLINES).scale(pixels, 4, 2)
+		self.assertEqual(numpy.unique(res).tolist(), [0x7FFF])
+
+	def test_cache(self):
+		"""
+		Index maps are cached, up to a limit.
+		"""
+		pixels = numpy.zeros( (224, 256), dtype=numpy.uint16 )
+		scaler = S.Scaler(cache_size=2)
+
+		first = scaler.scale(pixels, 512, 448)
+		self.assertEqual(len(scaler._maps), 1)
+		scaler.scale(pixels, 512, 448)
+		self.assertEqual(len(scaler._maps), 1)
+
+		for size in (256, 512, 768):
+			scaler.scale(pixels, size, 224)
+		self.assertEqual(len(scaler._maps), 2)
+
+	def test_bad_mode(self):
+		"""
+		Unknown modes are rejected.
+		"""
+		self.assertRaises(ValueError, S.Scaler, "hq4x")
+
+
+class TestScreenshot(unittest.TestCase):
+
+	def test_screenshot(self):
+		"""
+		Screenshots are scaled to their on-screen size.
+		"""
+		pixels = numpy.zeros( (448, 512), dtype=numpy.uint16 )
+		pixels[:2, :2] = 0x001F
+
+		image = S.screenshot(Frame(pixels), scale=2)
+		self.assertEqual(image.size, (512, 448))
+		self.assertEqual(image.getpixel( (0, 0) ), (0, 0, 255))
+		self.assertEqual(image.getpixel( (2, 2) ), (0, 0, 0))
+
+		# The index maps are kept for the next screenshot.
+		scaler = S._screenshot_scalers[S.MODE_NEAREST]
+		maps = list(scaler._maps.values())
+		S.screenshot(Frame(pixels), scale=2)
+		self.assertTrue(S._screenshot_scalers[S.MODE_NEAREST] is scaler)
+		self.assertEqual([id(m) for m in scaler._maps.values()],
+				[id(m) for m in maps])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+import unittest
+import multiprocessing
+import os
+import os.path
+import numpy
+from snes.video import shm_output as S
+
+
+def _frame(pixels, pitch=1024):
+	height, width = pixels.shape
+	data = numpy.zeros( (height, pitch), dtype=numpy.uint16 )
+	data[:, :width] = pixels
+	return data.ravel()
+
+
+def _read_in_child(name, results):
+	reader = S.SharedFrameReader(name)
+	frame_number, frame = reader.read()
+	results.put( (frame_number, frame.pixels.tolist()) )
+	reader.close()
+
+
+class TestSharedFrames(unittest.TestCase):
+
+	def setUp(self):
+		self.name = "snes-test-%d" % (os.getpid(),)
+		self.writer = S.SharedFrameWriter(self.name)
+		self.reader = S.SharedFrameReader(self.name)
+
+	def tearDown(self):
+		self.reader.close()
+		self.writer.close()
+
+	def test_round_trip(self):
+		"""
+		The reader gets the most recently published frame.
+		"""
+		self.assertEqual(self.reader.read(), None)
+
+		for value in xrange(3):
+			pixels = numpy.full( (478, 512), value, dtype=numpy.uint16 )
+			self.writer.video_refresh(_frame(pixels), 512, 478, True, True,
+					True, 1024)
+
+		frame_number, frame = self.reader.read()
+		self.assertEqual(frame_number, 3)
+		self.assertEqual(frame.pixels.shape, (478, 512))
+		self.assertEqual(numpy.unique(frame.pixels).tolist(), [2])
+		self.assertTrue(frame.hires)
+		self.assertTrue(frame.interlace)
+		self.assertTrue(frame.overscan)
+
+		pixels = numpy.arange(224 * 256, dtype=numpy.uint16).reshape(224, 256)
+		self.writer.video_refresh(_frame(pixels), 256, 224, False, False,
+				False, 1024)
+
+		frame_number, frame = self.reader.read()
+		self.assertEqual(frame_number, 4)
+		self.assertEqual(frame.pixels.tolist(), pixels.tolist())
+		self.assertFalse(frame.hires)
+
+	def test_after(self):
+		"""
+		Frames that have already been read aren't copied again.
+		"""
+		pixels = numpy.ones( (224, 256), dtype=numpy.uint16 )
+		self.writer.video_refresh(_frame(pixels), 256, 224, False, False,
+				False, 1024)
+		self.assertEqual(self.reader.read(after=1), None)
+
+		# A repeated frame still gets a new frame number.
+		self.writer.video_refresh(None, 256, 224, False, False, False, 1024)
+		self.assertEqual(self.reader.frame_number, 2)
+
+		frame_number, frame = self.reader.read(after=1)
+		self.assertEqual(frame_number, 2)
+		self.assertEqual(frame.pixels.tolist(), pixels.tolist())
+
+	def test_torn_read(self):
+		"""
+		Frames aren't read while the writer is publishing one.
+		"""
+		pixels = numpy.ones( (224, 256), dtype=numpy.uint16 )
+		self.writer.video_refresh(_frame(pixels), 256, 224, False, False,
+				False, 1024)
+
+		self.writer._set_sequence(self.writer._sequence + 1)
+		self.assertEqual(self.reader.read(), None)
+
+		self.writer._set_sequence(self.writer._sequence + 1)
+		self.assertEqual(self.reader.read()[0], 1)
+
+	def test_other_process(self):
+		"""
+		Frames can be read by another process.
+		"""
+		pixels = numpy.arange(224 * 256, dtype=numpy.uint16).reshape(224, 256)
+		self.writer.video_refresh(_frame(pixels), 256, 224, False, False,
+				False, 1024)
+
+		results = multiprocessing.Queue()
+		child = multiprocessing.Process(target=_read_in_child,
+				args=(self.name, results))
+		child.start()
+		frame_number, child_pixels = results.get(timeout=10)
+		child.join()
+
+		self.assertEqual(frame_number, 1)
+		self.assertEqual(child_pixels, pixels.tolist())
+
+	def test_missing_segment(self):
+		"""
+		Missing segments are reported.
+		"""
+		self.assertRaises(S.SharedMemoryError, S.SharedFrameReader,
+				self.name + "-missing")
+		self.assertRaises(ValueError, S.SharedFrameReader, "a/b")
+
+	def test_close(self):
+		"""
+		Closing the writer removes the segment.
+		"""
+		path = self.writer.path
+		self.assertTrue(os.path.exists(path))
+		self.writer.close()
+		self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+	unittest.main()